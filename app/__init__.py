@@ -2,16 +2,23 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from config import Config
+from app.replica import RoutingSession
 
-db = SQLAlchemy()
+# Reads in @read_replica views go to the replica bind, everything else to the primary
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     
+    # Pool settings and connect-time PRAGMAs for the database (DB_PROFILE)
+    from app.db_profiles import engine_options, init_db_profile
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    
     # Initialize extensions
     db.init_app(app)
+    init_db_profile(app)
     login_manager.init_app(app)
     
     # Configure login
@@ -19,12 +26,53 @@ def create_app():
     login_manager.login_message = 'Please log in to access this page.'
     
     # Register blueprints
-    from app.routes import main
+    from app.routes import main, STATEMENT_BUDGETS
     app.register_blueprint(main)
     
-    # Create database tables
+    # Flag list pages whose query count grows with their row count
+    from app.query_budget import init_query_budget
+    init_query_budget(app, STATEMENT_BUDGETS)
+    
+    # Fingerprinted, precompressed static files from `flask build-assets`
+    from app.assets import init_assets
+    init_assets(app)
+    
+    # Cache for generated PDFs
+    from app.pdf_cache import init_pdf_cache
+    init_pdf_cache(app)
+    
+    # Background sender for the email outbox
+    from app.mailer import init_mailer
+    init_mailer(app)
+    
+    # Keep a local SQLite read replica in sync
+    from app.replica import init_replica
+    init_replica(app)
+    
+    # WAL archiver for point-in-time restores
+    from app.wal import init_wal
+    init_wal(app)
+    
+    # Dashboard changes pushed to /api/dashboard_stream
+    from app.dashboard_stream import init_dashboard_stream
+    init_dashboard_stream(app)
+    
+    # Maintenance commands (flask reconcile-balances, ...)
+    from app.cli import register_commands
+    register_commands(app)
+    
+    # Creating and upgrading the schema is `flask migrate`'s job; workers only check it
     with app.app_context():
-        db.create_all()
+        from app.migrations import prepare_schema, unapplied_revisions
+        if app.config['CREATE_SCHEMA_AT_BOOT']:
+            prepare_schema()
+        else:
+            pending = unapplied_revisions()
+            if pending is None:
+                app.logger.warning('Database schema not set up, run `flask migrate`')
+            elif pending:
+                app.logger.warning('%d schema revision(s) pending, run `flask migrate`: %s',
+                                   len(pending), ', '.join(pending))
     
     return app
 
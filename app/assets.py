@@ -0,0 +1,224 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # Brotli not installed: gzip variants only
+    brotli = None
+
+# Build output under the static folder, and the manifest mapping source names to it
+BUILD_DIRECTORY = 'dist'
+MANIFEST_NAME = 'assets.json'
+
+# Served under fixed names: the browser looks them up by URL
+UNHASHED = ('sw.js', 'manifest.json')
+
+COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.txt')
+
+# Hashed names never change content, so browsers may keep them for a year unasked
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Encodings in order of preference, with the suffix of their precompressed file
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# The block of sw.js that `flask build-assets` rewrites
+SERVICE_WORKER_BLOCK = re.compile(r'(// ASSETS:[^\n]*\n).*?(// END ASSETS)', re.S)
+
+# ========== MINIFYING ==========
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/''', re.S)
+
+def minify_css(source):
+    """Comments and spacing out; strings (data URIs included) are left as written"""
+    parts, text = [], ''
+    for match, between in _split(CSS_TOKENS, source):
+        if match is None:
+            text += between
+        elif match.group(1):
+            parts.extend([_squeeze_css(text), match.group(1)])
+            text = ''
+    parts.append(_squeeze_css(text))
+    return ''.join(parts).strip()
+
+def _squeeze_css(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{};,]) ?', r'\1', text)
+    # Only after the colon: before it, a space can be a descendant selector (`a :hover`)
+    text = re.sub(r': ', ':', text)
+    return text.replace(';}', '}')
+
+def _split(pattern, source):
+    """(None, text between matches) and (match, None) pairs, in order"""
+    position = 0
+    for match in pattern.finditer(source):
+        yield None, source[position:match.start()]
+        yield match, None
+        position = match.end()
+    yield None, source[position:]
+
+def minify_js(source):
+    """Indentation, blank lines and whole-line comments out, line by line.
+    
+    Line breaks stay, so automatic semicolon insertion reads the code as
+    before, and lines inside multi-line template literals are kept verbatim.
+    """
+    lines = []
+    in_template = False
+    for line in source.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('//'):
+                lines.append(stripped)
+        if len(re.findall(r'(?<!\\)`', line)) % 2:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+# ========== BUILD ==========
+def static_sources(static_folder):
+    """Static files to fingerprint, as paths relative to the static folder"""
+    for directory, subdirectories, files in os.walk(static_folder):
+        relative = os.path.relpath(directory, static_folder)
+        if relative == BUILD_DIRECTORY:
+            subdirectories[:] = []
+            continue
+        subdirectories.sort()
+        for name in sorted(files):
+            path = os.path.normpath(os.path.join(relative, name)).replace(os.sep, '/')
+            if path not in UNHASHED and not name.startswith('.'):
+                yield path
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as handle:
+        handle.write(content)
+    os.replace(f'{path}.tmp', path)
+
+def build_assets(static_folder, static_url_path='/static'):
+    """Minify, fingerprint and precompress the static files; returns the new manifest.
+    
+    Writes each file as dist/<dir>/<name>.<content hash><ext>, next to .br and
+    .gz variants for text files, then dist/sw.js with the asset version and
+    precache list filled in, and last dist/assets.json. Files from the
+    previous build are kept, for pages still open in browsers.
+    """
+    build = os.path.join(static_folder, BUILD_DIRECTORY)
+    files, encoded, sizes = {}, {}, {}
+    for path in static_sources(static_folder):
+        with open(os.path.join(static_folder, path), 'rb') as handle:
+            content = handle.read()
+        stem, extension = os.path.splitext(path)
+        minify = MINIFIERS.get(extension)
+        if minify:
+            content = minify(content.decode('utf-8')).encode('utf-8')
+        
+        hashed = f'{BUILD_DIRECTORY}/{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+        target = os.path.join(static_folder, hashed)
+        _write(target, content)
+        files[path] = hashed
+        sizes[path] = [len(content)]
+        
+        if extension in COMPRESSIBLE:
+            variants = {'gzip': gzip.compress(content, 9, mtime=0)}
+            if brotli is not None:
+                variants['br'] = brotli.compress(content, quality=11)
+            encoded[hashed] = []
+            for encoding, suffix in ENCODINGS:
+                if encoding in variants and len(variants[encoding]) < len(content):
+                    _write(target + suffix, variants[encoding])
+                    encoded[hashed].append(encoding)
+                    sizes[path].append(len(variants[encoding]))
+    
+    version = hashlib.sha256(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    precache = ['/'] + [f'{static_url_path}/{hashed}' for hashed in files.values()]
+    with open(os.path.join(static_folder, 'sw.js'), encoding='utf-8') as handle:
+        worker = handle.read()
+    worker = SERVICE_WORKER_BLOCK.sub(lambda match: match.group(1) + (
+        f"const CACHE_NAME = 'car-buddies-garagepro-{version}';\n"
+        f'const urlsToCache = {json.dumps(precache, indent=4)};\n'
+    ) + match.group(2), worker)
+    _write(os.path.join(build, 'sw.js'), worker.encode('utf-8'))
+    
+    previous = load_manifest(static_folder)
+    manifest = {'version': version, 'files': files, 'encoded': encoded, 'sizes': sizes}
+    _write(os.path.join(build, MANIFEST_NAME), json.dumps(manifest, indent=2).encode('utf-8'))
+    _prune_build(static_folder, manifest, previous)
+    return manifest
+
+def _prune_build(static_folder, manifest, previous):
+    """Delete build output that neither this build nor the one before refers to"""
+    keep = {'sw.js', MANIFEST_NAME}
+    for build in (manifest, previous or {'files': {}}):
+        for hashed in build['files'].values():
+            name = hashed[len(BUILD_DIRECTORY) + 1:]
+            keep.update(name + suffix for suffix in ('', '.gz', '.br'))
+    root = os.path.join(static_folder, BUILD_DIRECTORY)
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.relpath(path, root).replace(os.sep, '/') not in keep:
+                os.remove(path)
+
+def load_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, BUILD_DIRECTORY, MANIFEST_NAME)) as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return None
+
+# ========== SERVING ==========
+def init_assets(app):
+    """Point url_for('static') at the built assets and serve them precompressed.
+    
+    Without a build (or in debug mode, so edits show straight away) static
+    files are served under their plain names as before.
+    """
+    manifest = None if app.debug else load_manifest(app.static_folder)
+    app.add_url_rule('/sw.js', 'service_worker', lambda: _service_worker(app, manifest))
+    if manifest is None:
+        return
+    app.extensions['assets'] = manifest
+    files = manifest['files']
+    encoded = manifest['encoded']
+    hashed_names = set(files.values())
+    
+    @app.url_defaults
+    def _hashed_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in files:
+            values['filename'] = files[values['filename']]
+    
+    send_static_file = app.view_functions['static']
+    
+    def static(filename):
+        if filename not in hashed_names:
+            return send_static_file(filename=filename)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        available = encoded.get(filename, ())
+        encoding, suffix = next(((encoding, suffix) for encoding, suffix in ENCODINGS
+                                 if encoding in available and request.accept_encodings[encoding]), (None, ''))
+        response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype,
+                                       max_age=IMMUTABLE_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            del response.headers['Content-Disposition']  # names the .br/.gz file
+        if available:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+    
+    app.view_functions['static'] = static
+
+def _service_worker(app, manifest):
+    """sw.js from the site root so it controls every page; the built copy once there is one"""
+    directory = os.path.join(app.static_folder, BUILD_DIRECTORY) if manifest else app.static_folder
+    response = send_from_directory(directory, 'sw.js', mimetype='text/javascript', max_age=0)
+    response.cache_control.no_cache = True
+    return response
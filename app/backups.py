@@ -0,0 +1,419 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from app import db
+from app.bulk_pdfs import ZipSink
+
+BACKUP_TYPES = ('database', 'full')
+
+def database_path():
+    """Path of the live SQLite database file"""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise ValueError('Online backups need a file-based SQLite database')
+    return url.database
+
+def backup_directory():
+    directory = current_app.config.get('BACKUP_DIR') or os.path.join(current_app.instance_path, 'backups')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def integrity_check(path):
+    """PRAGMA integrity_check on a database file; 'ok' when it is sound"""
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return '; '.join(row[0] for row in connection.execute('PRAGMA integrity_check'))
+    finally:
+        connection.close()
+
+class BackupRun:
+    """Progress of one backup, readable from the progress endpoint while it runs"""
+    
+    def __init__(self, name, backup_type, include_attachments):
+        self.name = name
+        self.backup_type = backup_type
+        self.include_attachments = include_attachments
+        self.pages_total = 0
+        self.pages_done = 0
+        self.restarts = 0
+        self.stage = 'queued'  # queued, copying, checking, packing, done, failed
+        self.error = None
+        self.manifest = None
+    
+    @property
+    def finished(self):
+        return self.stage in ('done', 'failed')
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'type': self.backup_type,
+            'stage': self.stage,
+            'pages_total': self.pages_total,
+            'pages_done': self.pages_done,
+            'restarts': self.restarts,
+            'finished': self.finished,
+            'error': self.error,
+            'manifest': self.manifest,
+        }
+
+class _TooManyRestarts(Exception):
+    pass
+
+def copy_database(source_path, target_path, run, pages_per_step, step_sleep, max_restarts):
+    """Copy a live database with the sqlite3 backup API, a few pages at a time.
+    
+    The source is only read-locked during each step and the thread sleeps
+    between steps, so writers in the web workers are never held up for the
+    whole copy. SQLite restarts the copy itself if another connection writes
+    in the meantime, so the result is always a consistent snapshot. After
+    `max_restarts` of those, the rest is copied in one step so a busy
+    database still gets backed up; writers then wait on busy_timeout.
+    """
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    last_remaining = [None]
+    
+    def progress(status, remaining, total):
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            run.restarts += 1
+            if run.restarts > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining[0] = remaining
+        run.pages_total = total
+        run.pages_done = total - remaining
+        if remaining:
+            time.sleep(step_sleep)
+    
+    try:
+        try:
+            source.backup(target, pages=pages_per_step, progress=progress)
+        except _TooManyRestarts:
+            source.backup(target, pages=-1)
+            run.pages_done = run.pages_total
+    finally:
+        target.close()
+        source.close()
+
+def _attachment_files(root_path):
+    attachments_dir = os.path.join(root_path, 'static', 'attachments')
+    for root, dirs, files in os.walk(attachments_dir):
+        for file in files:
+            file_path = os.path.join(root, file)
+            yield file_path, os.path.relpath(file_path, root_path)
+
+def run_backup(run):
+    """Take the backup described by `run` and write its manifest next to it"""
+    config = current_app.config
+    directory = backup_directory()
+    snapshot = os.path.join(directory, f'{run.name}.db.tmp')
+    started = time.monotonic()
+    try:
+        run.stage = 'copying'
+        source_path = database_path()
+        copy_database(source_path, snapshot, run, config['BACKUP_PAGES_PER_STEP'], config['BACKUP_STEP_SLEEP'],
+                      config['BACKUP_MAX_RESTARTS'])
+        
+        run.stage = 'checking'
+        check = integrity_check(snapshot)
+        if check != 'ok':
+            raise RuntimeError(f'Integrity check failed on the copy: {check}')
+        manifest = {
+            'name': run.name,
+            'type': run.backup_type,
+            'created_at': datetime.utcnow().isoformat(timespec='microseconds') + 'Z',
+            'source': os.path.basename(source_path),
+            'pages': run.pages_total,
+            'restarts': run.restarts,
+            'integrity_check': check,
+            'database_sha256': file_checksum(snapshot),
+            'database_bytes': os.path.getsize(snapshot),
+        }
+        
+        if run.backup_type == 'full':
+            run.stage = 'packing'
+            attachments = list(_attachment_files(current_app.root_path)) if run.include_attachments else []
+            store = BackupStore(os.path.join(directory, 'store'), config['BACKUP_CHUNK_KB'] * 1024,
+                                read_ahead=config['BACKUP_COMPRESS_WORKERS'] * 2)
+            previous = latest_manifest('full')
+            with ThreadPoolExecutor(max_workers=config['BACKUP_COMPRESS_WORKERS']) as executor:
+                files = [store.add_file(snapshot, 'garage.db', executor)]
+                files += [store.add_file(file_path, arcname, executor, previous=previous)
+                          for file_path, arcname in attachments]
+            os.remove(snapshot)
+            manifest.update({
+                'file': f'{run.name}.zip',
+                'sha256': manifest['database_sha256'],
+                'bytes': sum(entry['size'] for entry in files),
+                'stored_bytes': store.added_bytes,
+                'attachments': len(attachments),
+                'files': files,
+            })
+        else:
+            backup_file = os.path.join(directory, f'{run.name}.db')
+            os.replace(snapshot, backup_file)
+            manifest.update({
+                'file': os.path.basename(backup_file),
+                'sha256': file_checksum(backup_file),
+                'bytes': os.path.getsize(backup_file),
+            })
+        
+        manifest['seconds'] = round(time.monotonic() - started, 3)
+        write_manifest(manifest)
+        run.manifest = summary(manifest)
+        run.stage = 'done'
+    except Exception as e:
+        run.error = f'{type(e).__name__}: {e}'
+        run.stage = 'failed'
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+        return run
+    
+    try:
+        prune_backups()
+    except Exception:
+        current_app.logger.exception('Pruning backups after %s failed', run.name)
+    return run
+
+# ========== MANIFESTS ==========
+# One <name>.json per backup in the backup directory. Full backups list every
+# file as the chunks it is stored under, so they double as the snapshot index.
+def write_manifest(manifest):
+    path = os.path.join(backup_directory(), f"{manifest['name']}.json")
+    with open(f'{path}.tmp', 'w') as handle:
+        json.dump(manifest, handle, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+def summary(manifest):
+    """A manifest without its file list, for pages and progress responses"""
+    return {key: value for key, value in manifest.items() if key != 'files'}
+
+def all_manifests():
+    """Every backup's manifest, newest first"""
+    manifests = []
+    for entry in os.scandir(backup_directory()):
+        if entry.name.endswith('.json'):
+            with open(entry.path) as handle:
+                manifests.append(json.load(handle))
+    return sorted(manifests, key=lambda manifest: manifest['created_at'], reverse=True)
+
+def latest_manifest(backup_type):
+    return next((manifest for manifest in all_manifests() if manifest['type'] == backup_type), None)
+
+def list_backups(limit=20):
+    """Summaries of the newest backups, newest first"""
+    return [summary(manifest) for manifest in all_manifests()[:limit]]
+
+def find_manifest(name):
+    path = os.path.join(backup_directory(), f'{os.path.basename(name)}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+# ========== CONTENT-ADDRESSED STORE ==========
+class BackupStore:
+    """Deduplicated, compressed chunks of backed-up files, named by their SHA-256.
+    
+    Files are cut into fixed-size chunks (a multiple of the SQLite page size,
+    so unchanged pages of the database land in unchanged chunks) and each
+    chunk is zlib-compressed into objects/<2 hex>/<sha256>.z once. A snapshot
+    that changed little therefore adds little. Compression runs on a thread
+    pool; zlib releases the GIL, so the chunks really compress in parallel.
+    """
+    
+    def __init__(self, root, chunk_bytes, read_ahead=8):
+        self.root = root
+        self.chunk_bytes = chunk_bytes
+        self.read_ahead = read_ahead
+        self.added_bytes = 0
+        self._lock = threading.Lock()
+    
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], f'{digest}.z')
+    
+    def _touch(self, digest):
+        """Mark an existing object as just used, so collect_garbage's grace period covers it"""
+        try:
+            os.utime(self.object_path(digest))
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def _put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not self._touch(digest):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = zlib.compress(data, 6)
+            temporary = f'{path}.{threading.get_ident()}.tmp'
+            with open(temporary, 'wb') as handle:
+                handle.write(compressed)
+            os.replace(temporary, path)
+            with self._lock:
+                self.added_bytes += len(compressed)
+        return digest
+    
+    def add_file(self, path, name, executor, previous=None):
+        """Store a file's chunks and return its manifest entry.
+        
+        A file whose size and mtime match its entry in the `previous`
+        manifest reuses that entry without being read again.
+        """
+        stat = os.stat(path)
+        if previous:
+            entry = next((entry for entry in previous['files'] if entry['path'] == name), None)
+            if (entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+                    and all(self._touch(digest) for digest in entry['chunks'])):
+                return entry
+        
+        futures = []
+        digest = hashlib.sha256()
+        with open(path, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(self.chunk_bytes), b''):
+                digest.update(chunk)
+                # Read ahead only a few chunks per worker, so a large file is never all in memory
+                if len(futures) >= self.read_ahead:
+                    futures[-self.read_ahead].result()
+                futures.append(executor.submit(self._put, chunk))
+        return {
+            'path': name,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': digest.hexdigest(),
+            'chunks': [future.result() for future in futures],
+        }
+    
+    def read_chunks(self, entry):
+        for digest in entry['chunks']:
+            with open(self.object_path(digest), 'rb') as handle:
+                yield zlib.decompress(handle.read())
+    
+    def collect_garbage(self, manifests, grace_seconds=3600):
+        """Delete objects no remaining snapshot refers to; returns bytes freed.
+        
+        Objects written or reused in the last `grace_seconds` stay, as they
+        may belong to a backup still in progress that has no manifest yet
+        (reused objects are touched by _put and add_file).
+        """
+        referenced = {digest for manifest in manifests for entry in manifest.get('files', ())
+                      for digest in entry['chunks']}
+        freed = 0
+        cutoff = time.time() - grace_seconds
+        objects = os.path.join(self.root, 'objects')
+        if not os.path.isdir(objects):
+            return freed
+        for bucket in os.scandir(objects):
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith('.z') and entry.name[:-2] not in referenced and entry.stat().st_mtime < cutoff:
+                    freed += entry.stat().st_size
+                    os.remove(entry.path)
+        return freed
+
+def stream_snapshot_zip(manifest):
+    """Yield a full backup as a ZIP, rebuilt from the store as it is sent"""
+    store = BackupStore(os.path.join(backup_directory(), 'store'), 0)
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for entry in manifest['files']:
+            with archive.open(entry['path'], 'w') as member:
+                for chunk in store.read_chunks(entry):
+                    member.write(chunk)
+                    yield sink.drain()
+        archive.writestr('manifest.json', json.dumps(summary(manifest), indent=2))
+    yield sink.drain()
+
+# ========== RETENTION ==========
+def retained(manifests, daily, weekly, monthly):
+    """Names kept by grandfather-father-son retention.
+    
+    The newest backup of each of the last `daily` days, `weekly` ISO weeks
+    and `monthly` months is kept; everything else can go.
+    """
+    keep = set()
+    for tier, count in (('%Y-%m-%d', daily), ('%G-W%V', weekly), ('%Y-%m', monthly)):
+        periods = {}
+        for manifest in manifests:
+            created = datetime.fromisoformat(manifest['created_at'].rstrip('Z'))
+            period = created.strftime(tier)
+            # manifests are newest first, so the first seen is the period's newest
+            if period not in periods and len(periods) < count:
+                periods[period] = manifest['name']
+        keep.update(periods.values())
+    return keep
+
+def prune_backups(dry_run=False):
+    """Apply retention to each backup type and drop chunks nothing refers to.
+    
+    Returns (removed backup names, bytes freed from the store).
+    """
+    config = current_app.config
+    directory = backup_directory()
+    manifests = all_manifests()
+    removed = []
+    for backup_type in BACKUP_TYPES:
+        of_type = [manifest for manifest in manifests if manifest['type'] == backup_type]
+        keep = retained(of_type, config['BACKUP_KEEP_DAILY'], config['BACKUP_KEEP_WEEKLY'], config['BACKUP_KEEP_MONTHLY'])
+        removed += [manifest['name'] for manifest in of_type if manifest['name'] not in keep]
+    if dry_run:
+        return removed, 0
+    
+    for name in removed:
+        for suffix in ('.json', '.db'):
+            path = os.path.join(directory, f'{name}{suffix}')
+            if os.path.exists(path):
+                os.remove(path)
+    remaining = [manifest for manifest in manifests if manifest['name'] not in removed]
+    freed = BackupStore(os.path.join(directory, 'store'), 0).collect_garbage(remaining) if removed else 0
+    return removed, freed
+
+# ========== BACKGROUND RUNS ==========
+# Backups started by this process, so /backup/progress/<name> can report on them
+_runs = {}
+_runs_lock = threading.Lock()
+
+def new_backup_name(backup_type):
+    prefix = 'full_backup' if backup_type == 'full' else 'database_backup'
+    return f'{prefix}_{datetime.now():%Y%m%d_%H%M%S}_{os.urandom(2).hex()}'
+
+def get_backup_run(name):
+    with _runs_lock:
+        return _runs.get(name)
+
+def start_backup(backup_type='database', include_attachments=True):
+    """Start a backup on a background thread and return its run"""
+    if backup_type not in BACKUP_TYPES:
+        raise ValueError(f'Unsupported backup type: {backup_type}')
+    database_path()
+    
+    run = BackupRun(new_backup_name(backup_type), backup_type, include_attachments)
+    with _runs_lock:
+        for name in [name for name, old in _runs.items() if old.finished]:
+            del _runs[name]
+        _runs[run.name] = run
+    
+    app = current_app._get_current_object()
+    
+    def work():
+        with app.app_context():
+            run_backup(run)
+            if run.error:
+                app.logger.error('Backup %s failed: %s', run.name, run.error)
+    
+    threading.Thread(target=work, name=f'backup-{run.name}', daemon=True).start()
+    return run
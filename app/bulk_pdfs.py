@@ -0,0 +1,170 @@
+import calendar
+import threading
+import time
+import zipfile
+from datetime import date
+from app import db
+from app.models import CarOwner, ServiceJob
+from app.utils import owners_owing, invoice_document, statement_document, pdf_bytes
+
+# kind -> what a month-end run renders
+BULK_KINDS = {
+    'invoices': 'Invoices for jobs completed in the month',
+    'statements': 'Statements for owners with an outstanding balance',
+}
+
+def month_range(month):
+    """First and last day of a 'YYYY-MM' month"""
+    year, month_number = (int(part) for part in month.split('-'))
+    return date(year, month_number, 1), date(year, month_number, calendar.monthrange(year, month_number)[1])
+
+def select_documents(kind, start, end):
+    """Ids of the jobs or owners a run covers"""
+    if kind == 'invoices':
+        query = db.session.query(ServiceJob.id).filter(
+            ServiceJob.status == 'completed',
+            ServiceJob.date_out >= start,
+            ServiceJob.date_out <= end
+        ).order_by(ServiceJob.date_out, ServiceJob.id)
+    else:
+        query = owners_owing().with_entities(CarOwner.id)
+    return [row.id for row in query]
+
+# ========== WORKERS ==========
+# Each worker process builds its own app (and so its own engine and
+# connections) once, then renders documents inside that app's context.
+_worker_app = None
+
+def _init_worker(database_uri):
+    global _worker_app
+    from config import Config
+    from app import create_app
+    Config.SQLALCHEMY_DATABASE_URI = database_uri
+    _worker_app = create_app()
+
+def _render(kind, entity_id, start, end):
+    with _worker_app.app_context():
+        try:
+            if kind == 'invoices':
+                job = db.session.get(ServiceJob, entity_id)
+                return f'invoice_{job.id:06d}_{job.car.license_plate.replace(" ", "")}.pdf', pdf_bytes(invoice_document(job))
+            owner = db.session.get(CarOwner, entity_id)
+            return f'statement_{owner.id:06d}.pdf', pdf_bytes(statement_document(owner, start, end))
+        finally:
+            db.session.remove()
+
+# ========== RUNS ==========
+class BulkRun:
+    """Progress of one month-end run, readable while its ZIP is still streaming"""
+    
+    def __init__(self, run_id, kind, start, end):
+        self.run_id = run_id
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.total = 0
+        self.done = 0
+        self.failures = []
+        self.finished = False
+        self.cancelled = False
+        self.started_at = time.time()
+    
+    def to_dict(self):
+        return {
+            'run_id': self.run_id,
+            'kind': self.kind,
+            'total': self.total,
+            'done': self.done,
+            'failed': len(self.failures),
+            'failures': [{'id': entity_id, 'error': error} for entity_id, error in self.failures],
+            'finished': self.finished,
+            'cancelled': self.cancelled,
+        }
+
+# Runs started by this process, so /reports/bulk/<run_id>/progress can report on them
+_runs = {}
+_runs_lock = threading.Lock()
+
+def register_run(run):
+    with _runs_lock:
+        # Forget finished runs after an hour
+        cutoff = time.time() - 3600
+        for run_id in [run_id for run_id, old in _runs.items() if old.finished and old.started_at < cutoff]:
+            del _runs[run_id]
+        _runs[run.run_id] = run
+    return run
+
+def get_run(run_id):
+    with _runs_lock:
+        return _runs.get(run_id)
+
+class ZipSink:
+    """Write-only file object for zipfile that hands written bytes to the response"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def generate_bulk_zip(run, database_uri, workers=None):
+    """Render the run's documents on a process pool and yield the ZIP as it is built.
+    
+    Documents are added as they finish. One that fails to render is recorded
+    in the run and listed in errors.txt inside the ZIP; the rest still ship.
+    If the client goes away the run is marked cancelled and documents not yet
+    started are dropped rather than rendered for nobody.
+    """
+    # Only month-end runs need the process pool machinery, so it is not loaded at boot
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    ids = select_documents(run.kind, run.start, run.end)
+    run.total = len(ids)
+    db.session.remove()
+    yield b''
+    
+    sink = ZipSink()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        if ids:
+            context = multiprocessing.get_context('spawn')
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                           initializer=_init_worker, initargs=(database_uri,))
+            try:
+                futures = {executor.submit(_render, run.kind, entity_id, run.start, run.end): entity_id
+                           for entity_id in ids}
+                for future in as_completed(futures):
+                    try:
+                        name, data = future.result()
+                        # PDFs are already compressed internally
+                        archive.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+                    except Exception as e:
+                        run.failures.append((futures[future], f'{type(e).__name__}: {e}'))
+                    run.done += 1
+                    yield sink.drain()
+            finally:
+                # Waiting here (as the with-block would) holds the request thread until
+                # every document has rendered, even after the client has gone
+                executor.shutdown(wait=run.done == run.total, cancel_futures=True)
+        
+        if run.failures:
+            archive.writestr('errors.txt', ''.join(
+                f'{run.kind[:-1]} {entity_id}: {error}\n' for entity_id, error in run.failures))
+        archive.close()
+        yield sink.drain()
+    except GeneratorExit:
+        # Client disconnected: stream_with_context closes the generator
+        run.cancelled = True
+        raise
+    finally:
+        run.finished = True
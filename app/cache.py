@@ -0,0 +1,93 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+class SnapshotCache:
+    """Process-local key/value cache with a TTL per key.
+    
+    Keys can be tied to model classes with watch(); a committed session that
+    inserted, updated or deleted rows of a watched model drops those keys.
+    The TTL only bounds staleness from writes made by other worker processes.
+    """
+    
+    def __init__(self):
+        self._entries = {}
+        self._watchers = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidate(), so a value computed across one is not stored
+        self._generation = 0
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+    
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+    
+    def get_or_compute(self, key, compute, ttl):
+        value = self.get(key)
+        if value is None:
+            with self._lock:
+                generation = self._generation
+            value = compute()
+            with self._lock:
+                # A commit invalidated while computing: the value may predate it
+                if self._generation == generation:
+                    self._entries[key] = (time.monotonic() + ttl, value)
+        return value
+    
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            if not keys:
+                self._entries.clear()
+            for key in keys:
+                self._entries.pop(key, None)
+    
+    def watch(self, models, *keys):
+        """Drop `keys` whenever rows of any of `models` are committed"""
+        for model in models:
+            self._watchers.setdefault(model, set()).update(keys)
+    
+    def keys_for(self, models):
+        keys = set()
+        for model in models:
+            keys.update(self._watchers.get(model, ()))
+        return keys
+
+stats_cache = SnapshotCache()
+
+# ========== SESSION HOOKS ==========
+def _changed_models(session):
+    return session.info.setdefault('changed_models', set())
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changed = _changed_models(session)
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed.add(type(instance))
+
+@event.listens_for(Session, 'after_bulk_update')
+def _collect_bulk_update(update_context):
+    _changed_models(update_context.session).add(update_context.mapper.class_)
+
+@event.listens_for(Session, 'after_bulk_delete')
+def _collect_bulk_delete(delete_context):
+    _changed_models(delete_context.session).add(delete_context.mapper.class_)
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    changed = session.info.pop('changed_models', None)
+    if changed:
+        keys = stats_cache.keys_for(changed)
+        if keys:
+            stats_cache.invalidate(*keys)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changed_models', None)
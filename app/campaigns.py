@@ -0,0 +1,137 @@
+import threading
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func, case
+from app import db
+from app.models import CarOwner, OwnerBalance, ReminderCampaign, CampaignRecipient, EmailOutbox
+from app.mailer import enqueue_email
+from app.utils import owners_owing, statement_document, pdf_bytes
+
+# Campaign emails queue behind quotations and invoices
+CAMPAIGN_PRIORITY = 1
+
+def create_campaign(minimum_balance, statement_start, statement_end):
+    """Snapshot the owners owing more than `minimum_balance` into a new campaign"""
+    campaign = ReminderCampaign(minimum_balance=minimum_balance,
+                                statement_start=statement_start, statement_end=statement_end)
+    db.session.add(campaign)
+    db.session.flush()
+    
+    owners = owners_owing(minimum_balance).with_entities(CarOwner.id, CarOwner.email, OwnerBalance.balance)
+    rows = [
+        {
+            'campaign_id': campaign.id,
+            'owner_id': owner.id,
+            'email': owner.email,
+            'balance': owner.balance,
+            'error': None if owner.email else 'No email address on file',
+        }
+        for owner in owners
+    ]
+    if rows:
+        db.session.execute(CampaignRecipient.__table__.insert(), rows)
+    db.session.commit()
+    return campaign
+
+def reminder_email(owner, balance, campaign):
+    config = current_app.config
+    subject = f"Payment reminder - {config['GARAGE_NAME']}"
+    body = f"""
+        <html>
+        <body>
+            <h2>💵 Payment reminder from {config['GARAGE_NAME']}</h2>
+            <p>Dear {owner.name},</p>
+            <p>Our records show an outstanding balance of <strong>R {balance:,.2f}</strong> on your account.</p>
+            <p>Your statement for {campaign.statement_start:%d %b %Y} to {campaign.statement_end:%d %b %Y} is attached.
+            If you have already paid, please ignore this reminder.</p>
+            <br>
+            <p>Thank you for choosing {config['GARAGE_NAME']}!</p>
+            <p><strong>{config['GARAGE_NAME']}</strong><br>
+            {config['GARAGE_ADDRESS']}<br>
+            {config['GARAGE_PHONE']}</p>
+        </body>
+        </html>
+        """
+    return subject, body
+
+def prepare_campaign(campaign_id, progress=None):
+    """Render each recipient's statement and queue their reminder, a batch per commit.
+    
+    Statements are rendered here, ahead of the sender, so the SMTP session is
+    never kept waiting on a PDF. Recipients already queued are skipped, which
+    makes an interrupted campaign safe to prepare again.
+    """
+    batch_size = current_app.config['CAMPAIGN_BATCH_SIZE']
+    campaign = db.session.get(ReminderCampaign, campaign_id)
+    while True:
+        batch = campaign.recipients.filter(
+            CampaignRecipient.email_outbox_id.is_(None), CampaignRecipient.error.is_(None)
+        ).order_by(CampaignRecipient.id).limit(batch_size).all()
+        if not batch:
+            break
+        
+        for recipient in batch:
+            owner = recipient.owner
+            try:
+                document = statement_document(owner, campaign.statement_start, campaign.statement_end)
+                subject, body = reminder_email(owner, recipient.balance, campaign)
+                recipient.email_outbox = enqueue_email(
+                    recipient.email, subject, body, pdf_bytes(document),
+                    f'statement_{campaign.statement_end:%Y%m%d}.pdf', priority=CAMPAIGN_PRIORITY)
+            except Exception as e:
+                recipient.error = f'{type(e).__name__}: {e}'
+        db.session.commit()
+        if progress:
+            progress(len(batch))
+    
+    campaign.status = 'queued'
+    campaign.prepared_at = datetime.utcnow()
+    db.session.commit()
+    return campaign
+
+# What happened to a recipient: skipped, pending (not queued yet) or their outbox status
+CAMPAIGN_OUTCOMES = ('pending', 'queued', 'sending', 'sent', 'failed', 'skipped')
+
+def campaign_results(campaign_ids):
+    """{campaign id: {outcome: recipient count}} for several campaigns in one query"""
+    outcome = func.coalesce(EmailOutbox.status, case((CampaignRecipient.error.is_(None), 'pending'), else_='skipped'))
+    rows = db.session.query(CampaignRecipient.campaign_id, outcome, func.count(CampaignRecipient.id)).outerjoin(
+        EmailOutbox, CampaignRecipient.email_outbox_id == EmailOutbox.id
+    ).filter(CampaignRecipient.campaign_id.in_(campaign_ids)).group_by(CampaignRecipient.campaign_id, outcome)
+    
+    results = {campaign_id: {} for campaign_id in campaign_ids}
+    for campaign_id, name, count in rows:
+        results[campaign_id][name] = count
+    return results
+
+# ========== BACKGROUND PREPARATION ==========
+# Campaigns being prepared by this process, so the page does not offer to resume them
+_preparing = set()
+_preparing_lock = threading.Lock()
+
+def is_preparing(campaign_id):
+    with _preparing_lock:
+        return campaign_id in _preparing
+
+def start_preparing(campaign_id):
+    """Prepare a campaign on a background thread; False if this process already is"""
+    with _preparing_lock:
+        if campaign_id in _preparing:
+            return False
+        _preparing.add(campaign_id)
+    
+    app = current_app._get_current_object()
+    
+    def run():
+        with app.app_context():
+            try:
+                prepare_campaign(campaign_id)
+            except Exception:
+                app.logger.exception('Preparing reminder campaign %d failed', campaign_id)
+            finally:
+                db.session.remove()
+                with _preparing_lock:
+                    _preparing.discard(campaign_id)
+    
+    threading.Thread(target=run, name=f'campaign-{campaign_id}', daemon=True).start()
+    return True
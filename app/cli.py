@@ -0,0 +1,318 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+import click
+from sqlalchemy import func
+from app import db
+from app.models import rebuild_owner_balances, rebuild_job_totals, EmailOutbox, ReminderCampaign, CampaignRecipient
+from app.search import rebuild_search_index
+from app.bulk_pdfs import BULK_KINDS, BulkRun, month_range, generate_bulk_zip
+from app.migrations import REVISIONS, pending_revisions, prepare_schema
+from app.db_profiles import DB_PROFILES, is_sqlite, benchmark_profile
+from app import mailer
+from app.backups import BACKUP_TYPES, BackupRun, new_backup_name, run_backup, prune_backups
+from app.wal import WalArchiver, recovery_window, restore_to
+from app.assets import brotli, build_assets
+from app.campaigns import CAMPAIGN_OUTCOMES, create_campaign, prepare_campaign, campaign_results
+from app.routes import jobs_query, payments_query
+from app.statements import statement_lines
+from app.utils import owners_owing
+
+# Modules kept off the startup path (see app/pdfs.py and the lazy imports in
+# mailer.py and bulk_pdfs.py)
+HEAVY_MODULES = ('fpdf', 'PIL', 'smtplib', 'multiprocessing')
+
+# Run in a fresh interpreter by `flask benchmark-startup`; prints one JSON line
+STARTUP_PROBE = f'''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({{'import': imported - started, 'create_app': created - imported, 'first_request': served - created,
+                  'heavy_modules': [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))
+'''
+
+def hot_statements():
+    """The list pages' and sender's hot queries, built by the same helpers they use"""
+    return {
+        'payments list': payments_query().limit(51).statement,
+        'jobs by status': jobs_query('in_progress').limit(51).statement,
+        'owner statement': statement_lines(1)[0].limit(51).statement,
+        'outstanding balances': owners_owing().statement,
+        'due emails': mailer.due_emails(datetime.utcnow()).limit(20).statement,
+    }
+
+def register_commands(app):
+    """Attach the maintenance commands to `flask`"""
+    
+    @app.cli.command('reconcile-balances')
+    @click.option('--check', is_flag=True, help='Only report drift, do not rewrite the ledger.')
+    def reconcile_balances(check):
+        """Rebuild the owner_balance ledger from the transaction table."""
+        drifted = rebuild_owner_balances(apply=not check)
+        
+        for owner_id, stored, actual in drifted:
+            click.echo(f'Owner {owner_id}: ledger R{stored:,.2f}, transactions R{actual:,.2f}')
+        
+        if check:
+            click.echo(f'{len(drifted)} owner balance(s) out of step.')
+            if drifted:
+                raise SystemExit(1)
+        else:
+            click.echo(f'Ledger rebuilt, {len(drifted)} owner balance(s) corrected.')
+    
+    @app.cli.command('reconcile-job-totals')
+    @click.option('--check', is_flag=True, help='Only report drift, do not rewrite the stored totals.')
+    def reconcile_job_totals(check):
+        """Recompute stored service job totals from their service items."""
+        drifted = rebuild_job_totals(apply=not check)
+        
+        for job_id, stored, actual in drifted:
+            click.echo(f'Job #{job_id}: stored R{stored:,.2f}, items R{actual:,.2f}')
+        
+        if check:
+            click.echo(f'{len(drifted)} job total(s) out of step.')
+            if drifted:
+                raise SystemExit(1)
+        else:
+            click.echo(f'Job totals rebuilt, {len(drifted)} job(s) corrected.')
+    
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Re-index every car and owner for /search and /api/search."""
+        count = rebuild_search_index()
+        click.echo(f'Search index rebuilt with {count} document(s).')
+    
+    @app.cli.command('migrate')
+    @click.option('--status', is_flag=True, help='Only list revisions and whether they are applied.')
+    def migrate(status):
+        """Create the schema on a new database, or apply pending revisions from app/migrations.py."""
+        if status:
+            pending = {revision for revision, _, _ in pending_revisions()}
+            for revision, description, _ in REVISIONS:
+                click.echo(f'[{"pending" if revision in pending else "applied"}] {revision}: {description}')
+            return
+        
+        applied = prepare_schema()
+        for revision in applied:
+            click.echo(f'Applied {revision}')
+        click.echo(f'Schema up to date, {len(applied)} revision(s) applied.')
+    
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """Minify, fingerprint and precompress the static files for url_for('static')."""
+        manifest = build_assets(app.static_folder, app.static_url_path)
+        for path, sizes in manifest['sizes'].items():
+            compressed = ' -> '.join(f'{size:,}' for size in sizes[1:])
+            click.echo(f"{path:<32} {manifest['files'][path]:<44} {sizes[0]:>8,} B" + (f'  ({compressed} compressed)' if compressed else ''))
+        if brotli is None:
+            click.echo('Brotli is not installed: wrote gzip variants only.')
+        click.echo(f"Asset version {manifest['version']}; restart the workers to serve it.")
+    
+    @app.cli.command('benchmark-db-profiles')
+    @click.option('--repeat', default=200, show_default=True, help='Runs of each query, and commits per writer.')
+    @click.option('--writers', default=4, show_default=True, help='Concurrent writers in the contention run (SQLite).')
+    @click.option('--profile', 'profiles', multiple=True, type=click.Choice(sorted(DB_PROFILES)),
+                  help='Profiles to compare (default: all).')
+    def benchmark_db_profiles(repeat, writers, profiles):
+        """Compare engine profiles on the hot queries, and for SQLite on commits, using a copy of the database."""
+        statements = hot_statements()
+        sqlite = is_sqlite(app.config['SQLALCHEMY_DATABASE_URI'])
+        results = [benchmark_profile(app.config, name, statements, repeat, writers) for name in profiles or DB_PROFILES]
+        
+        click.echo(f"{'query':<24}" + ''.join(f"{result['profile']:>12}" for result in results))
+        for name in statements:
+            click.echo(f'{name:<24}' + ''.join(f"{result['reads'][name] * 1e6:>10.0f}us" for result in results))
+        click.echo(f"{'all hot queries':<24}" + ''.join(f"{sum(result['reads'].values()) * 1e3:>10.2f}ms" for result in results))
+        if sqlite:
+            click.echo(f"{'commit':<24}" + ''.join(f"{result['commit'] * 1e3:>10.2f}ms" for result in results))
+            click.echo(f"{f'{writers} writers, commits/s':<24}" + ''.join(
+                f"{result['concurrent_commits_per_second']:>12,.0f}" for result in results))
+            click.echo(f"{'locked errors':<24}" + ''.join(f"{result['locked_errors']:>12}" for result in results))
+        click.echo(f"Active profile: {app.config['DB_PROFILE']}")
+    
+    @app.cli.command('benchmark-startup')
+    @click.option('--runs', default=5, show_default=True, help='Fresh interpreters to start.')
+    def benchmark_startup(runs):
+        """Time importing the app, create_app() and the first request in fresh interpreters."""
+        # Background threads stay off so the probe never sends mail or copies the database
+        env = dict(os.environ, EMAIL_WORKER='0', WAL_ARCHIVE='0', REPLICA_SYNC_SECONDS='0')
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_PROBE], env=env, cwd=os.path.dirname(app.root_path),
+                                    capture_output=True, text=True, check=True).stdout
+            samples.append(json.loads(output.splitlines()[-1]))
+        
+        for name in ('import', 'create_app', 'first_request'):
+            timings = sorted(sample[name] for sample in samples)
+            click.echo(f'{name:<14} median {statistics.median(timings) * 1000:7.1f} ms   '
+                       f'min {timings[0] * 1000:7.1f} ms   max {timings[-1] * 1000:7.1f} ms')
+        click.echo('Loaded after the first request: ' + (', '.join(samples[-1]['heavy_modules']) or 'none of ' + ', '.join(HEAVY_MODULES)))
+    
+    @app.cli.command('benchmark-pdfs')
+    @click.option('--count', default=20, show_default=True, help='Renders per document type.')
+    def benchmark_pdfs(count):
+        """Time quotation/invoice/receipt rendering (bypassing the PDF cache) and report sizes."""
+        from app.models import ServiceJob, Transaction
+        from app.pdfs import generate_quotation_pdf, generate_invoice_pdf, generate_receipt_pdf
+        
+        job = ServiceJob.query.order_by(ServiceJob.id.desc()).first()
+        payment = Transaction.query.filter_by(transaction_type='payment').order_by(Transaction.id.desc()).first()
+        documents = []
+        if job:
+            documents += [('quotation', lambda: generate_quotation_pdf(job)), ('invoice', lambda: generate_invoice_pdf(job))]
+        if payment:
+            documents.append(('receipt', lambda: generate_receipt_pdf(payment)))
+        if not documents:
+            click.echo('Nothing to render: add a service job or a payment first.')
+            return
+        
+        for name, render in documents:
+            started = time.perf_counter()
+            size = len(render())
+            first = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            for _ in range(count):
+                render()
+            average = (time.perf_counter() - started) / count
+            click.echo(f'{name:<10} first {first * 1000:7.1f} ms   avg {average * 1000:6.1f} ms   {size / 1024:7.1f} KiB')
+    
+    @app.cli.command('send-outbox')
+    @click.option('--loop', is_flag=True, help='Keep running as the email sender instead of making one pass.')
+    def send_outbox(loop):
+        """Deliver due messages from the email outbox over one SMTP session."""
+        if loop:
+            click.echo('Sending from the email outbox, Ctrl+C to stop.')
+            mailer.outbox_sender.run_forever()
+        
+        sent, unsent = mailer.outbox_sender.drain()
+        mailer.outbox_sender.close()
+        click.echo(f'{sent} email(s) sent, {unsent} failed or deferred.')
+        
+        counts = dict(db.session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all())
+        click.echo('Outbox: ' + ', '.join(f'{counts.get(status, 0)} {status}' for status in mailer.EMAIL_STATUSES))
+    
+    @app.cli.command('send-reminders')
+    @click.option('--minimum', type=float, default=100.0, show_default=True, help='Remind owners owing more than this.')
+    @click.option('--start', type=click.DateTime(['%Y-%m-%d']), help='Statement start (default: first of this month).')
+    @click.option('--end', type=click.DateTime(['%Y-%m-%d']), help='Statement end (default: today).')
+    @click.option('--resume', 'resume_id', type=int, help='Finish preparing an interrupted campaign instead.')
+    def send_reminders(minimum, start, end, resume_id):
+        """Queue payment reminders with statements attached for owners with a balance."""
+        if resume_id:
+            campaign = db.session.get(ReminderCampaign, resume_id)
+            if campaign is None:
+                raise click.ClickException(f'No reminder campaign #{resume_id}.')
+        else:
+            campaign = create_campaign(minimum, start.date() if start else date.today().replace(day=1),
+                                       end.date() if end else date.today())
+        
+        remaining = campaign.recipients.filter(CampaignRecipient.email_outbox_id.is_(None),
+                                               CampaignRecipient.error.is_(None)).count()
+        with click.progressbar(length=remaining, label=f'Campaign #{campaign.id}') as bar:
+            prepare_campaign(campaign.id, progress=bar.update)
+        
+        results = campaign_results([campaign.id])[campaign.id]
+        click.echo(', '.join(f'{results[outcome]} {outcome}' for outcome in CAMPAIGN_OUTCOMES if results.get(outcome)) or 'No recipients.')
+        click.echo('The email sender delivers queued reminders (see `flask send-outbox`).')
+    
+    @app.cli.command('backup')
+    @click.option('--type', 'backup_type', type=click.Choice(BACKUP_TYPES), default='database', show_default=True)
+    @click.option('--no-attachments', is_flag=True, help='Leave static/attachments out of a full backup.')
+    def backup(backup_type, no_attachments):
+        """Take an online backup of the SQLite database while the app keeps running."""
+        run = BackupRun(new_backup_name(backup_type), backup_type, not no_attachments)
+        run_backup(run)
+        if run.error:
+            raise click.ClickException(run.error)
+        
+        manifest = run.manifest
+        click.echo(f"{manifest['file']}: {manifest['bytes'] / 1024:,.1f} KiB, {manifest['pages']} pages "
+                   f"in {manifest['seconds']}s ({manifest['restarts']} restart(s)), integrity {manifest['integrity_check']}")
+        if 'stored_bytes' in manifest:
+            click.echo(f"{manifest['stored_bytes'] / 1024:,.1f} KiB of new chunks added to the store")
+        click.echo(f"sha256 {manifest['sha256']}")
+    
+    @app.cli.command('prune-backups')
+    @click.option('--dry-run', is_flag=True, help='Only list the backups retention would remove.')
+    def prune_backups_command(dry_run):
+        """Apply daily/weekly/monthly retention and delete unreferenced store chunks."""
+        removed, freed = prune_backups(dry_run=dry_run)
+        for name in removed:
+            click.echo(f'{"Would remove" if dry_run else "Removed"} {name}')
+        click.echo(f'{len(removed)} backup(s) past retention, {freed / 1024:,.1f} KiB freed from the store.')
+    
+    @app.cli.command('sync-replica')
+    def sync_replica():
+        """Copy the primary onto the local SQLite read replica once (e.g. from cron)."""
+        syncer = app.extensions.get('replica_sync')
+        if syncer is None:
+            raise click.ClickException('No local SQLite replica configured (REPLICA_DATABASE_URL).')
+        run = syncer.sync_once()
+        click.echo(f'Replica synced: {run.pages_total} pages, {run.restarts} restart(s).')
+    
+    @app.cli.command('archive-wal')
+    @click.option('--loop', is_flag=True, help='Keep running as the WAL archiver instead of making one pass.')
+    @click.option('--base', is_flag=True, help='Take a new base snapshot in this pass.')
+    def archive_wal(loop, base):
+        """Ship committed WAL frames to the archive and checkpoint behind them."""
+        archiver = WalArchiver(app)
+        if loop:
+            click.echo('Archiving the WAL, Ctrl+C to stop.')
+            archiver.run_forever()
+        frames, took_base = archiver.archive_once(force_base=base)
+        click.echo(f'{frames} WAL frame(s) archived{" and a new base snapshot taken" if took_base else ""}.')
+    
+    @app.cli.command('restore-wal')
+    @click.option('--to', 'target', type=click.DateTime(['%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M']),
+                  help='UTC time to restore to (default: the latest archived point).')
+    @click.option('--output', type=click.Path(dir_okay=False), default='restored.db', show_default=True)
+    @click.option('--list', 'list_only', is_flag=True, help='Only show the window a restore can reach.')
+    def restore_wal(target, output, list_only):
+        """Rebuild the database as it was at a point in time from the WAL archive."""
+        window = recovery_window()
+        if window is None:
+            raise click.ClickException('The WAL archive has no base snapshot yet (see `flask archive-wal`).')
+        click.echo(f'Recoverable from {window[0]:%Y-%m-%d %H:%M:%S} to {window[1]:%Y-%m-%d %H:%M:%S} UTC.')
+        if list_only:
+            return
+        if os.path.exists(output):
+            raise click.ClickException(f'{output} already exists.')
+        try:
+            base, segments, reached, integrity = restore_to(target or window[1], output)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Restored {output} from {base['file']} and {segments} WAL segment(s), "
+                   f'as of {reached:%Y-%m-%d %H:%M:%S} UTC.')
+        click.echo(f'Integrity check: {integrity}')
+    
+    @app.cli.command('bulk-pdfs')
+    @click.argument('kind', type=click.Choice(sorted(BULK_KINDS)))
+    @click.option('--month', default=lambda: date.today().strftime('%Y-%m'), help='Month to run, YYYY-MM (default: this month).')
+    @click.option('--output', type=click.Path(dir_okay=False), help='ZIP to write (default: KIND_MONTH.zip).')
+    @click.option('--workers', type=int, default=None, help='Worker processes (default: BULK_PDF_WORKERS or one per CPU).')
+    def bulk_pdfs(kind, month, output, workers):
+        """Render month-end invoices or statements in parallel into one ZIP."""
+        start, end = month_range(month)
+        run = BulkRun(f'cli-{os.getpid()}', kind, start, end)
+        output = output or f'{kind}_{month}.zip'
+        chunks = generate_bulk_zip(run, app.config['SQLALCHEMY_DATABASE_URI'], workers or app.config['BULK_PDF_WORKERS'])
+        
+        with open(output, 'wb') as handle:
+            handle.write(next(chunks, b''))
+            with click.progressbar(chunks, length=run.total, label=f'Rendering {run.total} {kind}') as progress:
+                for chunk in progress:
+                    handle.write(chunk)
+        
+        for entity_id, error in run.failures:
+            click.echo(f'Failed {kind[:-1]} {entity_id}: {error}')
+        click.echo(f'Wrote {output}: {run.done - len(run.failures)} of {run.total} document(s), {len(run.failures)} failed.')
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import time
+from datetime import datetime
+from functools import lru_cache, wraps
+from flask import current_app, make_response, request, session as cookie_session
+from flask_login import current_user
+from sqlalchemy import func, select
+from app import db
+
+def conditional(version, fresh_for=None):
+    """Answer a GET with 304 Not Modified, without running the view, while the
+    client's ETag still matches.
+    
+    `version(**view_args)` returns the SQL expressions the page depends on,
+    selected together in one statement, typically row_version() and
+    table_version() columns. Goes below @login_required (and @read_replica, so
+    the token is read from the same database as the page). With `fresh_for`
+    seconds the page is rendered again at least that often anyway, for pages
+    whose forms carry an expiring CSRF token.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Flashed messages only show on a fresh render
+            if request.method != 'GET' or '_flashes' in cookie_session:
+                return view(*args, **kwargs)
+            
+            row = db.session.execute(select(*version(**kwargs))).one()
+            # The session's CSRF secret too: forms on a cached page must still validate
+            parts = [_render_version(), current_user.get_id(), cookie_session.get('csrf_token'), *row]
+            if fresh_for:
+                parts.append(int(time.time() // fresh_for))
+            etag = hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32]
+            
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            changed = [value for value in row if isinstance(value, datetime)]
+            if changed:
+                response.last_modified = max(changed)
+            # Kept by the browser, but always checked with the server first
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def row_version(model, row_id):
+    """updated_at of one row; NULL once it is deleted"""
+    return select(model.updated_at).where(model.id == row_id).scalar_subquery()
+
+def table_version(model, *criteria):
+    """Row count and latest updated_at of a table (or the rows matching `criteria`).
+    
+    The count catches deletes, which leave no updated_at behind.
+    """
+    return (
+        select(func.count()).select_from(model).where(*criteria).scalar_subquery(),
+        select(func.max(model.updated_at)).where(*criteria).scalar_subquery(),
+    )
+
+@lru_cache(maxsize=None)
+def _render_version():
+    """Latest change to the app's code or templates, and the built assets' version,
+    so a deploy invalidates every ETag"""
+    newest = 0
+    for directory, _, files in os.walk(current_app.root_path):
+        for name in files:
+            if name.endswith(('.py', '.html')):
+                newest = max(newest, os.stat(os.path.join(directory, name)).st_mtime_ns)
+    return newest, current_app.extensions.get('assets', {}).get('version')
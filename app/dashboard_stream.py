@@ -0,0 +1,172 @@
+import json
+import queue
+import threading
+import time
+from datetime import date
+from flask import current_app, has_app_context
+from sqlalchemy import event, literal, select
+from sqlalchemy.orm import Session
+from app import db
+from app.conditional import table_version
+from app.models import Car, CarOwner, ServiceJob, ServiceItem, Transaction, OwnerBalance
+from app.utils import dashboard_snapshot
+
+# Commits touching these wake the publisher in this process
+WATCHED_MODELS = (Car, CarOwner, ServiceJob, ServiceItem, Transaction, OwnerBalance)
+
+# app.js tries a refused stream again after this long, polling meanwhile
+REFUSED_RETRY_SECONDS = 60
+
+def snapshot_delta(previous, current):
+    """The stat fields that changed, and each recent list in full if anything in it did.
+    
+    Whole lists (five items at most) so jobs and transactions that were
+    deleted, or pushed out by newer ones, also leave open dashboards.
+    """
+    return {name: value for name, value in current.items() if previous.get(name) != value}
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+class DashboardBroadcaster:
+    """Pushes dashboard deltas to every open /api/dashboard_stream in this process.
+    
+    One publisher thread computes the dashboard once per change, however many
+    clients are listening, and hands each of them the delta through a queue;
+    clients hold no database connection while they wait. Commits in this
+    process wake the publisher at once. Commits in other workers are noticed
+    by a cheap version query (row counts and latest updated_at) every
+    DASHBOARD_STREAM_POLL_SECONDS while anyone is listening.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.thread = None
+        self.snapshot = None
+        self._version = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+    
+    def subscribe(self):
+        """A queue of delta events and the current snapshot to start from, or
+        None when DASHBOARD_STREAM_MAX_CLIENTS streams are already open here"""
+        subscriber = queue.Queue(maxsize=self.app.config['DASHBOARD_STREAM_BACKLOG'])
+        with self._lock:
+            if len(self._subscribers) >= self.app.config['DASHBOARD_STREAM_MAX_CLIENTS']:
+                return None
+            self._subscribers.add(subscriber)
+            snapshot = self.snapshot
+        self.start()
+        if snapshot is None:
+            # Nobody was listening, so nothing is current: start the publisher from here
+            snapshot = dashboard_snapshot(fresh=True)
+            with self._lock:
+                if self.snapshot is None:
+                    self.snapshot = snapshot
+            self.notify()
+        return subscriber, snapshot
+    
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+    
+    def notify(self):
+        """Something the dashboard shows was committed in this process"""
+        self._wake.set()
+    
+    def _version_query(self):
+        # The month's revenue also moves on the 1st, with no write at all
+        columns = [literal(date.today())]
+        for model in WATCHED_MODELS:
+            columns.extend(table_version(model))
+        return select(*columns)
+    
+    def publish_once(self):
+        """Recompute the dashboard if the data moved and queue the delta; returns it"""
+        with self.app.app_context():
+            try:
+                version = tuple(db.session.execute(self._version_query()).one())
+                if version == self._version:
+                    return None
+                snapshot = dashboard_snapshot(fresh=True)
+            finally:
+                db.session.remove()
+        
+        with self._lock:
+            previous, self.snapshot, self._version = self.snapshot, snapshot, version
+            subscribers = list(self._subscribers)
+        delta = snapshot_delta(previous or {}, snapshot)
+        if not delta:
+            return None
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(delta)
+            except queue.Full:
+                # Too far behind: its stream ends and the browser reconnects for a fresh snapshot
+                self.unsubscribe(subscriber)
+        return delta
+    
+    def run_forever(self):
+        interval = self.app.config['DASHBOARD_STREAM_POLL_SECONDS']
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            with self._lock:
+                if not self._subscribers:
+                    self.snapshot = self._version = None
+                    continue
+            try:
+                self.publish_once()
+            except Exception:
+                self.app.logger.exception('Dashboard stream update failed')
+    
+    def start(self):
+        with self._start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run_forever, name='dashboard-stream', daemon=True)
+                self.thread.start()
+    
+    def stream(self, subscriber, snapshot):
+        """The text/event-stream body: the snapshot, then deltas until the stream's time is up"""
+        config = self.app.config
+        closes_at = time.monotonic() + config['DASHBOARD_STREAM_MAX_SECONDS']
+        try:
+            yield f"retry: {int(config['DASHBOARD_STREAM_RETRY_SECONDS'] * 1000)}\n\n"
+            yield format_event('snapshot', snapshot)
+            while time.monotonic() < closes_at:
+                with self._lock:
+                    if subscriber not in self._subscribers:
+                        return
+                try:
+                    delta = subscriber.get(timeout=config['DASHBOARD_STREAM_KEEPALIVE_SECONDS'])
+                except queue.Empty:
+                    # Keeps proxies from timing the connection out, and finds closed ones
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_event('delta', delta)
+        finally:
+            self.unsubscribe(subscriber)
+
+# ========== SESSION HOOKS ==========
+@event.listens_for(Session, 'after_flush')
+def _note_dashboard_changes(session, flush_context):
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, WATCHED_MODELS):
+            session.info['dashboard_changes'] = True
+            return
+
+@event.listens_for(Session, 'after_commit')
+def _wake_publisher(session):
+    if session.info.pop('dashboard_changes', False) and has_app_context():
+        broadcaster = current_app.extensions.get('dashboard_stream')
+        if broadcaster is not None:
+            broadcaster.notify()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_dashboard_changes(session):
+    session.info.pop('dashboard_changes', None)
+
+def init_dashboard_stream(app):
+    app.extensions['dashboard_stream'] = DashboardBroadcaster(app)
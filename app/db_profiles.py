@@ -0,0 +1,176 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from app import db
+
+# Connect-time PRAGMAs for SQLite and pool settings for server databases.
+# `stock` leaves SQLAlchemy's and SQLite's defaults alone and is kept as the
+# benchmark baseline (`flask benchmark-db-profiles`).
+DB_PROFILES = {
+    'stock': {
+        'pragmas': {},
+        'pool': {},
+    },
+    # Every commit synced to disk before it returns
+    'durable': {
+        'pragmas': {'journal_mode': 'WAL', 'synchronous': 'FULL', 'busy_timeout': 5000},
+        'pool': {'pool_size': 10, 'max_overflow': 10, 'pool_pre_ping': True, 'pool_recycle': 1800, 'pool_timeout': 10},
+    },
+    # WAL syncs at checkpoints only: a power cut can lose the last few commits but
+    # never corrupts the database. Bigger page cache and memory-mapped reads.
+    'balanced': {
+        'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000,
+                    'cache_size': -20000, 'mmap_size': 256 * 1024 * 1024, 'temp_store': 'MEMORY'},
+        'pool': {'pool_size': 10, 'max_overflow': 10, 'pool_pre_ping': True, 'pool_recycle': 1800, 'pool_timeout': 10},
+    },
+}
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+def engine_options(config, profile_name=None):
+    """create_engine() keyword arguments for a profile (default DB_PROFILE)"""
+    profile = DB_PROFILES[profile_name or config['DB_PROFILE']]
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' or not profile['pool']:
+        return {}
+    
+    options = dict(profile['pool'])
+    if config['DB_POOL_SIZE'] is not None:
+        options['pool_size'] = config['DB_POOL_SIZE']
+    if config['DB_MAX_OVERFLOW'] is not None:
+        options['max_overflow'] = config['DB_MAX_OVERFLOW']
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    return options
+
+def apply_profile(engine, config, profile_name=None):
+    """Run the profile's PRAGMAs (SQLite) or session timeout (MySQL) on every new connection"""
+    profile = DB_PROFILES[profile_name or config['DB_PROFILE']]
+    backend = engine.url.get_backend_name()
+    
+    if backend == 'sqlite':
+        pragmas = profile['pragmas']
+        if engine.url.database in (None, '', ':memory:'):
+            # No WAL (or point to it) for in-memory databases
+            pragmas = {name: value for name, value in pragmas.items() if name not in ('journal_mode', 'mmap_size')}
+        if not pragmas:
+            return
+        
+        @event.listens_for(engine, 'connect')
+        def _set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+            cursor.close()
+    
+    elif backend == 'mysql' and profile['pool'] and config['DB_STATEMENT_TIMEOUT_MS']:
+        timeout = int(config['DB_STATEMENT_TIMEOUT_MS'])
+        
+        @event.listens_for(engine, 'connect')
+        def _set_statement_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f'SET SESSION max_execution_time={timeout}')
+            cursor.close()
+
+def init_db_profile(app):
+    """Apply DB_PROFILE to the app's engines; engine_options() must already be in the config"""
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        apply_profile(engine, app.config)
+    
+    # A worker forked from a preloaded app (gunicorn preload_app) must open its own
+    # connections; close=False leaves the parent's to the parent
+    os.register_at_fork(after_in_child=lambda: [engine.dispose(close=False) for engine in engines])
+
+def journal_mode(config):
+    """The journal mode the active profile puts SQLite in (None: SQLite's default)"""
+    return DB_PROFILES[config['DB_PROFILE']]['pragmas'].get('journal_mode')
+
+# ========== BENCHMARK ==========
+def _timed(run, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    return (time.perf_counter() - started) / repeat
+
+def _copy_sqlite(source, target):
+    """Online copy of the live database, switched back to SQLite's default journal"""
+    source_connection = sqlite3.connect(source)
+    target_connection = sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+        target_connection.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target_connection.close()
+        source_connection.close()
+
+def benchmark_profile(config, profile_name, statements, repeat, writers):
+    """Time one profile on the app's hot queries, and on SQLite also on commits.
+    
+    SQLite runs against a fresh copy of the database per profile, so journal
+    mode and write results are not carried over and the live database is
+    never written to. Server databases are only read.
+    """
+    url = config['SQLALCHEMY_DATABASE_URI']
+    workdir = None
+    if is_sqlite(url):
+        workdir = tempfile.mkdtemp(prefix='db-profile-')
+        path = os.path.join(workdir, 'benchmark.db')
+        _copy_sqlite(make_url(url).database, path)
+        url = f'sqlite:///{path}'
+    
+    engine = create_engine(url, **engine_options(dict(config, SQLALCHEMY_DATABASE_URI=url), profile_name))
+    apply_profile(engine, config, profile_name)
+    result = {'profile': profile_name, 'reads': {}}
+    try:
+        with engine.connect() as connection:
+            for name, statement in statements.items():
+                connection.execute(statement).all()  # warm the cache
+                result['reads'][name] = _timed(lambda: connection.execute(statement).all(), repeat)
+        
+        if workdir:
+            with engine.begin() as connection:
+                connection.execute(text('CREATE TABLE benchmark_write (id INTEGER PRIMARY KEY, payload TEXT)'))
+            
+            def commit_one(connection):
+                with connection.begin():
+                    connection.execute(text('INSERT INTO benchmark_write (payload) VALUES (:payload)'), {'payload': 'x' * 200})
+            
+            with engine.connect() as connection:
+                result['commit'] = _timed(lambda: commit_one(connection), repeat)
+            
+            # Several workers committing at once, each on its own connection, the
+            # way gunicorn workers share the file
+            errors = []
+            
+            def worker():
+                with engine.connect() as connection:
+                    for _ in range(repeat):
+                        try:
+                            commit_one(connection)
+                        except OperationalError as e:
+                            errors.append(e)
+            
+            threads = [threading.Thread(target=worker) for _ in range(writers)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            result['concurrent_commits_per_second'] = (writers * repeat - len(errors)) / elapsed
+            result['locked_errors'] = len(errors)
+    finally:
+        engine.dispose()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return result
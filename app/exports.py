@@ -0,0 +1,92 @@
+import csv
+from sqlalchemy import func, case
+from app import db
+from app.models import CarOwner, Car, ServiceJob, ServiceItem, Transaction, OwnerBalance
+
+# Rows are fetched and written this many at a time, so memory stays flat
+EXPORT_BATCH_SIZE = 500
+
+class _Line:
+    """File-like target that hands back what csv.writer writes instead of storing it.
+    
+    csv.writer already writes None as an empty field, so the queries below
+    can select nullable columns as they are.
+    """
+    def write(self, value):
+        return value
+
+def _customers(start, end):
+    # Owners are not dated, the range is ignored
+    return db.session.query(
+        CarOwner.name,
+        CarOwner.phone,
+        CarOwner.email,
+        CarOwner.address,
+        func.coalesce(OwnerBalance.balance, 0.0)
+    ).outerjoin(OwnerBalance, OwnerBalance.owner_id == CarOwner.id).order_by(CarOwner.name, CarOwner.id)
+
+def _jobs(start, end):
+    query = db.session.query(
+        ServiceJob.id,
+        Car.license_plate,
+        ServiceJob.date_in,
+        ServiceJob.date_out,
+        ServiceJob.status,
+        ServiceJob.total_cost
+    ).join(Car, Car.id == ServiceJob.car_id)
+    return _in_range(query, ServiceJob.date_in, start, end).order_by(ServiceJob.date_in, ServiceJob.id)
+
+def _transactions(start, end):
+    query = db.session.query(
+        Transaction.id,
+        Transaction.date,
+        Transaction.transaction_type,
+        CarOwner.name,
+        Transaction.description,
+        Transaction.amount,
+        Transaction.service_job_id
+    ).join(CarOwner, CarOwner.id == Transaction.owner_id)
+    return _in_range(query, Transaction.date, start, end).order_by(Transaction.date, Transaction.id)
+
+def _service_items(start, end):
+    query = db.session.query(
+        ServiceItem.service_job_id,
+        Car.license_plate,
+        ServiceJob.date_in,
+        ServiceItem.description,
+        ServiceItem.cost,
+        case((ServiceItem.is_fixed == True, 'Fixed'), else_='Pending')
+    ).join(ServiceJob, ServiceJob.id == ServiceItem.service_job_id).join(Car, Car.id == ServiceJob.car_id)
+    return _in_range(query, ServiceJob.date_in, start, end).order_by(ServiceJob.date_in, ServiceItem.id)
+
+def _in_range(query, column, start, end):
+    if start:
+        query = query.filter(column >= start)
+    if end:
+        query = query.filter(column <= end)
+    return query
+
+# data_type -> (CSV header, query builder taking start/end dates)
+EXPORTS = {
+    'customers': (['Name', 'Phone', 'Email', 'Address', 'Balance'], _customers),
+    'jobs': (['Job ID', 'License Plate', 'Date In', 'Date Out', 'Status', 'Total Cost'], _jobs),
+    'transactions': (['Transaction ID', 'Date', 'Type', 'Customer', 'Description', 'Amount', 'Job ID'], _transactions),
+    'service_items': (['Job ID', 'License Plate', 'Date In', 'Description', 'Cost', 'Status'], _service_items),
+}
+
+def generate_csv(data_type, start=None, end=None):
+    """Yield the CSV export for `data_type` a batch of rows at a time"""
+    header, build_query = EXPORTS[data_type]
+    writer = csv.writer(_Line())
+    
+    yield writer.writerow(header)
+    
+    batch = []
+    for row in build_query(start, end).yield_per(EXPORT_BATCH_SIZE):
+        batch.append(writer.writerow(row))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield ''.join(batch)
+            batch = []
+    
+    if batch:
+        yield ''.join(batch)
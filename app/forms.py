@@ -59,6 +59,15 @@ class PaymentForm(FlaskForm):
     description = StringField('Description', validators=[Optional(), Length(max=200)])
     owner_id = SelectField('Customer', coerce=int, validators=[DataRequired()])
 
+class ReminderCampaignForm(FlaskForm):
+    minimum_balance = DecimalField('Minimum Balance (R)', validators=[DataRequired(), NumberRange(min=0.01)], places=2, default=100)
+    statement_start = DateField('Statement From', validators=[DataRequired()], default=lambda: date.today().replace(day=1))
+    statement_end = DateField('Statement To', validators=[DataRequired()], default=date.today)
+    
+    def validate_statement_end(self, field):
+        if self.statement_start.data and field.data and field.data < self.statement_start.data:
+            raise ValidationError('The statement must end on or after its start date')
+
 class SearchForm(FlaskForm):
     search_query = StringField('Search', validators=[DataRequired()])
     search_type = SelectField('Search Type', choices=[
@@ -78,8 +87,7 @@ class UserProfileForm(FlaskForm):
 class BackupForm(FlaskForm):
     backup_type = SelectField('Backup Type', choices=[
         ('full', 'Full Backup (Database + Files)'),
-        ('database', 'Database Only'),
-        ('settings', 'Settings Only')
+        ('database', 'Database Only')
     ], validators=[DataRequired()])
     include_attachments = BooleanField('Include File Attachments', default=True)
 
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db
+from app.models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+# Larger responses are not kept; a repeat then gets the generic "already done" answer
+MAX_STORED_BODY = 64 * 1024
+
+# session.info flag, set by the after_commit hook below while an idempotent view runs
+COMMITTED = 'idempotent_view_committed'
+
+def idempotent(view):
+    """Run a write once per Idempotency-Key; repeats get the first response back.
+    
+    The key row is added to the session before the view runs, so it commits
+    in the same transaction as the view's own changes: either both are saved
+    or neither is, and a repeat racing the first attempt fails on the key's
+    primary key instead of writing twice. Goes below @login_required; requests
+    without the header are passed straight through.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 64:
+            return jsonify({'success': False, 'error': f'{HEADER} is longer than 64 characters'}), 400
+        
+        stored = db.session.get(IdempotencyKey, (key, current_user.id))
+        if stored is not None:
+            return _replay(stored)
+        
+        record = IdempotencyKey(key=key, user_id=current_user.id, endpoint=request.endpoint)
+        db.session.add(record)
+        db.session.info[COMMITTED] = False
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except IntegrityError:
+            db.session.info.pop(COMMITTED, None)
+            db.session.rollback()
+            stored = db.session.get(IdempotencyKey, (key, current_user.id))
+            if stored is None:
+                raise
+            return _replay(stored)
+        
+        # Autoflush makes the key row persistent as soon as the view queries
+        # anything, so only a commit during the view says its write happened
+        committed = db.session.info.pop(COMMITTED, False)
+        if not committed or not inspect(record).persistent:
+            # A form error or an expired CSRF token, say: the next attempt runs it again
+            db.session.rollback()
+            return response
+        
+        record.status_code = response.status_code
+        record.content_type = response.content_type
+        record.location = response.headers.get('Location')
+        if not response.direct_passthrough and response.content_length is not None \
+                and response.content_length <= MAX_STORED_BODY:
+            record.body = response.get_data(as_text=True)
+        cutoff = datetime.utcnow() - timedelta(hours=current_app.config['IDEMPOTENCY_KEY_HOURS'])
+        IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+        return response
+    return wrapper
+
+def _replay(stored):
+    if stored.status_code is None:
+        # Committed, but the worker stopped before it could keep the response
+        response = jsonify({'success': True, 'replayed': True})
+    else:
+        response = current_app.response_class(stored.body or '', status=stored.status_code,
+                                              content_type=stored.content_type)
+        if stored.location:
+            response.headers['Location'] = stored.location
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+# ========== SESSION HOOKS ==========
+@event.listens_for(Session, 'after_commit')
+def _note_commit(session):
+    if COMMITTED in session.info:
+        session.info[COMMITTED] = True
@@ -0,0 +1,198 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app import db
+from app.models import Car, CarOwner
+
+class PrefixIndex:
+    """Process-local typeahead index over plates, owner names and phones.
+    
+    Every entity is stored under a few normalized keys (the compact plate,
+    the full name and each word of it, the phone digits) in one sorted
+    list, so a prefix lookup is a bisect plus a short forward scan.
+    Commits in this process keep it current through the session hooks
+    below; writes from other worker processes show up once the index is
+    older than LOOKUP_INDEX_MAX_AGE and gets reloaded.
+    """
+    
+    def __init__(self):
+        self._keys = []
+        self._entries = {}
+        self._entity_keys = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None
+    
+    def load(self, entities):
+        """Replace the index with (kind, id, label, detail, keys) tuples"""
+        keys = []
+        entries = {}
+        entity_keys = {}
+        for kind, entity_id, label, detail, entity_key_set in entities:
+            entries[(kind, entity_id)] = (label, detail)
+            entity_keys[(kind, entity_id)] = entity_key_set
+            keys.extend((key, kind, entity_id) for key in entity_key_set)
+        keys.sort()
+        
+        with self._lock:
+            self._keys = keys
+            self._entries = entries
+            self._entity_keys = entity_keys
+            self.loaded_at = time.monotonic()
+    
+    def put(self, kind, entity_id, label, detail, keys):
+        with self._lock:
+            self._remove(kind, entity_id)
+            self._entries[(kind, entity_id)] = (label, detail)
+            self._entity_keys[(kind, entity_id)] = keys
+            for key in keys:
+                insort(self._keys, (key, kind, entity_id))
+    
+    def remove(self, kind, entity_id):
+        with self._lock:
+            self._remove(kind, entity_id)
+    
+    def _remove(self, kind, entity_id):
+        self._entries.pop((kind, entity_id), None)
+        for key in self._entity_keys.pop((kind, entity_id), ()):
+            i = bisect_left(self._keys, (key, kind, entity_id))
+            if i < len(self._keys) and self._keys[i] == (key, kind, entity_id):
+                del self._keys[i]
+    
+    def get(self, kind, entity_id):
+        return self._entries.get((kind, entity_id))
+    
+    def lookup(self, query, kind=None, limit=10):
+        """Entities with a key starting with `query`, as (kind, id, label, detail)"""
+        results = []
+        seen = set()
+        with self._lock:
+            for needle in query_keys(query):
+                i = bisect_left(self._keys, (needle,))
+                while i < len(self._keys) and len(results) < limit:
+                    key, entity_kind, entity_id = self._keys[i]
+                    if not key.startswith(needle):
+                        break
+                    i += 1
+                    if (kind and entity_kind != kind) or (entity_kind, entity_id) in seen:
+                        continue
+                    seen.add((entity_kind, entity_id))
+                    label, detail = self._entries[(entity_kind, entity_id)]
+                    results.append((entity_kind, entity_id, label, detail))
+        return results
+    
+    def __len__(self):
+        return len(self._entries)
+
+lookup_index = PrefixIndex()
+
+# ========== KEYS ==========
+def _compact(value):
+    return re.sub(r'\s+', '', value or '').lower()
+
+def _digits(value):
+    return re.sub(r'\D', '', value or '')
+
+def car_keys(license_plate):
+    return {_compact(license_plate)} - {''}
+
+def owner_keys(name, phone):
+    name = ' '.join((name or '').lower().split())
+    return ({name, _digits(phone)} | set(name.split())) - {''}
+
+def query_keys(query):
+    """Normalized forms of a typed query, one per kind of key it could be a prefix of"""
+    lowered = ' '.join((query or '').lower().split())
+    return [needle for needle in dict.fromkeys([lowered, _compact(query), _digits(query)]) if needle]
+
+def car_label(license_plate, make, model):
+    return f'{license_plate} - {make} {model}'
+
+# ========== LOADING ==========
+def warm_lookup_index():
+    """Load every car and owner into the index with two column queries"""
+    entities = []
+    for car_id, plate, make, model in db.session.query(Car.id, Car.license_plate, Car.make, Car.model):
+        entities.append(('car', car_id, car_label(plate, make, model), '', car_keys(plate)))
+    for owner_id, name, phone in db.session.query(CarOwner.id, CarOwner.name, CarOwner.phone):
+        entities.append(('owner', owner_id, name, phone, owner_keys(name, phone)))
+    lookup_index.load(entities)
+    return len(entities)
+
+def ensure_lookup_index(max_age):
+    if lookup_index.loaded_at is None or time.monotonic() - lookup_index.loaded_at > max_age:
+        warm_lookup_index()
+    return lookup_index
+
+def picker_choices(kind, selected_id):
+    """SelectField choices for an async picker: only the currently selected entity.
+    
+    Falls back to a primary-key lookup when the index has not seen it yet (added
+    through another worker), so validating a form never depends on its age.
+    """
+    if not selected_id:
+        return []
+    entry = lookup_index.get(kind, selected_id)
+    if entry is None:
+        entry = _load_entry(kind, selected_id)
+    return [(selected_id, entry[0])] if entry else []
+
+def _load_entry(kind, entity_id):
+    """(label, detail) of one car or owner from the database, added to the index; None if it does not exist"""
+    if kind == 'car':
+        car = db.session.get(Car, entity_id)
+        if car is None:
+            return None
+        entry = (car_label(car.license_plate, car.make, car.model), '', car_keys(car.license_plate))
+    else:
+        owner = db.session.get(CarOwner, entity_id)
+        if owner is None:
+            return None
+        entry = (owner.name, owner.phone, owner_keys(owner.name, owner.phone))
+    if lookup_index.loaded_at is not None:
+        lookup_index.put(kind, entity_id, *entry)
+    return entry[:2]
+
+# ========== SESSION HOOKS ==========
+# Changes are staged per session and applied on commit, so a rolled-back
+# insert never shows up in the typeahead
+def _stage(target, change):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('lookup_changes', []).append(change)
+
+@event.listens_for(Car, 'after_insert')
+@event.listens_for(Car, 'after_update')
+def _car_saved(mapper, connection, target):
+    _stage(target, ('car', target.id, car_label(target.license_plate, target.make, target.model), '',
+                    car_keys(target.license_plate)))
+
+@event.listens_for(CarOwner, 'after_insert')
+@event.listens_for(CarOwner, 'after_update')
+def _owner_saved(mapper, connection, target):
+    _stage(target, ('owner', target.id, target.name, target.phone, owner_keys(target.name, target.phone)))
+
+@event.listens_for(Car, 'after_delete')
+def _car_deleted(mapper, connection, target):
+    _stage(target, ('car', target.id, None, None, None))
+
+@event.listens_for(CarOwner, 'after_delete')
+def _owner_deleted(mapper, connection, target):
+    _stage(target, ('owner', target.id, None, None, None))
+
+@event.listens_for(Session, 'after_commit')
+def _apply_on_commit(session):
+    if lookup_index.loaded_at is None:
+        session.info.pop('lookup_changes', None)
+        return
+    for kind, entity_id, label, detail, keys in session.info.pop('lookup_changes', ()):
+        if keys is None:
+            lookup_index.remove(kind, entity_id)
+        else:
+            lookup_index.put(kind, entity_id, label, detail, keys)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('lookup_changes', None)
@@ -0,0 +1,260 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app import db
+from app.models import EmailOutbox
+from app.query_plans import hot_query
+
+EMAIL_STATUSES = ('queued', 'sending', 'sent', 'failed')
+
+# smtplib and email.message are imported where a message is actually built or
+# sent: every worker loads this module at boot, few of them ever send mail.
+
+# Messages claimed per pass over the outbox
+EMAIL_BATCH_SIZE = 20
+
+# A claimed message is someone else's for this long; after that a crashed
+# sender's message goes back in the queue
+EMAIL_CLAIM_SECONDS = 600
+
+def enqueue_email(recipient, subject, body, attachment=None, attachment_name=None, priority=0):
+    """Add an email to the outbox; it is handed to the sender when the session commits"""
+    entry = EmailOutbox(recipient=recipient, subject=subject, body=body, priority=priority,
+                        attachment=attachment, attachment_name=attachment_name)
+    db.session.add(entry)
+    db.session.info['email_queued'] = True
+    return entry
+
+def requeue_email(entry):
+    """Give a failed email a fresh set of attempts"""
+    entry.status = 'queued'
+    entry.attempts = 0
+    entry.next_attempt_at = datetime.utcnow()
+    db.session.info['email_queued'] = True
+
+def build_message(entry, sender):
+    from email.message import EmailMessage
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = entry.recipient
+    msg['Subject'] = entry.subject
+    msg.set_content(entry.body, subtype='html')
+    if entry.attachment and entry.attachment_name:
+        msg.add_attachment(entry.attachment, maintype='application', subtype='octet-stream',
+                           filename=entry.attachment_name)
+    return msg
+
+def is_permanent(error):
+    """Whether retrying `error` is pointless: the server rejected the message itself"""
+    import smtplib
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        # Bad credentials get fixed in the environment, the message is fine
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+def retry_delay(attempts, base):
+    """Exponential backoff: base, 2x base, 4x base, ... seconds"""
+    return base * 2 ** max(attempts - 1, 0)
+
+def due_emails(now):
+    """Ids of queued messages whose next attempt is due, in sending order"""
+    return hot_query(db.session.query(EmailOutbox.id).filter(
+        EmailOutbox.status == 'queued', EmailOutbox.next_attempt_at <= now
+    ).order_by(EmailOutbox.priority, EmailOutbox.next_attempt_at), 'due emails')
+
+class OutboxSender:
+    """Drains email_outbox over one reused, authenticated SMTP session.
+    
+    Messages are claimed with a conditional UPDATE, so several senders (one
+    per gunicorn worker, or `flask send-outbox --loop`) never send the same
+    message twice. Transient failures are retried with exponential backoff
+    up to EMAIL_MAX_ATTEMPTS; rejections are marked failed straight away.
+    The connection is kept between messages, paced to EMAIL_RATE_PER_MINUTE,
+    and replaced after EMAIL_MESSAGES_PER_SESSION messages or once idle.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.smtp = None
+        self.last_used = 0.0
+        self.session_messages = 0
+        self.next_send_at = 0.0
+        self.wake = threading.Event()
+        self.thread = None
+        self.unreachable = False
+        self._start_lock = threading.Lock()
+    
+    # ========== SMTP SESSION ==========
+    def connection(self):
+        import smtplib
+        if self.smtp is None:
+            config = self.app.config
+            smtp = smtplib.SMTP(config['EMAIL_SERVER'], config['EMAIL_PORT'], timeout=30)
+            try:
+                if config['EMAIL_USE_TLS']:
+                    smtp.starttls()
+                if config['EMAIL_USERNAME']:
+                    smtp.login(config['EMAIL_USERNAME'], config['EMAIL_PASSWORD'])
+            except Exception:
+                smtp.close()
+                raise
+            self.smtp = smtp
+            self.session_messages = 0
+        return self.smtp
+    
+    def close(self):
+        import smtplib
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+            self.smtp = None
+    
+    def throttle(self):
+        """Sleep until the configured send rate allows another message"""
+        rate = self.app.config['EMAIL_RATE_PER_MINUTE']
+        if rate:
+            delay = self.next_send_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_send_at = max(self.next_send_at, time.monotonic()) + 60.0 / rate
+    
+    def deliver(self, msg):
+        import smtplib
+        # Providers cap messages per connection, so start a new one before hitting it
+        if self.smtp is not None and self.session_messages >= self.app.config['EMAIL_MESSAGES_PER_SESSION']:
+            self.close()
+        self.throttle()
+        # A session the server dropped while idle gets one reconnect
+        for attempt in range(2):
+            smtp = self.connection()
+            try:
+                smtp.send_message(msg)
+                self.session_messages += 1
+                self.last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.smtp = None
+                if attempt:
+                    raise
+    
+    # ========== OUTBOX ==========
+    def _release_stale_claims(self, now):
+        db.session.execute(EmailOutbox.__table__.update().where(
+            EmailOutbox.status == 'sending', EmailOutbox.next_attempt_at < now
+        ).values(status='queued'))
+        db.session.commit()
+    
+    def _claim(self, entry_id, now):
+        result = db.session.execute(EmailOutbox.__table__.update().where(
+            EmailOutbox.id == entry_id, EmailOutbox.status == 'queued'
+        ).values(status='sending', next_attempt_at=now + timedelta(seconds=EMAIL_CLAIM_SECONDS)))
+        db.session.commit()
+        return result.rowcount == 1
+    
+    def _send_entry(self, entry):
+        import smtplib
+        config = self.app.config
+        try:
+            self.deliver(build_message(entry, config['EMAIL_USERNAME'] or config['GARAGE_EMAIL']))
+        except Exception as e:
+            if not isinstance(e, smtplib.SMTPResponseException):
+                # No usable session (server down, bad credentials): leave the rest of
+                # the batch for the next pass instead of burning their attempts
+                self.close()
+                self.unreachable = True
+            entry.attempts += 1
+            entry.last_error = f'{type(e).__name__}: {e}'
+            if is_permanent(e) or entry.attempts >= config['EMAIL_MAX_ATTEMPTS']:
+                entry.status = 'failed'
+                self.app.logger.warning('Email %d to %s failed: %s', entry.id, entry.recipient, entry.last_error)
+            else:
+                entry.status = 'queued'
+                entry.next_attempt_at = datetime.utcnow() + timedelta(
+                    seconds=retry_delay(entry.attempts, config['EMAIL_RETRY_SECONDS']))
+            db.session.commit()
+            return False
+        
+        entry.attempts += 1
+        entry.status = 'sent'
+        entry.sent_at = datetime.utcnow()
+        entry.last_error = None
+        db.session.commit()
+        return True
+    
+    def drain(self):
+        """Send every message that is due; returns (sent, failed or deferred)"""
+        sent = unsent = 0
+        with self.app.app_context():
+            try:
+                now = datetime.utcnow()
+                self._release_stale_claims(now)
+                self.unreachable = False
+                while not self.unreachable:
+                    due = [row.id for row in due_emails(now).limit(EMAIL_BATCH_SIZE)]
+                    if not due:
+                        break
+                    for entry_id in due:
+                        if self.unreachable:
+                            break
+                        if not self._claim(entry_id, now):
+                            continue
+                        if self._send_entry(db.session.get(EmailOutbox, entry_id)):
+                            sent += 1
+                        else:
+                            unsent += 1
+            finally:
+                db.session.remove()
+        return sent, unsent
+    
+    # ========== BACKGROUND THREAD ==========
+    def run_forever(self):
+        config = self.app.config
+        while True:
+            self.wake.clear()
+            try:
+                self.drain()
+            except Exception:
+                self.app.logger.exception('Email outbox pass failed')
+            if self.smtp is not None and time.monotonic() - self.last_used > config['EMAIL_IDLE_SECONDS']:
+                self.close()
+            self.wake.wait(config['EMAIL_POLL_SECONDS'])
+    
+    def start(self):
+        with self._start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run_forever, name='email-outbox', daemon=True)
+                self.thread.start()
+    
+    def notify(self):
+        self.wake.set()
+
+outbox_sender = None
+
+def init_mailer(app):
+    """Create the app's outbox sender; with EMAIL_WORKER on, its thread starts on the first request"""
+    global outbox_sender
+    outbox_sender = OutboxSender(app)
+    
+    if app.config['EMAIL_WORKER']:
+        @app.before_request
+        def _start_outbox_sender():
+            # Not at boot: CLI commands and bulk PDF workers build apps that never send mail
+            if outbox_sender.thread is None and request.endpoint != 'static':
+                outbox_sender.start()
+
+# ========== SESSION HOOKS ==========
+@event.listens_for(Session, 'after_commit')
+def _wake_sender(session):
+    if session.info.pop('email_queued', False) and outbox_sender is not None:
+        outbox_sender.notify()
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_queued(session):
+    session.info.pop('email_queued', None)
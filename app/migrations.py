@@ -0,0 +1,144 @@
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, String, DateTime, func, select, text, inspect
+from app import db
+from app.models import CarOwner, Car, ServiceJob, ServiceItem, Transaction, EmailOutbox, ReminderCampaign, CampaignRecipient, IdempotencyKey
+
+# Bookkeeping for applied revisions, kept off db.Model's metadata so
+# create_all() never pretends a database is up to date
+migration_metadata = MetaData()
+
+schema_migration = Table(
+    'schema_migration', migration_metadata,
+    Column('revision', String(40), primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False, default=datetime.utcnow),
+)
+
+# ========== REVISIONS ==========
+# Each revision is (id, description, upgrade(connection)) and must be safe to
+# run on a database where create_all() already built the current models.
+def _create_indexes(*indexes):
+    def upgrade(connection):
+        for index in indexes:
+            index.create(connection, checkfirst=True)
+    return upgrade
+
+def _create_tables(*models):
+    def upgrade(connection):
+        for model in models:
+            model.__table__.create(connection, checkfirst=True)
+    return upgrade
+
+def _add_column(table, name, ddl):
+    def upgrade(connection):
+        if name not in {column['name'] for column in inspect(connection).get_columns(table)}:
+            quoted = connection.dialect.identifier_preparer.quote(table)
+            connection.execute(text(f'ALTER TABLE {quoted} ADD COLUMN {name} {ddl}'))
+    return upgrade
+
+def _backfill_updated_at(*models):
+    """Start rows that predate updated_at from their created_at"""
+    def upgrade(connection):
+        for model in models:
+            table = model.__table__
+            connection.execute(table.update().where(table.c.updated_at.is_(None)).values(
+                updated_at=func.coalesce(table.c.created_at, func.current_timestamp())))
+    return upgrade
+
+def _steps(*upgrades):
+    def upgrade(connection):
+        for step in upgrades:
+            step(connection)
+    return upgrade
+
+def _index(model, name):
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+# Models whose pages are served conditionally (app/conditional.py)
+TRACKED_MODELS = (CarOwner, Car, ServiceJob, ServiceItem, Transaction)
+
+REVISIONS = [
+    ('0001_hot_query_indexes', 'Composite indexes for the payment, job, car and service item filters', _create_indexes(
+        _index(Transaction, 'ix_transaction_type_date'),
+        _index(Transaction, 'ix_transaction_owner_type'),
+        _index(ServiceJob, 'ix_service_job_status_date_in'),
+        _index(ServiceJob, 'ix_service_job_car_id'),
+        _index(ServiceItem, 'ix_service_item_service_job_id'),
+        _index(Car, 'ix_car_owner_id'),
+    )),
+    ('0002_email_outbox', 'email_outbox table for the background email sender', _create_tables(EmailOutbox)),
+    ('0003_reminder_campaigns', 'Payment reminder campaigns and email_outbox.priority', _steps(
+        _add_column('email_outbox', 'priority', 'INTEGER NOT NULL DEFAULT 0'),
+        _create_tables(ReminderCampaign, CampaignRecipient),
+    )),
+    ('0004_updated_at', 'updated_at on owners, cars, jobs, service items and transactions', _steps(
+        *(_add_column(model.__tablename__, 'updated_at', 'DATETIME') for model in TRACKED_MODELS),
+        _backfill_updated_at(*TRACKED_MODELS),
+    )),
+    ('0005_idempotency_keys', 'idempotency_key table for replayed offline writes', _create_tables(IdempotencyKey)),
+]
+
+def applied_revisions(connection):
+    migration_metadata.create_all(connection)
+    return {row.revision for row in connection.execute(select(schema_migration.c.revision))}
+
+def pending_revisions():
+    with db.engine.begin() as connection:
+        applied = applied_revisions(connection)
+    return [revision for revision in REVISIONS if revision[0] not in applied]
+
+def upgrade_schema():
+    """Apply pending revisions in order, each in its own transaction; returns their ids"""
+    applied = []
+    for revision, description, upgrade in pending_revisions():
+        with db.engine.begin() as connection:
+            upgrade(connection)
+            connection.execute(schema_migration.insert().values(
+                revision=revision, description=description, applied_at=datetime.utcnow()))
+        applied.append(revision)
+    return applied
+
+def stamp_schema():
+    """Record every revision as applied, for a database create_all() just built from scratch"""
+    with db.engine.begin() as connection:
+        applied = applied_revisions(connection)
+        for revision, description, _ in REVISIONS:
+            if revision not in applied:
+                connection.execute(schema_migration.insert().values(
+                    revision=revision, description=description, applied_at=datetime.utcnow()))
+
+def unapplied_revisions():
+    """Ids of revisions not yet applied, or None before the first `flask migrate`; read-only"""
+    if not inspect(db.engine).has_table(schema_migration.name):
+        return None
+    with db.engine.connect() as connection:
+        applied = {row.revision for row in connection.execute(select(schema_migration.c.revision))}
+    return [revision for revision, _, _ in REVISIONS if revision not in applied]
+
+# ========== SCHEMA SETUP ==========
+def prepare_schema():
+    """Build a new database from the models, or bring an existing one up to date.
+    
+    What every worker used to do on boot, now run once by `flask migrate`.
+    Returns the ids of the revisions applied.
+    """
+    new_database = not inspect(db.engine).get_table_names()
+    db.create_all()
+    if new_database:
+        stamp_schema()
+    # Before anything below loads rows through the models, which select every
+    # column they declare (updated_at, ...)
+    applied = upgrade_schema()
+    
+    # Stored totals on service_job tables created before them
+    from app.models import OwnerBalance, rebuild_owner_balances, add_job_total_columns
+    add_job_total_columns()
+    
+    # Databases created before the owner_balance ledger need it filled once
+    if not OwnerBalance.query.first() and Transaction.query.first():
+        rebuild_owner_balances()
+    
+    # Search index (FTS5 on SQLite, trigram tables elsewhere), filled when first created
+    from app.search import ensure_search_index
+    ensure_search_index()
+    return applied
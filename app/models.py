@@ -2,7 +2,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
+from sqlalchemy import event, func, case, select, inspect, text
+from sqlalchemy.orm import query_expression
 from app import db, login_manager
+from app.query_plans import hot_query
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -28,22 +31,42 @@ class CarOwner(db.Model):
     email = db.Column(db.String(120))
     address = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     cars = db.relationship('Car', backref='owner', lazy=True, cascade='all, delete-orphan')
     transactions = db.relationship('Transaction', backref='owner', lazy=True)
+    ledger = db.relationship('OwnerBalance', uselist=False, lazy='joined', cascade='all, delete-orphan')
+    
+    # Filled in by the list-page loader profiles in routes.py, None elsewhere
+    car_count = query_expression()
     
     @property
     def balance(self):
-        total_invoices = sum(transaction.amount for transaction in self.transactions 
-                           if transaction.transaction_type == 'invoice')
-        total_payments = sum(transaction.amount for transaction in self.transactions 
-                           if transaction.transaction_type == 'payment')
-        return total_invoices - total_payments
+        # Maintained by the Transaction insert hooks below, no need to walk transactions
+        return self.ledger.balance if self.ledger else 0.0
+    
+    @property
+    def last_payment_date(self):
+        return self.ledger.last_payment_date if self.ledger else None
     
     def __repr__(self):
         return f'<CarOwner {self.name}>'
 
+class OwnerBalance(db.Model):
+    """Running invoice/payment totals per owner, kept in step with Transaction inserts"""
+    __tablename__ = 'owner_balance'
+    
+    owner_id = db.Column(db.Integer, db.ForeignKey('car_owner.id'), primary_key=True)
+    total_invoiced = db.Column(db.Float, nullable=False, default=0.0)
+    total_paid = db.Column(db.Float, nullable=False, default=0.0)
+    balance = db.Column(db.Float, nullable=False, default=0.0, index=True)
+    last_payment_date = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<OwnerBalance {self.owner_id} - R{self.balance}>'
+
 class Car(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     license_plate = db.Column(db.String(20), unique=True, nullable=False)
@@ -53,6 +76,7 @@ class Car(db.Model):
     color = db.Column(db.String(30))
     vin = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Foreign key
     owner_id = db.Column(db.Integer, db.ForeignKey('car_owner.id'), nullable=False)
@@ -60,6 +84,15 @@ class Car(db.Model):
     # Relationships
     service_jobs = db.relationship('ServiceJob', backref='car', lazy=True, cascade='all, delete-orphan')
     
+    # Filled in by the list-page loader profiles in routes.py, None elsewhere
+    job_count = query_expression()
+    last_service_date = query_expression()
+    
+    # Indexes are added to existing databases by the migrations in app/migrations.py
+    __table_args__ = (
+        db.Index('ix_car_owner_id', 'owner_id'),
+    )
+    
     def __repr__(self):
         return f'<Car {self.license_plate} - {self.make} {self.model}>'
 
@@ -72,6 +105,12 @@ class ServiceJob(db.Model):
     status = db.Column(db.String(20), default='in_progress')  # in_progress, completed, quoted
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Totals over service_items, kept in step by the ServiceItem write hooks below
+    total_cost = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    quoted_cost = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     # Foreign key
     car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
@@ -79,13 +118,10 @@ class ServiceJob(db.Model):
     # Relationships
     service_items = db.relationship('ServiceItem', backref='service_job', lazy=True, cascade='all, delete-orphan')
     
-    @property
-    def total_cost(self):
-        return sum(item.cost for item in self.service_items if item.is_fixed)
-    
-    @property
-    def quoted_cost(self):
-        return sum(item.cost for item in self.service_items)
+    __table_args__ = (
+        db.Index('ix_service_job_status_date_in', 'status', 'date_in'),
+        db.Index('ix_service_job_car_id', 'car_id'),
+    )
     
     def __repr__(self):
         return f'<ServiceJob {self.id} - {self.car.license_plate}>'
@@ -96,10 +132,15 @@ class ServiceItem(db.Model):
     cost = db.Column(db.Float, nullable=False, default=0.0)
     is_fixed = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Foreign key
     service_job_id = db.Column(db.Integer, db.ForeignKey('service_job.id'), nullable=False)
     
+    __table_args__ = (
+        db.Index('ix_service_item_service_job_id', 'service_job_id'),
+    )
+    
     def __repr__(self):
         return f'<ServiceItem {self.description} - R{self.cost}>'
 
@@ -110,11 +151,17 @@ class Transaction(db.Model):
     description = db.Column(db.String(200))
     date = db.Column(db.Date, nullable=False, default=date.today)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Foreign keys
     owner_id = db.Column(db.Integer, db.ForeignKey('car_owner.id'), nullable=False)
     service_job_id = db.Column(db.Integer, db.ForeignKey('service_job.id'))
     
+    __table_args__ = (
+        db.Index('ix_transaction_type_date', 'transaction_type', 'date'),
+        db.Index('ix_transaction_owner_type', 'owner_id', 'transaction_type'),
+    )
+    
     def __repr__(self):
         return f'<Transaction {self.transaction_type} - R{self.amount}>'
 
@@ -129,6 +176,242 @@ class ServiceCategory(db.Model):
     def __repr__(self):
         return f'<ServiceCategory {self.name}>'
 
+class EmailOutbox(db.Model):
+    """An email waiting for, or done with, the background sender in app/mailer.py"""
+    __tablename__ = 'email_outbox'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    attachment = db.Column(db.LargeBinary)
+    attachment_name = db.Column(db.String(200))
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, sending, sent, failed
+    priority = db.Column(db.Integer, nullable=False, default=0)  # lower goes first; campaigns use 1
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} {self.status} to {self.recipient}>'
+
+class ReminderCampaign(db.Model):
+    """A payment reminder run: every owner owing more than `minimum_balance` gets their statement"""
+    __tablename__ = 'reminder_campaign'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    minimum_balance = db.Column(db.Float, nullable=False, default=0.0)
+    statement_start = db.Column(db.Date, nullable=False)
+    statement_end = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='preparing')  # preparing, queued
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    prepared_at = db.Column(db.DateTime)
+    
+    recipients = db.relationship('CampaignRecipient', backref='campaign', lazy='dynamic', cascade='all, delete-orphan')
+    
+    def __repr__(self):
+        return f'<ReminderCampaign {self.id} {self.status}>'
+
+class CampaignRecipient(db.Model):
+    """One owner in a reminder campaign and the outbox message queued for them"""
+    __tablename__ = 'campaign_recipient'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('reminder_campaign.id'), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('car_owner.id'), nullable=False)
+    email = db.Column(db.String(120))
+    balance = db.Column(db.Float, nullable=False)
+    email_outbox_id = db.Column(db.Integer, db.ForeignKey('email_outbox.id'))
+    error = db.Column(db.Text)
+    
+    owner = db.relationship('CarOwner')
+    email_outbox = db.relationship('EmailOutbox')
+    
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'owner_id', name='uq_campaign_recipient_owner'),
+    )
+    
+    def __repr__(self):
+        return f'<CampaignRecipient {self.campaign_id}/{self.owner_id}>'
+
+class IdempotencyKey(db.Model):
+    """A write sent with an Idempotency-Key header, and the response it got the first time"""
+    __tablename__ = 'idempotency_key'
+    
+    key = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    endpoint = db.Column(db.String(100), nullable=False)
+    status_code = db.Column(db.Integer)  # None until the response is stored
+    content_type = db.Column(db.String(100))
+    location = db.Column(db.String(500))
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} {self.endpoint}>'
+
+def _apply_to_ledger(connection, transaction, sign):
+    """Add (sign=1) or remove (sign=-1) a transaction from its owner's ledger row"""
+    ledger = OwnerBalance.__table__
+    amount = (transaction.amount or 0.0) * sign
+    invoiced = amount if transaction.transaction_type == 'invoice' else 0.0
+    paid = amount if transaction.transaction_type == 'payment' else 0.0
+    
+    values = {
+        'total_invoiced': ledger.c.total_invoiced + invoiced,
+        'total_paid': ledger.c.total_paid + paid,
+        'balance': ledger.c.balance + invoiced - paid,
+        'updated_at': datetime.utcnow(),
+    }
+    if paid > 0:
+        values['last_payment_date'] = case(
+            (ledger.c.last_payment_date > transaction.date, ledger.c.last_payment_date),
+            else_=transaction.date
+        )
+    
+    result = connection.execute(
+        ledger.update().where(ledger.c.owner_id == transaction.owner_id).values(**values)
+    )
+    if result.rowcount == 0:
+        connection.execute(ledger.insert().values(
+            owner_id=transaction.owner_id,
+            total_invoiced=invoiced,
+            total_paid=paid,
+            balance=invoiced - paid,
+            last_payment_date=transaction.date if paid > 0 else None,
+            updated_at=datetime.utcnow(),
+        ))
+
+@event.listens_for(Transaction, 'after_insert')
+def _transaction_inserted(mapper, connection, target):
+    _apply_to_ledger(connection, target, 1)
+
+@event.listens_for(Transaction, 'after_delete')
+def _transaction_deleted(mapper, connection, target):
+    _apply_to_ledger(connection, target, -1)
+
+def _job_totals(job_id):
+    """Column expressions recomputing a job's stored totals from its items"""
+    items = ServiceItem.__table__
+    
+    def total(*criteria):
+        return select(func.coalesce(func.sum(items.c.cost), 0.0)).where(
+            items.c.service_job_id == job_id, *criteria
+        ).scalar_subquery()
+    
+    return {
+        'total_cost': total(items.c.is_fixed == True),
+        'quoted_cost': total(),
+        'item_count': select(func.count()).where(items.c.service_job_id == job_id).scalar_subquery(),
+    }
+
+@event.listens_for(ServiceItem, 'after_insert')
+@event.listens_for(ServiceItem, 'after_update')
+@event.listens_for(ServiceItem, 'after_delete')
+def _service_item_changed(mapper, connection, target):
+    jobs = ServiceJob.__table__
+    connection.execute(hot_query(
+        jobs.update().where(jobs.c.id == target.service_job_id).values(**_job_totals(target.service_job_id)),
+        'job totals'
+    ))
+
+def rebuild_job_totals(apply=True):
+    """Recompute the stored totals of every service job from its items.
+    
+    Returns a list of (job_id, stored_total, actual_total) for jobs that had drifted.
+    With apply=False the jobs are only checked and left untouched.
+    """
+    actual = {
+        row.id: row for row in db.session.query(
+            ServiceJob.id,
+            func.coalesce(func.sum(case((ServiceItem.is_fixed == True, ServiceItem.cost), else_=0.0)), 0.0).label('total_cost'),
+            func.coalesce(func.sum(ServiceItem.cost), 0.0).label('quoted_cost'),
+            func.count(ServiceItem.id).label('item_count')
+        ).outerjoin(ServiceItem, ServiceItem.service_job_id == ServiceJob.id).group_by(ServiceJob.id)
+    }
+    
+    drifted = []
+    for job in ServiceJob.query.all():
+        row = actual[job.id]
+        if (abs(job.total_cost - row.total_cost) > 0.005 or abs(job.quoted_cost - row.quoted_cost) > 0.005
+                or job.item_count != row.item_count):
+            drifted.append((job.id, job.total_cost, row.total_cost))
+            job.total_cost = row.total_cost
+            job.quoted_cost = row.quoted_cost
+            job.item_count = row.item_count
+    
+    if apply:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return drifted
+
+def add_job_total_columns():
+    """Add the stored job totals to service_job tables created before they existed"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns('service_job')}
+    missing = [name for name in ('total_cost', 'quoted_cost', 'item_count') if name not in existing]
+    if not missing:
+        return
+    
+    with db.engine.begin() as connection:
+        for name in missing:
+            column_type = 'INTEGER' if name == 'item_count' else 'FLOAT'
+            connection.execute(text(f'ALTER TABLE service_job ADD COLUMN {name} {column_type} NOT NULL DEFAULT 0'))
+    rebuild_job_totals()
+
+def rebuild_owner_balances(apply=True):
+    """Recompute every ledger row from the transaction table.
+    
+    Returns a list of (owner_id, stored_balance, actual_balance) for rows that had drifted.
+    With apply=False the ledger is only checked and left untouched.
+    """
+    invoiced = func.coalesce(func.sum(case((Transaction.transaction_type == 'invoice', Transaction.amount), else_=0.0)), 0.0)
+    paid = func.coalesce(func.sum(case((Transaction.transaction_type == 'payment', Transaction.amount), else_=0.0)), 0.0)
+    last_payment = func.max(case((Transaction.transaction_type == 'payment', Transaction.date)))
+    
+    actual = {
+        row.id: row for row in db.session.query(
+            CarOwner.id,
+            invoiced.label('invoiced'),
+            paid.label('paid'),
+            last_payment.label('last_payment_date')
+        ).outerjoin(Transaction, Transaction.owner_id == CarOwner.id).group_by(CarOwner.id)
+    }
+    stored = {entry.owner_id: entry for entry in OwnerBalance.query.all()}
+    
+    drifted = []
+    for owner_id, row in actual.items():
+        entry = stored.pop(owner_id, None)
+        expected = row.invoiced - row.paid
+        current = entry.balance if entry else 0.0
+        if abs(current - expected) > 0.005:
+            drifted.append((owner_id, current, expected))
+        
+        if entry is None:
+            entry = OwnerBalance(owner_id=owner_id)
+            db.session.add(entry)
+        entry.total_invoiced = row.invoiced
+        entry.total_paid = row.paid
+        entry.balance = expected
+        entry.last_payment_date = row.last_payment_date
+        entry.updated_at = datetime.utcnow()
+    
+    # Ledger rows left over belong to owners that no longer exist
+    for entry in stored.values():
+        db.session.delete(entry)
+    
+    if apply:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return drifted
+
 @login_manager.user_loader
 def load_user(id):
     return User.query.get(int(id))
\ No newline at end of file
@@ -0,0 +1,96 @@
+import base64
+import json
+from datetime import date, datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_
+
+class KeysetPage:
+    """One page of rows plus the cursor that continues after its last row"""
+    
+    def __init__(self, items, next_cursor, per_page, cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+        self.cursor = cursor
+    
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+    
+    @property
+    def is_first(self):
+        return self.cursor is None
+    
+    def __iter__(self):
+        return iter(self.items)
+    
+    def __len__(self):
+        return len(self.items)
+
+def _encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, (date, datetime)) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_cursor(cursor, keys):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if len(raw) != len(keys):
+            return None
+        
+        values = []
+        for (column, _), value in zip(keys, raw):
+            python_type = column.type.python_type
+            if value is not None and python_type in (date, datetime):
+                value = python_type.fromisoformat(value)
+            values.append(value)
+        return values
+    except (ValueError, TypeError, json.JSONDecodeError):
+        # A mangled cursor just restarts from the first page
+        return None
+
+def _after(keys, values):
+    """WHERE clause selecting rows that sort strictly after `values`"""
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        step = column < values[i] if descending else column > values[i]
+        ties = [keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*ties, step))
+    return or_(*clauses)
+
+def page_size():
+    """Requested page size, clamped to the configured maximum"""
+    default = current_app.config['PAGE_SIZE']
+    try:
+        per_page = int(request.args.get('per_page', default))
+    except ValueError:
+        per_page = default
+    return max(1, min(per_page, current_app.config['PAGE_SIZE_MAX']))
+
+def keyset_paginate(query, keys, cursor=None, per_page=None):
+    """Fetch one page of `query` ordered by `keys`.
+    
+    `keys` is a list of (column, descending) pairs ending in a unique
+    column, e.g. [(ServiceJob.date_in, True), (ServiceJob.id, True)].
+    The page is read with WHERE (keys) after (cursor) ... LIMIT n + 1, so
+    its cost does not grow with how far into the list the user is.
+    """
+    per_page = per_page or page_size()
+    cursor = cursor if cursor is not None else request.args.get('cursor')
+    
+    values = _decode_cursor(cursor, keys) if cursor else None
+    if values is not None:
+        query = query.filter(_after(keys, values))
+    else:
+        cursor = None
+    
+    order = [column.desc() if descending else column.asc() for column, descending in keys]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = _encode_cursor([getattr(last, column.key) for column, _ in keys])
+    
+    return KeysetPage(rows, next_cursor, per_page, cursor)
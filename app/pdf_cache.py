@@ -0,0 +1,201 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from flask import current_app, send_file
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models import CarOwner, Car, ServiceJob, ServiceItem, Transaction
+
+# Bump when the PDF layout in pdfs.py changes, so old renders stop matching
+PDF_LAYOUT_VERSION = 2
+
+class PDFCache:
+    """Two-tier cache of rendered PDFs keyed by a hash of everything printed on them.
+    
+    A key only ever maps to one document, so entries never go stale; the
+    session hooks below just drop superseded renders early. Recently used
+    documents stay in a bounded in-memory LRU, and every document is also
+    written to a directory that is trimmed oldest-first past its size limit.
+    """
+    
+    def __init__(self):
+        self.directory = None
+        self.memory_items = 32
+        self.disk_bytes = 100 * 1024 * 1024
+        self._memory = OrderedDict()
+        self._tags = {}
+        self._disk_used = None
+        self._lock = threading.Lock()
+    
+    def configure(self, directory, memory_items, disk_bytes):
+        self.directory = directory
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        os.makedirs(directory, exist_ok=True)
+    
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.pdf')
+    
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        try:
+            with open(self.path(key), 'rb') as handle:
+                data = handle.read()
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+    
+    def put(self, key, data, tags=()):
+        self._remember(key, data, tags)
+        if not os.path.exists(self.path(key)):
+            temporary = f'{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temporary, 'wb') as handle:
+                handle.write(data)
+            os.replace(temporary, self.path(key))
+            self._grow_disk(key, len(data))
+    
+    def fetch(self, key, render, tags=()):
+        """Bytes for `key`, rendering and storing them on a miss"""
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data, tags)
+        elif tags:
+            self._remember(key, data, tags)
+        return data
+    
+    def ensure(self, key, render, tags=()):
+        """Make sure `key` is on disk without reading it back, rendering on a miss"""
+        if os.path.exists(self.path(key)):
+            with self._lock:
+                for tag in tags:
+                    self._tags.setdefault(tag, set()).add(key)
+        else:
+            self.put(key, render(), tags)
+        return self.path(key)
+    
+    def _remember(self, key, data, tags=()):
+        with self._lock:
+            self._memory[key] = data
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+    
+    def _grow_disk(self, key, size):
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                                      if entry.name.endswith('.pdf'))
+            else:
+                self._disk_used += size
+            over = self._disk_used > self.disk_bytes
+        if over:
+            self._evict_disk(keep=key)
+    
+    def _evict_disk(self, keep):
+        # Oldest first, down to 90% of the limit so every write does not trigger a scan.
+        # The document just written is about to be served, so it always stays.
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith('.pdf')),
+                         key=lambda entry: entry.stat().st_mtime)
+        used = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if used <= self.disk_bytes * 0.9:
+                break
+            if entry.name == f'{keep}.pdf':
+                continue
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                used -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_used = used
+    
+    def discard_tags(self, tags):
+        """Drop every document rendered from one of `tags`, e.g. ('job', 12)"""
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._tags.pop(tag, ()))
+            for key in keys:
+                self._memory.pop(key, None)
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+        if keys:
+            with self._lock:
+                self._disk_used = None
+
+pdf_cache = PDFCache()
+
+def init_pdf_cache(app):
+    directory = app.config.get('PDF_CACHE_DIR') or os.path.join(app.instance_path, 'pdf_cache')
+    pdf_cache.configure(directory, app.config['PDF_CACHE_MEMORY_ITEMS'], app.config['PDF_CACHE_DISK_MB'] * 1024 * 1024)
+
+def document_key(kind, content):
+    """Content address for a document: its kind, layout version, garage details and `content`"""
+    config = current_app.config
+    garage = [config['GARAGE_NAME'], config['GARAGE_ADDRESS'], config['GARAGE_PHONE'], config['GARAGE_EMAIL']]
+    raw = json.dumps([kind, PDF_LAYOUT_VERSION, garage, content], default=str, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def send_pdf(document, download_name):
+    """Serve a (key, render, tags) document from the disk tier with ETag/Last-Modified,
+    so a repeat download of an unchanged document is answered with a 304"""
+    key, render, tags = document
+    path = pdf_cache.ensure(key, render, tags)
+    try:
+        return send_file(path, mimetype='application/pdf', as_attachment=True,
+                         download_name=download_name, etag=key, conditional=True)
+    except FileNotFoundError:
+        # Evicted or discarded by another thread or worker since ensure(): serve it from memory
+        return send_file(io.BytesIO(pdf_cache.fetch(key, render, tags)), mimetype='application/pdf',
+                         as_attachment=True, download_name=download_name, etag=key, conditional=True)
+
+def pdf_bytes(document):
+    key, render, tags = document
+    return pdf_cache.fetch(key, render, tags)
+
+# ========== SESSION HOOKS ==========
+def _tags_for(instance):
+    if isinstance(instance, ServiceItem):
+        return [('job', instance.service_job_id)]
+    if isinstance(instance, ServiceJob):
+        return [('job', instance.id)]
+    if isinstance(instance, Transaction):
+        # Receipts print the owner's remaining balance
+        return [('payment', instance.id), ('balance', instance.owner_id)]
+    if isinstance(instance, Car):
+        return [('car', instance.id)]
+    if isinstance(instance, CarOwner):
+        return [('owner', instance.id)]
+    return []
+
+@event.listens_for(Session, 'after_flush')
+def _collect_pdf_tags(session, flush_context):
+    tags = session.info.setdefault('pdf_tags', set())
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags.update(_tags_for(instance))
+
+@event.listens_for(Session, 'after_commit')
+def _discard_on_commit(session):
+    tags = session.info.pop('pdf_tags', None)
+    if tags and pdf_cache.directory:
+        pdf_cache.discard_tags(tags)
+
+@event.listens_for(Session, 'after_rollback')
+def _keep_on_rollback(session):
+    session.info.pop('pdf_tags', None)
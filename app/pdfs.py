@@ -0,0 +1,319 @@
+import io
+import os
+from flask import current_app
+from fpdf import FPDF
+from fpdf.image_parsing import get_img_info
+from fpdf.fpdf import ImageInfo
+from PIL import Image
+from app.statements import statement_summary, iter_statement_lines
+
+# fpdf2 and Pillow take longer to import than the rest of the app together, so this
+# module is only imported on the first render (see _render() in utils.py)
+
+class Letterhead:
+    """Garage header shared by every generated PDF.
+    
+    The logo is decoded, scaled to its printed width at LOGO_DPI and
+    re-encoded as JPEG once per process; each document then embeds the
+    prepared image stream as is instead of re-reading and re-compressing
+    the PNG. The garage details are read from config at the same time.
+    """
+    LOGO_WIDTH_MM = 33
+    LOGO_DPI = 200
+    LOGO_NAME = 'letterhead-logo'
+    
+    def __init__(self, config, root_path):
+        self.name = config['GARAGE_NAME']
+        self.address = config['GARAGE_ADDRESS']
+        self.phone_line = f"Tel: {config['GARAGE_PHONE']}"
+        self.email_line = f"Email: {config['GARAGE_EMAIL']}"
+        self.logo = self._prepare_logo(os.path.join(root_path, 'static', 'images', 'garage_logo.png'))
+    
+    def _prepare_logo(self, path):
+        if not os.path.exists(path):
+            return None
+        with Image.open(path) as image:
+            width = round(self.LOGO_WIDTH_MM / 25.4 * self.LOGO_DPI)
+            if image.width > width:
+                image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True)
+        return get_img_info(self.LOGO_NAME, buffer, 'DCTDecode')
+    
+    def embed_logo(self, pdf):
+        # Registering the prepared stream under a name makes fpdf2 reuse it as is
+        if self.logo is None:
+            return
+        if self.LOGO_NAME not in pdf.images:
+            pdf.images[self.LOGO_NAME] = ImageInfo(self.logo, i=len(pdf.images) + 1, usages=0, iccp_i=None)
+        pdf.image(self.LOGO_NAME, 10, 8, self.LOGO_WIDTH_MM)
+
+_letterheads = {}
+
+def get_letterhead():
+    config = current_app.config
+    key = (current_app.root_path, config['GARAGE_NAME'], config['GARAGE_ADDRESS'],
+           config['GARAGE_PHONE'], config['GARAGE_EMAIL'])
+    if key not in _letterheads:
+        _letterheads[key] = Letterhead(config, current_app.root_path)
+    return _letterheads[key]
+
+class PDF(FPDF):
+    """A4 document with the garage letterhead, compressed page streams and core fonts only"""
+    
+    def __init__(self):
+        super().__init__()
+        self.letterhead = get_letterhead()
+        self.set_compression(True)
+    
+    def header(self):
+        letterhead = self.letterhead
+        letterhead.embed_logo(self)
+        
+        # Garage info
+        self.set_font('helvetica', 'B', 16)
+        self.cell(80)
+        self.cell(30, 10, letterhead.name, 0, 0, 'C')
+        self.ln(5)
+        
+        self.set_font('helvetica', '', 10)
+        self.cell(80)
+        self.cell(30, 10, letterhead.address, 0, 0, 'C')
+        self.ln(4)
+        
+        self.cell(80)
+        self.cell(30, 10, letterhead.phone_line, 0, 0, 'C')
+        self.ln(4)
+        
+        self.cell(80)
+        self.cell(30, 10, letterhead.email_line, 0, 0, 'C')
+        self.ln(10)
+        
+        # Line break
+        self.line(10, 30, 200, 30)
+
+def generate_quotation_pdf(service_job):
+    """Generate quotation PDF for a service job"""
+    pdf = PDF()
+    pdf.add_page()
+    
+    # Title
+    pdf.set_font('helvetica', 'B', 14)
+    pdf.cell(0, 10, 'QUOTATION', 0, 1, 'C')
+    pdf.ln(5)
+    
+    # Customer and car info
+    pdf.set_font('helvetica', 'B', 12)
+    pdf.cell(0, 10, 'Customer & Vehicle Details:', 0, 1)
+    pdf.set_font('helvetica', '', 10)
+    
+    owner = service_job.car.owner
+    car = service_job.car
+    
+    pdf.cell(0, 6, f"Customer: {owner.name}", 0, 1)
+    pdf.cell(0, 6, f"Phone: {owner.phone}", 0, 1)
+    if owner.email:
+        pdf.cell(0, 6, f"Email: {owner.email}", 0, 1)
+    pdf.cell(0, 6, f"Vehicle: {car.make} {car.model} ({car.year})", 0, 1)
+    pdf.cell(0, 6, f"License Plate: {car.license_plate}", 0, 1)
+    pdf.cell(0, 6, f"VIN: {car.vin or 'N/A'}", 0, 1)
+    pdf.cell(0, 6, f"Date In: {service_job.date_in}", 0, 1)
+    pdf.cell(0, 6, f"Mileage In: {service_job.mileage_in:,} km", 0, 1)
+    pdf.ln(5)
+    
+    # Services table header
+    pdf.set_font('helvetica', 'B', 12)
+    pdf.cell(0, 10, 'Proposed Services:', 0, 1)
+    
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(120, 8, 'Description', 1, 0)
+    pdf.cell(30, 8, 'Status', 1, 0, 'C')
+    pdf.cell(30, 8, 'Cost (R)', 1, 1, 'R')
+    
+    # Services items
+    pdf.set_font('helvetica', '', 10)
+    total = 0
+    for item in service_job.service_items:
+        status = "Fixed" if item.is_fixed else "Pending"
+        pdf.cell(120, 8, item.description, 1, 0)
+        pdf.cell(30, 8, status, 1, 0, 'C')
+        pdf.cell(30, 8, f"{item.cost:,.2f}", 1, 1, 'R')
+        total += item.cost
+    
+    # Total
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(150, 8, 'TOTAL QUOTATION:', 1, 0, 'R')
+    pdf.cell(30, 8, f"{total:,.2f}", 1, 1, 'R')
+    
+    # Notes
+    pdf.ln(10)
+    pdf.set_font('helvetica', 'I', 9)
+    pdf.multi_cell(0, 5, "Note: This is a quotation. Final invoice may vary based on actual work completed. Prices include VAT.")
+    
+    return bytes(pdf.output())
+
+def generate_invoice_pdf(service_job):
+    """Generate invoice PDF for a completed service job"""
+    pdf = PDF()
+    pdf.add_page()
+    
+    # Title
+    pdf.set_font('helvetica', 'B', 14)
+    pdf.cell(0, 10, 'INVOICE', 0, 1, 'C')
+    pdf.ln(5)
+    
+    # Customer and car info
+    pdf.set_font('helvetica', 'B', 12)
+    pdf.cell(0, 10, 'Customer & Vehicle Details:', 0, 1)
+    pdf.set_font('helvetica', '', 10)
+    
+    owner = service_job.car.owner
+    car = service_job.car
+    
+    pdf.cell(0, 6, f"Customer: {owner.name}", 0, 1)
+    pdf.cell(0, 6, f"Phone: {owner.phone}", 0, 1)
+    if owner.email:
+        pdf.cell(0, 6, f"Email: {owner.email}", 0, 1)
+    pdf.cell(0, 6, f"Vehicle: {car.make} {car.model} ({car.year})", 0, 1)
+    pdf.cell(0, 6, f"License Plate: {car.license_plate}", 0, 1)
+    pdf.cell(0, 6, f"Date In: {service_job.date_in}", 0, 1)
+    pdf.cell(0, 6, f"Date Out: {service_job.date_out}", 0, 1)
+    pdf.cell(0, 6, f"Mileage In: {service_job.mileage_in:,} km", 0, 1)
+    if service_job.mileage_out:
+        pdf.cell(0, 6, f"Mileage Out: {service_job.mileage_out:,} km", 0, 1)
+    pdf.ln(5)
+    
+    # Services table header (only fixed items)
+    pdf.set_font('helvetica', 'B', 12)
+    pdf.cell(0, 10, 'Services Completed:', 0, 1)
+    
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(140, 8, 'Description', 1, 0)
+    pdf.cell(40, 8, 'Cost (R)', 1, 1, 'R')
+    
+    # Services items (only fixed ones)
+    pdf.set_font('helvetica', '', 10)
+    total = 0
+    for item in service_job.service_items:
+        if item.is_fixed:  # Only include fixed items in invoice
+            pdf.cell(140, 8, item.description, 1, 0)
+            pdf.cell(40, 8, f"{item.cost:,.2f}", 1, 1, 'R')
+            total += item.cost
+    
+    # Total
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(140, 8, 'TOTAL DUE:', 1, 0, 'R')
+    pdf.cell(40, 8, f"{total:,.2f}", 1, 1, 'R')
+    
+    # Payment terms
+    pdf.ln(10)
+    pdf.set_font('helvetica', 'I', 9)
+    pdf.multi_cell(0, 5, "Payment Terms: Payment due upon receipt. Thank you for your business!")
+    
+    return bytes(pdf.output())
+
+def generate_receipt_pdf(payment):
+    """Generate receipt PDF for a payment"""
+    pdf = PDF()
+    pdf.add_page()
+    
+    # Title
+    pdf.set_font('helvetica', 'B', 14)
+    pdf.cell(0, 10, 'PAYMENT RECEIPT', 0, 1, 'C')
+    pdf.ln(5)
+    
+    # Customer info
+    pdf.set_font('helvetica', 'B', 12)
+    pdf.cell(0, 10, 'Payment Details:', 0, 1)
+    pdf.set_font('helvetica', '', 10)
+    
+    owner = payment.owner
+    
+    pdf.cell(0, 6, f"Customer: {owner.name}", 0, 1)
+    pdf.cell(0, 6, f"Phone: {owner.phone}", 0, 1)
+    if owner.email:
+        pdf.cell(0, 6, f"Email: {owner.email}", 0, 1)
+    pdf.cell(0, 6, f"Receipt Date: {payment.date}", 0, 1)
+    pdf.cell(0, 6, f"Receipt Number: RCP{payment.id:06d}", 0, 1)
+    pdf.ln(5)
+    
+    # Payment details
+    pdf.set_font('helvetica', 'B', 12)
+    pdf.cell(0, 10, 'Payment Information:', 0, 1)
+    
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(100, 8, 'Description', 1, 0)
+    pdf.cell(40, 8, 'Amount (R)', 1, 1, 'R')
+    
+    pdf.set_font('helvetica', '', 10)
+    pdf.cell(100, 8, payment.description or 'Payment received', 1, 0)
+    pdf.cell(40, 8, f"{payment.amount:,.2f}", 1, 1, 'R')
+    
+    # New balance
+    pdf.ln(5)
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(100, 8, 'Remaining Balance:', 1, 0, 'R')
+    pdf.cell(40, 8, f"{owner.balance:,.2f}", 1, 1, 'R')
+    
+    # Thank you message
+    pdf.ln(10)
+    pdf.set_font('helvetica', 'I', 9)
+    pdf.multi_cell(0, 5, "Thank you for your payment! We appreciate your business.")
+    
+    return bytes(pdf.output())
+
+def generate_statement_pdf(owner, start, end):
+    """Generate an account statement PDF for an owner over a period, with running balances"""
+    summary = statement_summary(owner.id, start, end)
+    
+    pdf = PDF()
+    pdf.add_page()
+    
+    # Title
+    pdf.set_font('helvetica', 'B', 14)
+    pdf.cell(0, 10, 'ACCOUNT STATEMENT', 0, 1, 'C')
+    pdf.ln(5)
+    
+    # Customer info
+    pdf.set_font('helvetica', '', 10)
+    pdf.cell(0, 6, f"Customer: {owner.name}", 0, 1)
+    pdf.cell(0, 6, f"Phone: {owner.phone}", 0, 1)
+    if owner.email:
+        pdf.cell(0, 6, f"Email: {owner.email}", 0, 1)
+    pdf.cell(0, 6, f"Period: {start or 'Opening'} to {end}", 0, 1)
+    pdf.ln(5)
+    
+    def table_header():
+        pdf.set_font('helvetica', 'B', 10)
+        pdf.cell(25, 8, 'Date', 1, 0)
+        pdf.cell(77, 8, 'Description', 1, 0)
+        pdf.cell(26, 8, 'Invoiced (R)', 1, 0, 'R')
+        pdf.cell(26, 8, 'Paid (R)', 1, 0, 'R')
+        pdf.cell(26, 8, 'Balance (R)', 1, 1, 'R')
+        pdf.set_font('helvetica', '', 10)
+    
+    table_header()
+    pdf.cell(154, 8, 'Opening balance', 1, 0)
+    pdf.cell(26, 8, f"{summary['opening']:,.2f}", 1, 1, 'R')
+    
+    # Rows arrive in batches with their running balance already computed
+    for line in iter_statement_lines(owner.id, start, end, summary['opening']):
+        if pdf.will_page_break(8):
+            pdf.add_page()
+            table_header()
+        invoiced = f"{line.amount:,.2f}" if line.transaction_type == 'invoice' else ''
+        paid = f"{line.amount:,.2f}" if line.transaction_type == 'payment' else ''
+        pdf.cell(25, 8, line.date.strftime('%d %b %Y'), 1, 0)
+        pdf.cell(77, 8, (line.description or '')[:45], 1, 0)
+        pdf.cell(26, 8, invoiced, 1, 0, 'R')
+        pdf.cell(26, 8, paid, 1, 0, 'R')
+        pdf.cell(26, 8, f"{line.balance:,.2f}", 1, 1, 'R')
+    
+    # Closing balance
+    pdf.set_font('helvetica', 'B', 10)
+    pdf.cell(102, 8, 'CLOSING BALANCE:', 1, 0, 'R')
+    pdf.cell(26, 8, f"{summary['invoiced']:,.2f}", 1, 0, 'R')
+    pdf.cell(26, 8, f"{summary['paid']:,.2f}", 1, 0, 'R')
+    pdf.cell(26, 8, f"{summary['closing']:,.2f}", 1, 1, 'R')
+    
+    return bytes(pdf.output())
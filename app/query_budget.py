@@ -0,0 +1,35 @@
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+def init_query_budget(app, budgets):
+    """Count SQL statements per request and flag views that go over budget.
+    
+    `budgets` maps an endpoint name to the most statements it may issue,
+    whatever the number of rows on the page. Only active when
+    ENFORCE_STATEMENT_BUDGETS is set; under TESTING an overrun raises
+    (tests/test_statement_budgets.py).
+    """
+    if not app.config.get('ENFORCE_STATEMENT_BUDGETS'):
+        return
+    
+    @app.before_request
+    def start_counting():
+        g.sql_statements = 0
+    
+    @app.after_request
+    def check_budget(response):
+        budget = budgets.get(request.endpoint)
+        issued = g.get('sql_statements', 0)
+        if budget is not None and issued > budget:
+            message = f'{request.endpoint} issued {issued} SQL statements, budget is {budget}'
+            if app.testing:
+                raise AssertionError(message)
+            app.logger.warning(message)
+        return response
+
+# Registered once for every engine; counts only in requests of apps that enforce budgets
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_statements' in g:
+        g.sql_statements += 1
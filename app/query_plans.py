@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+
+# Execution option naming a hot query; set with hot_query() where the query is built
+HOT_QUERY = 'hot_query'
+
+def hot_query(statement, name):
+    """Tag a query (ORM Query, select or update) as hot: its plan must never scan a whole table.
+    
+    tests/test_query_plans.py drives the pages that run each tagged query and
+    checks the SQL they actually send with EXPLAIN QUERY PLAN.
+    """
+    return statement.execution_options(**{HOT_QUERY: name})
+
+@contextmanager
+def recording_hot_queries(engine):
+    """Collect (name, sql, parameters) for every tagged statement `engine` runs inside the block"""
+    recorded = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        name = context.execution_options.get(HOT_QUERY) if context is not None else None
+        if name:
+            recorded.append((name, statement, parameters))
+    
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield recorded
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+def table_scans(connection, statement, parameters, tables):
+    """Steps of a statement's SQLite query plan that read all of one of `tables`.
+    
+    Scans of subqueries and window results are left out: what matters is how
+    the base tables are reached.
+    """
+    plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)
+    scans = []
+    for row in plan:
+        words = row.detail.split()
+        if words[0] == 'SCAN' and words[1].strip('"') in tables:
+            scans.append(row.detail)
+    return scans
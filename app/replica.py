@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, request, session as cookie_session, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run a single worker
+    fcntl = None
+
+# Bind key of the replica in SQLALCHEMY_BINDS
+REPLICA_BIND = 'replica'
+
+class RoutingSession(Session):
+    """db.session that reads from the replica inside @read_replica views.
+    
+    Flushes always go to the primary, and a view that writes stays on the
+    primary for the rest of the request so it reads its own changes.
+    """
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('use_replica'):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+def read_replica(view):
+    """Serve a read-only view from the replica, unless the user wrote something the
+    replica may not have yet; goes below @login_required so the user loads from the primary"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = replica_has_writes_since(cookie_session.get('last_write_at', 0))
+        return view(*args, **kwargs)
+    return wrapper
+
+def replica_has_writes_since(timestamp):
+    """Whether the replica is known to hold everything committed up to `timestamp`"""
+    syncer = current_app.extensions.get('replica_sync')
+    if syncer is not None:
+        synced_at = syncer.synced_at()
+        return synced_at is not None and synced_at > timestamp
+    if REPLICA_BIND not in current_app.config['SQLALCHEMY_BINDS']:
+        return False
+    return time.time() - current_app.config['REPLICA_MAX_LAG_SECONDS'] > timestamp
+
+# ========== READ-AFTER-WRITE ==========
+@event.listens_for(OrmSession, 'after_flush')
+def _note_write(session, flush_context):
+    session.info['wrote'] = True
+    if has_request_context():
+        g.use_replica = False
+
+@event.listens_for(OrmSession, 'after_commit')
+def _remember_write(session):
+    # The user's next replica reads wait until the replica has caught up with this
+    if session.info.pop('wrote', False) and has_request_context():
+        cookie_session['last_write_at'] = time.time()
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
+
+# ========== LOCAL SQLITE REPLICA ==========
+class ReplicaSync:
+    """Keeps a second SQLite file in step with the primary.
+    
+    Every REPLICA_SYNC_SECONDS the primary is copied onto the replica with the
+    stepped backup copy used for backups, so writers are never held up for
+    the whole copy and replica readers keep their WAL snapshot meanwhile.
+    Nothing is copied while PRAGMA data_version shows no new commits. One
+    process per host syncs (a lock file decides); all of them read the time
+    of the last sync from the marker file next to the replica.
+    """
+    
+    def __init__(self, app, primary_path, replica_path):
+        self.app = app
+        self.primary_path = primary_path
+        self.replica_path = replica_path
+        self.marker_path = f'{replica_path}.synced'
+        self.thread = None
+        self._lock_file = None
+        self._start_lock = threading.Lock()
+    
+    def synced_at(self):
+        """Primary commits before this time are on the replica (None: never synced)"""
+        try:
+            with open(self.marker_path) as handle:
+                return float(handle.read())
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def sync_once(self):
+        # Not at the top: this module loads before app.db exists
+        from app.backups import BackupRun, copy_database
+        config = self.app.config
+        started = time.time()
+        run = BackupRun('replica', 'database', False)
+        copy_database(self.primary_path, self.replica_path, run, config['BACKUP_PAGES_PER_STEP'],
+                      config['BACKUP_STEP_SLEEP'], config['BACKUP_MAX_RESTARTS'])
+        with open(f'{self.marker_path}.tmp', 'w') as handle:
+            handle.write(repr(started))
+        os.replace(f'{self.marker_path}.tmp', self.marker_path)
+        return run
+    
+    def _acquire_process_lock(self):
+        handle = open(f'{self.replica_path}.lock', 'w')
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+        self._lock_file = handle
+        return True
+    
+    def run_forever(self):
+        interval = self.app.config['REPLICA_SYNC_SECONDS']
+        while not self._acquire_process_lock():
+            time.sleep(interval)
+        watch = sqlite3.connect(self.primary_path)
+        last_version = None
+        while True:
+            try:
+                version = watch.execute('PRAGMA data_version').fetchone()[0]
+                if version != last_version or self.synced_at() is None:
+                    self.sync_once()
+                    last_version = version
+            except Exception:
+                self.app.logger.exception('Replica sync failed')
+            time.sleep(interval)
+    
+    def start(self):
+        with self._start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run_forever, name='replica-sync', daemon=True)
+                self.thread.start()
+
+def local_replica(app):
+    """The ReplicaSync for a SQLite primary with a SQLite replica file, else None"""
+    db = app.extensions['sqlalchemy']
+    with app.app_context():
+        replica = db.engines.get(REPLICA_BIND)
+        if replica is None or db.engine.url.get_backend_name() != 'sqlite' or replica.url.get_backend_name() != 'sqlite':
+            return None
+        return ReplicaSync(app, db.engine.url.database, replica.url.database)
+
+def init_replica(app):
+    """With a local SQLite replica, track its syncs and keep it in sync from the first request"""
+    syncer = local_replica(app)
+    if syncer is None:
+        return
+    app.extensions['replica_sync'] = syncer
+    if not app.config['REPLICA_SYNC_SECONDS']:
+        return
+    
+    @app.before_request
+    def _start_replica_sync():
+        if syncer.thread is None and request.endpoint != 'static':
+            syncer.start()
@@ -1,19 +1,167 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, current_app, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
-from sqlalchemy import func, extract
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import func, extract, case, select, literal
+from sqlalchemy.orm import joinedload, selectinload, contains_eager, raiseload, with_expression, defer
 from app import db
-from app.models import User, CarOwner, Car, ServiceJob, ServiceItem, Transaction, ServiceCategory
-from app.forms import LoginForm, CarOwnerForm, CarForm, ServiceJobForm, ServiceItemForm, PaymentForm, SearchForm, UserProfileForm, BackupForm, EmailForm, QuickServiceItemForm
-from app.utils import send_email, generate_quotation_pdf, generate_invoice_pdf, generate_receipt_pdf
-from app.utils import send_quotation_email, send_invoice_email, backup_database, format_currency, get_dashboard_stats
+from app.models import User, CarOwner, Car, ServiceJob, ServiceItem, Transaction, ServiceCategory, OwnerBalance, EmailOutbox, ReminderCampaign, CampaignRecipient
+from app.forms import LoginForm, CarOwnerForm, CarForm, ServiceJobForm, ServiceItemForm, PaymentForm, ReminderCampaignForm, SearchForm, UserProfileForm, BackupForm, EmailForm, QuickServiceItemForm
+from app.utils import send_email, quotation_document, invoice_document, receipt_document, statement_document
+from app.statements import statement_summary, statement_lines, statement_order, recent_statement_lines
+from app.pdf_cache import send_pdf
+from app.bulk_pdfs import BULK_KINDS, BulkRun, month_range, register_run, get_run, generate_bulk_zip
+from app.pagination import keyset_paginate
+from app.query_plans import hot_query
+from app.dashboard_stream import REFUSED_RETRY_SECONDS
+from app.replica import read_replica
+from app.conditional import conditional, row_version, table_version
+from app.idempotency import idempotent
+from app.exports import EXPORTS, generate_csv
+from app.search import search_entities
+from app.lookup import ensure_lookup_index, picker_choices
+from app.mailer import EMAIL_STATUSES, requeue_email
+from app.backups import start_backup, get_backup_run, find_manifest, list_backups, backup_directory, stream_snapshot_zip
+from app.campaigns import CAMPAIGN_OUTCOMES, create_campaign, campaign_results, is_preparing, start_preparing
+from app.utils import send_quotation_email, send_invoice_email, format_currency, get_dashboard_stats, dashboard_snapshot, owners_owing
 from datetime import datetime, date, timedelta
-import io
 import json
 import os
-import csv
 
 main = Blueprint('main', __name__)
 
+# ========== LOADER PROFILES ==========
+# Each list view declares up front everything its template dereferences.
+# load_profile() closes every chain with raiseload('*'), so a template that
+# reaches for an undeclared relationship fails loudly instead of firing one
+# query per row. Detail pages keep the default lazy loading.
+def _car_job_count():
+    return with_expression(Car.job_count, select(func.count(ServiceJob.id)).where(
+        ServiceJob.car_id == Car.id).scalar_subquery())
+
+def _car_last_service_date():
+    return with_expression(Car.last_service_date, select(func.max(ServiceJob.date_in)).where(
+        ServiceJob.car_id == Car.id).scalar_subquery())
+
+def _owner_car_count():
+    return with_expression(CarOwner.car_count, select(func.count(Car.id)).where(
+        Car.owner_id == CarOwner.id).scalar_subquery())
+
+def _owner_with_ledger(path):
+    return joinedload(path).options(joinedload(CarOwner.ledger).raiseload('*'), raiseload('*'))
+
+LOAD_PROFILES = {
+    'car_owners': lambda: [joinedload(CarOwner.ledger).raiseload('*'), _owner_car_count()],
+    'cars': lambda: [_owner_with_ledger(Car.owner), _car_job_count(), _car_last_service_date()],
+    'jobs': lambda: [joinedload(ServiceJob.car).options(_owner_with_ledger(Car.owner), raiseload('*'))],
+    'payments': lambda: [_owner_with_ledger(Transaction.owner)],
+    'owners_owing': lambda: [contains_eager(CarOwner.ledger).raiseload('*')],
+    'search_owners': lambda: [
+        joinedload(CarOwner.ledger).raiseload('*'),
+        _owner_car_count(),
+        selectinload(CarOwner.cars).options(_car_job_count(), raiseload('*')),
+    ],
+    'search_cars': lambda: [_owner_with_ledger(Car.owner), _car_job_count(), _car_last_service_date()],
+    'campaign_recipients': lambda: [
+        _owner_with_ledger(CampaignRecipient.owner),
+        joinedload(CampaignRecipient.email_outbox).options(
+            defer(EmailOutbox.body), defer(EmailOutbox.attachment), raiseload('*')),
+    ],
+}
+
+def load_profile(name):
+    """Loader options for a list view, with every undeclared relationship set to raise"""
+    return LOAD_PROFILES[name]() + [raiseload('*')]
+
+def _load_ranked(model, ids, profile):
+    """Load rows of `model` by id with a loader profile, keeping the order of `ids`"""
+    if not ids:
+        return []
+    rows = {row.id: row for row in model.query.options(*load_profile(profile)).filter(model.id.in_(ids))}
+    return [rows[row_id] for row_id in ids if row_id in rows]
+
+def _init_picker(field, kind, preselect_arg=None):
+    """Give an async picker field (see /api/lookup) just its selected entity as a choice"""
+    ensure_lookup_index(current_app.config['LOOKUP_INDEX_MAX_AGE'])
+    if field.data is None and preselect_arg:
+        field.data = request.args.get(preselect_arg, type=int)
+    field.choices = picker_choices(kind, field.data)
+
+# Keyset sort orders for the paginated lists, each ending in the primary key
+JOB_ORDER = [(ServiceJob.date_in, True), (ServiceJob.id, True)]
+CAR_ORDER = [(Car.make, False), (Car.model, False), (Car.id, False)]
+OWNER_ORDER = [(CarOwner.name, False), (CarOwner.id, False)]
+PAYMENT_ORDER = [(Transaction.date, True), (Transaction.id, True)]
+OUTBOX_ORDER = [(EmailOutbox.created_at, True), (EmailOutbox.id, True)]
+RECIPIENT_ORDER = [(CampaignRecipient.id, False)]
+
+def jobs_query(status):
+    """Jobs for the jobs list and /api/jobs, optionally of one status"""
+    query = ServiceJob.query.options(*load_profile('jobs'))
+    if status != 'all':
+        query = query.filter_by(status=status)
+    return hot_query(query, 'jobs by status')
+
+def payments_query():
+    """Payments for the payments list and /api/payments"""
+    return hot_query(Transaction.query.options(*load_profile('payments')).filter_by(transaction_type='payment'),
+                     'payments list')
+
+# Reports served by the report_<type> routes
+REPORT_TYPES = ('outstanding_balances', 'recent_payments', 'active_jobs', 'service_history')
+
+# Most SQL statements each list page may issue, whatever its row count
+# (the logged-in user lookup included). Checked by app/query_budget.py and
+# asserted for a few and for ten times as many rows by tests/test_statement_budgets.py.
+STATEMENT_BUDGETS = {
+    'main.dashboard': 4,
+    'main.car_owners': 4,
+    'main.cars': 4,
+    'main.jobs': 4,
+    'main.payments': 3,
+    'main.search': 4,
+    'main.api_search': 4,
+    'main.report_outstanding_balances': 3,
+    'main.report_recent_payments': 3,
+    'main.report_active_jobs': 4,
+    'main.report_service_history': 4,
+    'main.generate_report': 1,
+    'main.api_jobs': 2,
+    'main.api_cars': 2,
+    'main.api_car_owners': 2,
+    'main.api_payments': 2,
+    'main.api_lookup': 2,
+    'main.owner_statement': 4,
+    'main.email_outbox': 3,
+    'main.reminder_campaigns': 3,
+    'main.reminder_campaign': 4,
+}
+
+# ========== VERSION TOKENS ==========
+# What each conditionally served page shows, for @conditional. Every service item
+# write also touches its job's updated_at (the job totals hook in models.py),
+# so a job's row stands for its items.
+def _job_version(job_id):
+    job = select(ServiceJob.car_id).where(ServiceJob.id == job_id).scalar_subquery()
+    owner = select(Car.owner_id).where(Car.id == job).scalar_subquery()
+    return [row_version(ServiceJob, job_id), row_version(Car, job), row_version(CarOwner, owner),
+            select(OwnerBalance.updated_at).where(OwnerBalance.owner_id == owner).scalar_subquery()]
+
+def _car_version(car_id):
+    owner = select(Car.owner_id).where(Car.id == car_id).scalar_subquery()
+    return [row_version(Car, car_id), row_version(CarOwner, owner),
+            select(OwnerBalance.updated_at).where(OwnerBalance.owner_id == owner).scalar_subquery(),
+            *table_version(ServiceJob, ServiceJob.car_id == car_id)]
+
+def _report_version(*models):
+    # Reports count days up to today, so they also change at midnight
+    def version():
+        return [literal(date.today()), *(column for model in models for column in table_version(model))]
+    return version
+
+# Pages with forms are rendered again at least this often, well inside
+# Flask-WTF's one-hour CSRF token lifetime
+FORM_PAGE_FRESH_FOR = 1800
+
 # ========== AUTHENTICATION ROUTES ==========
 @main.route('/')
 @main.route('/dashboard')
@@ -56,12 +204,16 @@ def logout():
 @main.route('/car_owners')
 @login_required
 def car_owners():
-    owners = CarOwner.query.order_by(CarOwner.name).all()
-    total_outstanding = sum(owner.balance for owner in owners)
-    owners_with_balance = len([owner for owner in owners if owner.balance > 0])
+    owners = keyset_paginate(CarOwner.query.options(*load_profile('car_owners')), OWNER_ORDER)
+    total_owners = CarOwner.query.count()
+    total_outstanding, owners_with_balance = db.session.query(
+        func.coalesce(func.sum(OwnerBalance.balance), 0),
+        func.count(case((OwnerBalance.balance > 0, 1)))
+    ).one()
     
     return render_template('pages/car_owners.html', 
                          owners=owners, 
+                         total_owners=total_owners, 
                          total_outstanding=total_outstanding,
                          owners_with_balance=owners_with_balance)
 
@@ -87,16 +239,55 @@ def add_car_owner():
 @login_required
 def car_owner_detail(owner_id):
     owner = CarOwner.query.get_or_404(owner_id)
-    return render_template('pages/car_owner_detail.html', owner=owner)
+    recent_transactions = recent_statement_lines(owner.id)
+    return render_template('pages/car_owner_detail.html', owner=owner, recent_transactions=recent_transactions)
+
+def _statement_period():
+    """?start= and ?end= for a statement, defaulting to this month so far"""
+    start = date.fromisoformat(request.args['start']) if request.args.get('start') else date.today().replace(day=1)
+    end = date.fromisoformat(request.args['end']) if request.args.get('end') else date.today()
+    return start, end
+
+@main.route('/car_owners/<int:owner_id>/statement')
+@login_required
+def owner_statement(owner_id):
+    owner = CarOwner.query.get_or_404(owner_id)
+    try:
+        start, end = _statement_period()
+    except ValueError:
+        flash('❌ Invalid statement period, use YYYY-MM-DD', 'error')
+        return redirect(url_for('main.owner_statement', owner_id=owner_id))
+    
+    summary = statement_summary(owner.id, start, end)
+    query, lines = statement_lines(owner.id, start, end, summary['opening'])
+    page = keyset_paginate(query, statement_order(lines))
+    
+    return render_template('pages/statement.html',
+                         owner=owner,
+                         lines=page,
+                         summary=summary,
+                         start=start,
+                         end=end)
+
+@main.route('/car_owners/<int:owner_id>/statement.pdf')
+@login_required
+def owner_statement_pdf(owner_id):
+    owner = CarOwner.query.get_or_404(owner_id)
+    try:
+        start, end = _statement_period()
+    except ValueError:
+        flash('❌ Invalid statement period, use YYYY-MM-DD', 'error')
+        return redirect(url_for('main.owner_statement', owner_id=owner_id))
+    
+    return send_pdf(statement_document(owner, start, end), f'statement_{owner.id}_{start}_to_{end}.pdf')
 
 # ========== CAR ROUTES ==========
 @main.route('/cars')
 @login_required
 def cars():
-    cars = Car.query.order_by(Car.make, Car.model).all()
-    total_cars = len(cars)
-    cars_with_services = len([car for car in cars if car.service_jobs])
-    unique_owners = len(set(car.owner_id for car in cars))
+    cars = keyset_paginate(Car.query.options(*load_profile('cars')), CAR_ORDER)
+    total_cars, unique_owners = db.session.query(func.count(Car.id), func.count(Car.owner_id.distinct())).one()
+    cars_with_services = db.session.query(func.count(ServiceJob.car_id.distinct())).scalar()
     
     return render_template('pages/cars.html', 
                          cars=cars,
@@ -108,7 +299,7 @@ def cars():
 @login_required
 def add_car():
     form = CarForm()
-    form.owner_id.choices = [(owner.id, owner.name) for owner in CarOwner.query.order_by('name')]
+    _init_picker(form.owner_id, 'owner', 'owner_id')
     
     if form.validate_on_submit():
         car = Car(
@@ -129,25 +320,34 @@ def add_car():
 
 @main.route('/cars/<int:car_id>')
 @login_required
+@conditional(_car_version)
 def car_detail(car_id):
     car = Car.query.get_or_404(car_id)
-    return render_template('pages/car_detail.html', car=car)
+    
+    completed_jobs, active_jobs, total_spent = hot_query(db.session.query(
+        func.count(case((ServiceJob.status == 'completed', 1))),
+        func.count(case((ServiceJob.status == 'in_progress', 1))),
+        func.coalesce(func.sum(case((ServiceJob.status == 'completed', ServiceJob.total_cost))), 0)
+    ).filter(ServiceJob.car_id == car.id), 'car service history').one()
+    
+    return render_template('pages/car_detail.html', 
+                         car=car,
+                         completed_jobs=completed_jobs,
+                         active_jobs=active_jobs,
+                         total_spent=total_spent)
 
 # ========== SERVICE JOB ROUTES ==========
 @main.route('/jobs')
 @login_required
 def jobs():
     status_filter = request.args.get('status', 'all')
+    jobs = keyset_paginate(jobs_query(status_filter), JOB_ORDER)
     
-    query = ServiceJob.query
-    if status_filter != 'all':
-        query = query.filter_by(status=status_filter)
-    
-    jobs = query.order_by(ServiceJob.date_in.desc()).all()
-    
-    active_jobs_count = ServiceJob.query.filter_by(status='in_progress').count()
-    completed_jobs_count = ServiceJob.query.filter_by(status='completed').count()
-    total_jobs = ServiceJob.query.count()
+    active_jobs_count, completed_jobs_count, total_jobs = db.session.query(
+        func.count(case((ServiceJob.status == 'in_progress', 1))),
+        func.count(case((ServiceJob.status == 'completed', 1))),
+        func.count(ServiceJob.id)
+    ).one()
     total_revenue = db.session.query(func.sum(Transaction.amount)).filter_by(transaction_type='payment').scalar() or 0
     
     return render_template('pages/jobs.html', 
@@ -162,7 +362,7 @@ def jobs():
 @login_required
 def add_job():
     form = ServiceJobForm()
-    form.car_id.choices = [(car.id, f"{car.license_plate} - {car.make} {car.model}") for car in Car.query.order_by('license_plate')]
+    _init_picker(form.car_id, 'car', 'car_id')
     
     if form.validate_on_submit():
         job = ServiceJob(
@@ -180,6 +380,7 @@ def add_job():
 
 @main.route('/jobs/<int:job_id>')
 @login_required
+@conditional(_job_version, fresh_for=FORM_PAGE_FRESH_FOR)
 def job_detail(job_id):
     job = ServiceJob.query.get_or_404(job_id)
     service_item_form = ServiceItemForm()
@@ -192,6 +393,7 @@ def job_detail(job_id):
 
 @main.route('/jobs/<int:job_id>/add_service', methods=['POST'])
 @login_required
+@idempotent
 def add_service_item(job_id):
     job = ServiceJob.query.get_or_404(job_id)
     form = ServiceItemForm()
@@ -211,6 +413,7 @@ def add_service_item(job_id):
 
 @main.route('/jobs/<int:job_id>/add_quick_service', methods=['POST'])
 @login_required
+@idempotent
 def add_quick_service_item(job_id):
     job = ServiceJob.query.get_or_404(job_id)
     form = QuickServiceItemForm()
@@ -244,6 +447,7 @@ def add_quick_service_item(job_id):
 
 @main.route('/jobs/service/<int:service_id>/toggle', methods=['POST'])
 @login_required
+@idempotent
 def toggle_service_item(service_id):
     try:
         service_item = ServiceItem.query.get_or_404(service_id)
@@ -257,6 +461,7 @@ def toggle_service_item(service_id):
 
 @main.route('/jobs/service/<int:service_id>/delete', methods=['POST'])
 @login_required
+@idempotent
 def delete_service_item(service_id):
     try:
         service_item = ServiceItem.query.get_or_404(service_id)
@@ -269,6 +474,7 @@ def delete_service_item(service_id):
 
 @main.route('/jobs/<int:job_id>/complete', methods=['POST'])
 @login_required
+@idempotent
 def complete_job(job_id):
     job = ServiceJob.query.get_or_404(job_id)
     
@@ -298,27 +504,13 @@ def complete_job(job_id):
 @login_required
 def generate_quotation(job_id):
     job = ServiceJob.query.get_or_404(job_id)
-    pdf_bytes = generate_quotation_pdf(job)
-    
-    return send_file(
-        io.BytesIO(pdf_bytes),
-        download_name=f'quotation_{job.car.license_plate}_{date.today()}.pdf',
-        as_attachment=True,
-        mimetype='application/pdf'
-    )
+    return send_pdf(quotation_document(job), f'quotation_{job.car.license_plate}_{date.today()}.pdf')
 
 @main.route('/jobs/<int:job_id>/invoice')
 @login_required
 def generate_invoice(job_id):
     job = ServiceJob.query.get_or_404(job_id)
-    pdf_bytes = generate_invoice_pdf(job)
-    
-    return send_file(
-        io.BytesIO(pdf_bytes),
-        download_name=f'invoice_{job.car.license_plate}_{date.today()}.pdf',
-        as_attachment=True,
-        mimetype='application/pdf'
-    )
+    return send_pdf(invoice_document(job), f'invoice_{job.car.license_plate}_{date.today()}.pdf')
 
 @main.route('/jobs/<int:job_id>/send_quotation', methods=['POST'])
 @login_required
@@ -333,11 +525,11 @@ def send_quotation_email_route(job_id):
     try:
         success = send_quotation_email(job, recipient_email)
         if success:
-            flash('✅ Quotation sent successfully!', 'success')
+            flash(f'📨 Quotation queued for {recipient_email}, see the email outbox for delivery', 'success')
         else:
-            flash('❌ Failed to send quotation email', 'error')
+            flash('❌ Failed to queue quotation email', 'error')
     except Exception as e:
-        flash(f'❌ Error sending email: {str(e)}', 'error')
+        flash(f'❌ Error queueing email: {str(e)}', 'error')
     
     return redirect(url_for('main.job_detail', job_id=job_id))
 
@@ -354,33 +546,105 @@ def send_invoice_email_route(job_id):
     try:
         success = send_invoice_email(job, recipient_email)
         if success:
-            flash('✅ Invoice sent successfully!', 'success')
+            flash(f'📨 Invoice queued for {recipient_email}, see the email outbox for delivery', 'success')
         else:
-            flash('❌ Failed to send invoice email', 'error')
+            flash('❌ Failed to queue invoice email', 'error')
     except Exception as e:
-        flash(f'❌ Error sending email: {str(e)}', 'error')
+        flash(f'❌ Error queueing email: {str(e)}', 'error')
     
     return redirect(url_for('main.job_detail', job_id=job_id))
 
+@main.route('/email/outbox')
+@login_required
+def email_outbox():
+    status = request.args.get('status')
+    query = EmailOutbox.query.options(defer(EmailOutbox.body), defer(EmailOutbox.attachment))
+    if status in EMAIL_STATUSES:
+        query = query.filter(EmailOutbox.status == status)
+    messages = keyset_paginate(query, OUTBOX_ORDER)
+    counts = dict(db.session.query(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status).all())
+    
+    return render_template('pages/email_outbox.html',
+                         messages=messages,
+                         counts=counts,
+                         statuses=EMAIL_STATUSES,
+                         status=status)
+
+@main.route('/email/outbox/<int:entry_id>/retry', methods=['POST'])
+@login_required
+def retry_email(entry_id):
+    entry = EmailOutbox.query.get_or_404(entry_id)
+    if entry.status == 'failed':
+        requeue_email(entry)
+        db.session.commit()
+        flash(f'📨 Email to {entry.recipient} queued again', 'success')
+    
+    return redirect(url_for('main.email_outbox', status=request.args.get('status')))
+
+# ========== REMINDER ROUTES ==========
+@main.route('/reminders', methods=['GET', 'POST'])
+@login_required
+def reminder_campaigns():
+    form = ReminderCampaignForm()
+    
+    if form.validate_on_submit():
+        campaign = create_campaign(float(form.minimum_balance.data), form.statement_start.data, form.statement_end.data)
+        start_preparing(campaign.id)
+        flash(f'📨 Reminder campaign started for {campaign.recipients.count()} owner(s)', 'success')
+        return redirect(url_for('main.reminder_campaign', campaign_id=campaign.id))
+    
+    campaigns = ReminderCampaign.query.order_by(ReminderCampaign.id.desc()).limit(20).all()
+    results = campaign_results([campaign.id for campaign in campaigns])
+    
+    return render_template('pages/reminders.html',
+                         form=form,
+                         campaigns=campaigns,
+                         results=results,
+                         outcomes=CAMPAIGN_OUTCOMES)
+
+@main.route('/reminders/<int:campaign_id>')
+@login_required
+def reminder_campaign(campaign_id):
+    campaign = ReminderCampaign.query.get_or_404(campaign_id)
+    recipients = keyset_paginate(hot_query(CampaignRecipient.query.options(*load_profile('campaign_recipients')).filter(
+        CampaignRecipient.campaign_id == campaign.id), 'campaign recipients'), RECIPIENT_ORDER)
+    
+    return render_template('pages/reminder_campaign.html',
+                         campaign=campaign,
+                         recipients=recipients,
+                         results=campaign_results([campaign.id])[campaign.id],
+                         outcomes=CAMPAIGN_OUTCOMES,
+                         preparing=is_preparing(campaign.id))
+
+@main.route('/reminders/<int:campaign_id>/resume', methods=['POST'])
+@login_required
+def resume_reminder_campaign(campaign_id):
+    campaign = ReminderCampaign.query.get_or_404(campaign_id)
+    if campaign.status == 'preparing' and start_preparing(campaign.id):
+        flash('📨 Campaign resumed, owners already queued are skipped', 'success')
+    
+    return redirect(url_for('main.reminder_campaign', campaign_id=campaign_id))
+
 # ========== PAYMENT ROUTES ==========
 @main.route('/payments')
 @login_required
 def payments():
-    payments = Transaction.query.filter_by(transaction_type='payment').order_by(Transaction.date.desc()).all()
-    all_owners = CarOwner.query.all()
+    payments = keyset_paginate(payments_query(), PAYMENT_ORDER)
+    owners_with_balance = owners_owing().options(*load_profile('owners_owing')).all()
     form = PaymentForm()
-    form.owner_id.choices = [(owner.id, f"{owner.name} (Balance: R{owner.balance:.2f})") for owner in all_owners if owner.balance > 0]
+    _init_picker(form.owner_id, 'owner', 'owner_id')
     
     return render_template('pages/payments.html', 
                          payments=payments, 
                          form=form,
-                         all_owners=all_owners)
+                         owners_with_balance=owners_with_balance)
 
 @main.route('/payments/add', methods=['POST'])
 @login_required
+@idempotent
 def add_payment():
     form = PaymentForm()
-    form.owner_id.choices = [(owner.id, owner.name) for owner in CarOwner.query.all()]
+    _init_picker(form.owner_id, 'owner')
     
     if form.validate_on_submit():
         payment = Transaction(
@@ -400,14 +664,7 @@ def add_payment():
 @login_required
 def generate_receipt(payment_id):
     payment = Transaction.query.get_or_404(payment_id)
-    pdf_bytes = generate_receipt_pdf(payment)
-    
-    return send_file(
-        io.BytesIO(pdf_bytes),
-        download_name=f'receipt_{payment.id}_{date.today()}.pdf',
-        as_attachment=True,
-        mimetype='application/pdf'
-    )
+    return send_pdf(receipt_document(payment), f'receipt_{payment.id}_{date.today()}.pdf')
 
 # ========== SEARCH & REPORTS ROUTES ==========
 @main.route('/search', methods=['GET', 'POST'])
@@ -420,100 +677,81 @@ def search():
         query = form.search_query.data
         search_type = form.search_type.data
         
-        if search_type == 'license_plate':
-            results = Car.query.filter(Car.license_plate.ilike(f'%{query}%')).all()
-        elif search_type == 'owner_name':
-            results = CarOwner.query.filter(CarOwner.name.ilike(f'%{query}%')).all()
-        elif search_type == 'car_make':
-            results = Car.query.filter(
-                (Car.make.ilike(f'%{query}%')) | (Car.model.ilike(f'%{query}%'))
-            ).all()
-        elif search_type == 'phone':
-            results = CarOwner.query.filter(CarOwner.phone.ilike(f'%{query}%')).all()
+        hits = search_entities(query, search_type)
+        
+        if search_type in ('license_plate', 'car_make'):
+            results = _load_ranked(Car, [entity_id for kind, entity_id in hits if kind == 'car'], 'search_cars')
+        else:
+            results = _load_ranked(CarOwner, [entity_id for kind, entity_id in hits if kind == 'owner'], 'search_owners')
     
     return render_template('pages/search.html', form=form, results=results)
 
 @main.route('/reports/<report_type>')
 @login_required
 def generate_report(report_type):
-    if report_type == 'outstanding_balances':
-        owners_with_balance = CarOwner.query.all()
-        owners_with_balance = [owner for owner in owners_with_balance if owner.balance > 0]
-        return render_template('pages/reports/outstanding_balances.html', owners=owners_with_balance)
-    
-    elif report_type == 'recent_payments':
-        thirty_days_ago = date.today() - timedelta(days=30)
-        recent_payments = Transaction.query.filter(
-            Transaction.transaction_type == 'payment',
-            Transaction.date >= thirty_days_ago
-        ).order_by(Transaction.date.desc()).all()
-        return render_template('pages/reports/recent_payments.html', payments=recent_payments)
-    
-    elif report_type == 'active_jobs':
-        active_jobs = ServiceJob.query.filter_by(status='in_progress').all()
-        return render_template('pages/reports/active_jobs.html', jobs=active_jobs)
-    
-    elif report_type == 'service_history':
-        all_jobs = ServiceJob.query.order_by(ServiceJob.date_in.desc()).all()
-        return render_template('pages/reports/service_history.html', jobs=all_jobs)
+    """Old report URLs: each report has its own profiled, paginated route now"""
+    if report_type in REPORT_TYPES:
+        return redirect(url_for(f'main.report_{report_type}'))
     
-    else:
-        flash('❌ Invalid report type', 'error')
-        return redirect(url_for('main.dashboard'))
+    flash('❌ Invalid report type', 'error')
+    return redirect(url_for('main.dashboard'))
 
 @main.route('/export/<data_type>')
 @login_required
+@read_replica
 def export_data(data_type):
-    if data_type == 'customers':
-        owners = CarOwner.query.all()
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Name', 'Phone', 'Email', 'Address', 'Balance'])
-        
-        for owner in owners:
-            writer.writerow([
-                owner.name,
-                owner.phone,
-                owner.email or '',
-                owner.address or '',
-                owner.balance
-            ])
-        
-        output.seek(0)
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            download_name=f'customers_export_{date.today()}.csv',
-            as_attachment=True,
-            mimetype='text/csv'
-        )
-    
-    elif data_type == 'jobs':
-        jobs = ServiceJob.query.all()
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Job ID', 'License Plate', 'Date In', 'Date Out', 'Status', 'Total Cost'])
-        
-        for job in jobs:
-            writer.writerow([
-                job.id,
-                job.car.license_plate,
-                job.date_in,
-                job.date_out or '',
-                job.status,
-                job.total_cost
-            ])
-        
-        output.seek(0)
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            download_name=f'jobs_export_{date.today()}.csv',
-            as_attachment=True,
-            mimetype='text/csv'
-        )
-    
-    else:
+    if data_type not in EXPORTS:
         flash('❌ Invalid export type', 'error')
         return redirect(url_for('main.dashboard'))
+    
+    # Optional ?start=YYYY-MM-DD&end=YYYY-MM-DD range on the export's date column
+    try:
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        flash('❌ Invalid date range, use YYYY-MM-DD', 'error')
+        return redirect(url_for('main.search'))
+    
+    filename = f'{data_type}_export_{date.today()}.csv'
+    if start or end:
+        filename = f'{data_type}_export_{start or "start"}_to_{end or date.today()}.csv'
+    
+    return Response(
+        stream_with_context(generate_csv(data_type, start, end)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@main.route('/reports/bulk/<kind>')
+@login_required
+def bulk_documents(kind):
+    """Month-end invoices or statements as one streamed ZIP (?month=YYYY-MM&run=<id>)"""
+    if kind not in BULK_KINDS:
+        flash('❌ Invalid document run', 'error')
+        return redirect(url_for('main.search'))
+    
+    month = request.args.get('month') or date.today().strftime('%Y-%m')
+    try:
+        start, end = month_range(month)
+    except ValueError:
+        flash('❌ Invalid month, use YYYY-MM', 'error')
+        return redirect(url_for('main.search'))
+    
+    run = register_run(BulkRun(request.args.get('run') or os.urandom(8).hex(), kind, start, end))
+    return Response(
+        stream_with_context(generate_bulk_zip(run, current_app.config['SQLALCHEMY_DATABASE_URI'],
+                                              current_app.config['BULK_PDF_WORKERS'])),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={kind}_{month}.zip'}
+    )
+
+@main.route('/reports/bulk/progress/<run_id>')
+@login_required
+def bulk_documents_progress(run_id):
+    run = get_run(run_id)
+    if run is None:
+        return jsonify({'error': 'Unknown run'}), 404
+    return jsonify(run.to_dict())
 
 # ========== SETTINGS & PROFILE ROUTES ==========
 @main.route('/profile', methods=['GET', 'POST'])
@@ -553,22 +791,69 @@ def backup():
     
     if form.validate_on_submit():
         try:
-            backup_file = backup_database(form.backup_type.data, form.include_attachments.data)
-            flash(f'✅ Backup created successfully: {backup_file}', 'success')
+            run = start_backup(form.backup_type.data, form.include_attachments.data)
+            flash(f'⏳ Backup {run.name} started', 'success')
+            return redirect(url_for('main.backup', run=run.name))
         except Exception as e:
             flash(f'❌ Backup failed: {str(e)}', 'error')
     
-    return render_template('pages/backup.html', form=form)
+    return render_template('pages/backup.html', form=form, run=request.args.get('run'), backups=list_backups())
+
+@main.route('/backup/download/<name>')
+@login_required
+def download_backup(name):
+    manifest = find_manifest(name)
+    if manifest is None:
+        flash('❌ Backup not found', 'error')
+        return redirect(url_for('main.backup'))
+    
+    if manifest['type'] == 'full':
+        return Response(
+            stream_with_context(stream_snapshot_zip(manifest)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f"attachment; filename={manifest['file']}"}
+        )
+    return send_file(os.path.join(backup_directory(), manifest['file']), as_attachment=True,
+                     download_name=manifest['file'], etag=manifest['sha256'])
+
+@main.route('/backup/progress/<name>')
+@login_required
+def backup_progress(name):
+    run = get_backup_run(name)
+    if run is not None:
+        return jsonify(run.to_dict())
+    
+    # Finished in another worker process: its manifest is on disk
+    manifest = find_manifest(name)
+    if manifest is None:
+        return jsonify({'error': 'Unknown backup'}), 404
+    return jsonify({'name': name, 'stage': 'done', 'finished': True, 'error': None, 'manifest': manifest})
 
 # ========== API ROUTES ==========
 @main.route('/api/dashboard_stats')
 @login_required
 def dashboard_stats():
-    stats = get_dashboard_stats()
-    return jsonify(stats)
+    return jsonify(dashboard_snapshot())
+
+@main.route('/api/dashboard_stream')
+@login_required
+def dashboard_stream():
+    """Server-sent dashboard changes; app.js polls /api/dashboard_stats when the stream drops"""
+    broadcaster = current_app.extensions['dashboard_stream']
+    subscription = broadcaster.subscribe()
+    if subscription is None:
+        # Every stream slot in this worker is taken; EventSource gives up on a 503
+        # and app.js polls until it tries again
+        return Response(f'retry: {REFUSED_RETRY_SECONDS * 1000}\n\n', status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(REFUSED_RETRY_SECONDS), 'Cache-Control': 'no-cache'})
+    subscriber, snapshot = subscription
+    # Not stream_with_context: the request's database session is closed before streaming starts
+    return Response(broadcaster.stream(subscriber, snapshot), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @main.route('/api/search')
 @login_required
+@read_replica
 def api_search():
     query = request.args.get('q', '')
     search_type = request.args.get('type', 'all')
@@ -576,11 +861,17 @@ def api_search():
     if not query or len(query) < 2:
         return jsonify([])
     
-    results = []
+    # Ranked across cars and owners by the search index
+    hits = search_entities(query, search_type, limit=20)
+    cars = {car.id: car for car in _load_ranked(
+        Car, [entity_id for kind, entity_id in hits if kind == 'car'], 'search_cars')}
+    owners = {owner.id: owner for owner in _load_ranked(
+        CarOwner, [entity_id for kind, entity_id in hits if kind == 'owner'], 'search_owners')}
     
-    if search_type == 'license_plate' or search_type == 'all':
-        cars = Car.query.filter(Car.license_plate.ilike(f'%{query}%')).all()
-        for car in cars:
+    results = []
+    for kind, entity_id in hits:
+        if kind == 'car' and entity_id in cars:
+            car = cars[entity_id]
             results.append({
                 'type': 'car',
                 'id': car.id,
@@ -589,10 +880,8 @@ def api_search():
                 'model': car.model,
                 'owner_name': car.owner.name
             })
-    
-    if search_type == 'owner_name' or search_type == 'all':
-        owners = CarOwner.query.filter(CarOwner.name.ilike(f'%{query}%')).all()
-        for owner in owners:
+        elif kind == 'owner' and entity_id in owners:
+            owner = owners[entity_id]
             results.append({
                 'type': 'owner',
                 'id': owner.id,
@@ -603,8 +892,124 @@ def api_search():
     
     return jsonify(results)
 
+@main.route('/api/csrf_token')
+@login_required
+def api_csrf_token():
+    """A current CSRF token, for form posts the service worker replays after going offline"""
+    return jsonify({'csrf_token': generate_csrf()})
+
+@main.route('/api/lookup')
+@login_required
+def api_lookup():
+    """Typeahead for the owner and car pickers, answered from the in-memory prefix index"""
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('type')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    
+    if not query:
+        return jsonify([])
+    
+    index = ensure_lookup_index(current_app.config['LOOKUP_INDEX_MAX_AGE'])
+    hits = index.lookup(query, kind if kind in ('car', 'owner') else None, limit)
+    results = [{'type': hit_kind, 'id': entity_id, 'label': label, 'detail': detail}
+               for hit_kind, entity_id, label, detail in hits]
+    
+    # The payment form pre-fills the amount from the balance; one primary-key lookup
+    if request.args.get('balance') and results:
+        owner_ids = [result['id'] for result in results if result['type'] == 'owner']
+        balances = dict(db.session.query(OwnerBalance.owner_id, OwnerBalance.balance)
+                        .filter(OwnerBalance.owner_id.in_(owner_ids)))
+        for result in results:
+            if result['type'] == 'owner':
+                result['balance'] = balances.get(result['id'], 0.0)
+    
+    return jsonify(results)
+
+@main.route('/api/jobs')
+@login_required
+@read_replica
+def api_jobs():
+    page = keyset_paginate(jobs_query(request.args.get('status', 'all')), JOB_ORDER)
+    
+    return jsonify({
+        'items': [{
+            'id': job.id,
+            'license_plate': job.car.license_plate,
+            'owner_name': job.car.owner.name,
+            'date_in': job.date_in.isoformat(),
+            'date_out': job.date_out.isoformat() if job.date_out else None,
+            'status': job.status,
+            'item_count': job.item_count,
+            'total_cost': job.total_cost,
+            'quoted_cost': job.quoted_cost
+        } for job in page],
+        'next_cursor': page.next_cursor,
+        'per_page': page.per_page
+    })
+
+@main.route('/api/cars')
+@login_required
+@read_replica
+def api_cars():
+    page = keyset_paginate(Car.query.options(*load_profile('cars')), CAR_ORDER)
+    
+    return jsonify({
+        'items': [{
+            'id': car.id,
+            'license_plate': car.license_plate,
+            'make': car.make,
+            'model': car.model,
+            'year': car.year,
+            'owner_id': car.owner_id,
+            'owner_name': car.owner.name,
+            'job_count': car.job_count,
+            'last_service_date': car.last_service_date.isoformat() if car.last_service_date else None
+        } for car in page],
+        'next_cursor': page.next_cursor,
+        'per_page': page.per_page
+    })
+
+@main.route('/api/car_owners')
+@login_required
+@read_replica
+def api_car_owners():
+    page = keyset_paginate(CarOwner.query.options(*load_profile('car_owners')), OWNER_ORDER)
+    
+    return jsonify({
+        'items': [{
+            'id': owner.id,
+            'name': owner.name,
+            'phone': owner.phone,
+            'email': owner.email,
+            'car_count': owner.car_count,
+            'balance': owner.balance
+        } for owner in page],
+        'next_cursor': page.next_cursor,
+        'per_page': page.per_page
+    })
+
+@main.route('/api/payments')
+@login_required
+@read_replica
+def api_payments():
+    page = keyset_paginate(payments_query(), PAYMENT_ORDER)
+    
+    return jsonify({
+        'items': [{
+            'id': payment.id,
+            'owner_id': payment.owner_id,
+            'owner_name': payment.owner.name,
+            'amount': payment.amount,
+            'description': payment.description,
+            'date': payment.date.isoformat()
+        } for payment in page],
+        'next_cursor': page.next_cursor,
+        'per_page': page.per_page
+    })
+
 @main.route('/api/chart_data')
 @login_required
+@read_replica
 def chart_data():
     # Revenue by month for the last 6 months
     six_months_ago = date.today() - timedelta(days=180)
@@ -658,8 +1063,10 @@ def too_many_requests_error(error):
 # ========== REPORT ROUTES ==========
 @main.route('/reports/outstanding_balances')
 @login_required
+@read_replica
+@conditional(_report_version(OwnerBalance, CarOwner))
 def report_outstanding_balances():
-    owners_with_balance = [owner for owner in CarOwner.query.all() if owner.balance > 0]
+    owners_with_balance = owners_owing().options(*load_profile('owners_owing')).all()
     total_outstanding = sum(owner.balance for owner in owners_with_balance)
     
     return render_template('pages/reports/outstanding_balances.html', 
@@ -669,12 +1076,14 @@ def report_outstanding_balances():
 
 @main.route('/reports/recent_payments')
 @login_required
+@read_replica
+@conditional(_report_version(Transaction, CarOwner, OwnerBalance))
 def report_recent_payments():
     thirty_days_ago = date.today() - timedelta(days=30)
-    recent_payments = Transaction.query.filter(
+    recent_payments = hot_query(Transaction.query.options(*load_profile('payments')).filter(
         Transaction.transaction_type == 'payment',
         Transaction.date >= thirty_days_ago
-    ).order_by(Transaction.date.desc()).all()
+    ).order_by(Transaction.date.desc()), 'recent payments report').all()
     
     total_received = sum(payment.amount for payment in recent_payments)
     
@@ -686,9 +1095,11 @@ def report_recent_payments():
 
 @main.route('/reports/active_jobs')
 @login_required
+@read_replica
+@conditional(_report_version(ServiceJob, Car, CarOwner, OwnerBalance))
 def report_active_jobs():
-    active_jobs = ServiceJob.query.filter_by(status='in_progress').all()
-    total_quoted = sum(job.quoted_cost for job in active_jobs)
+    active_jobs = jobs_query('in_progress').all()
+    total_quoted = db.session.query(func.sum(ServiceJob.quoted_cost)).filter_by(status='in_progress').scalar() or 0
     
     # Calculate average days in shop
     if active_jobs:
@@ -705,24 +1116,26 @@ def report_active_jobs():
 
 @main.route('/reports/service_history')
 @login_required
+@read_replica
+@conditional(_report_version(ServiceJob, Car, CarOwner, OwnerBalance))
 def report_service_history():
-    all_jobs = ServiceJob.query.order_by(ServiceJob.date_in.desc()).all()
-    
-    completed_jobs = [job for job in all_jobs if job.status == 'completed']
-    in_progress_jobs = [job for job in all_jobs if job.status == 'in_progress']
+    all_jobs = keyset_paginate(ServiceJob.query.options(*load_profile('jobs')), JOB_ORDER)
     
-    total_services = sum(len(job.service_items) for job in all_jobs)
-    total_revenue = sum(job.total_cost for job in completed_jobs)
+    total_jobs, completed_jobs, in_progress_jobs, total_services, total_revenue = db.session.query(
+        func.count(ServiceJob.id),
+        func.count(case((ServiceJob.status == 'completed', 1))),
+        func.count(case((ServiceJob.status == 'in_progress', 1))),
+        func.coalesce(func.sum(ServiceJob.item_count), 0),
+        func.coalesce(func.sum(case((ServiceJob.status == 'completed', ServiceJob.total_cost))), 0)
+    ).one()
     
-    if all_jobs:
-        average_job_value = total_revenue / len(completed_jobs) if completed_jobs else 0
-    else:
-        average_job_value = 0
+    average_job_value = total_revenue / completed_jobs if completed_jobs else 0
     
     return render_template('pages/reports/service_history.html', 
                          jobs=all_jobs,
-                         completed_jobs=len(completed_jobs),
-                         in_progress_jobs=len(in_progress_jobs),
+                         total_jobs=total_jobs,
+                         completed_jobs=completed_jobs,
+                         in_progress_jobs=in_progress_jobs,
                          total_services=total_services,
                          total_revenue=total_revenue,
                          average_job_value=average_job_value,
@@ -731,12 +1144,14 @@ def report_service_history():
 # ========== PDF ROUTES ==========
 @main.route('/jobs/<int:job_id>/quotation/html')
 @login_required
+@conditional(_job_version)
 def view_quotation_html(job_id):
     job = ServiceJob.query.get_or_404(job_id)
     return render_template('pages/quotation.html', job=job, now=datetime.now())
 
 @main.route('/jobs/<int:job_id>/invoice/html')
 @login_required
+@conditional(_job_version)
 def view_invoice_html(job_id):
     job = ServiceJob.query.get_or_404(job_id)
     return render_template('pages/invoice.html', job=job, now=datetime.now())
\ No newline at end of file
@@ -0,0 +1,261 @@
+import re
+from sqlalchemy import MetaData, Table, Column, Integer, String, Index, event, text, select, func, and_, or_, case
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models import Car, CarOwner
+
+# Searchable fields per search type, as offered by SearchForm and /api/search
+SEARCH_FIELDS = {
+    'license_plate': ['plate'],
+    'car_make': ['make_model'],
+    'owner_name': ['name'],
+    'phone': ['phone'],
+}
+ALL_FIELDS = ['plate', 'make_model', 'name', 'phone']
+
+# Engines (by URL) whose search index lives in an FTS5 trigram table, found
+# on first use; every other engine uses the portable trigram tables below
+_fts5_engines = set()
+
+# ========== DOCUMENTS ==========
+def normalize_plate(value):
+    return re.sub(r'\s+', '', value or '').upper()
+
+def normalize_phone(value):
+    return re.sub(r'\D', '', value or '')
+
+def car_document(car):
+    # Plates are indexed as typed and without spaces, so "AB12" finds "AB 12 GP"
+    return {
+        'plate': f'{car.license_plate} {normalize_plate(car.license_plate)}',
+        'make_model': f'{car.make} {car.model}',
+        'name': '',
+        'phone': '',
+    }
+
+def owner_document(owner):
+    # Phones are indexed as typed and as bare digits, so "0781234" finds "078 123 4"
+    return {
+        'plate': '',
+        'make_model': '',
+        'name': owner.name,
+        'phone': f'{owner.phone} {normalize_phone(owner.phone)}',
+    }
+
+def _query_for_field(field, query):
+    if field == 'plate':
+        return normalize_plate(query)
+    if field == 'phone' and normalize_phone(query):
+        return normalize_phone(query)
+    return query.strip()
+
+# ========== PORTABLE TRIGRAM STORE ==========
+trigram_metadata = MetaData()
+
+search_document = Table(
+    'search_document', trigram_metadata,
+    Column('entity_type', String(10), primary_key=True),
+    Column('entity_id', Integer, primary_key=True),
+    Column('plate', String(60), nullable=False, default=''),
+    Column('make_model', String(110), nullable=False, default=''),
+    Column('name', String(100), nullable=False, default=''),
+    Column('phone', String(60), nullable=False, default=''),
+)
+
+search_trigram = Table(
+    'search_trigram', trigram_metadata,
+    Column('trigram', String(3), nullable=False),
+    Column('field', String(12), nullable=False),
+    Column('entity_type', String(10), nullable=False),
+    Column('entity_id', Integer, nullable=False),
+    Index('ix_search_trigram_lookup', 'trigram', 'field'),
+    Index('ix_search_trigram_entity', 'entity_type', 'entity_id'),
+)
+
+def trigrams(value):
+    value = value.lower()
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+# ========== INDEX MAINTENANCE ==========
+def _uses_fts5(connection):
+    engine = connection.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    key = str(engine.url)
+    if key not in _fts5_engines and db.inspect(connection).has_table('search_fts'):
+        _fts5_engines.add(key)
+    return key in _fts5_engines
+
+def _delete_document(connection, entity_type, entity_id):
+    if _uses_fts5(connection):
+        connection.execute(text('DELETE FROM search_fts WHERE entity_type = :type AND entity_id = :id'),
+                           {'type': entity_type, 'id': entity_id})
+    else:
+        for table in (search_document, search_trigram):
+            connection.execute(table.delete().where(and_(table.c.entity_type == entity_type,
+                                                          table.c.entity_id == entity_id)))
+
+def _index_document(connection, entity_type, entity_id, document):
+    _delete_document(connection, entity_type, entity_id)
+    
+    if _uses_fts5(connection):
+        connection.execute(text(
+            'INSERT INTO search_fts (entity_type, entity_id, plate, make_model, name, phone) '
+            'VALUES (:entity_type, :entity_id, :plate, :make_model, :name, :phone)'
+        ), dict(document, entity_type=entity_type, entity_id=entity_id))
+        return
+    
+    connection.execute(search_document.insert().values(entity_type=entity_type, entity_id=entity_id, **document))
+    grams = [
+        {'trigram': gram, 'field': field, 'entity_type': entity_type, 'entity_id': entity_id}
+        for field, value in document.items() for gram in trigrams(value)
+    ]
+    if grams:
+        connection.execute(search_trigram.insert(), grams)
+
+@event.listens_for(Car, 'after_insert')
+@event.listens_for(Car, 'after_update')
+def _car_saved(mapper, connection, target):
+    _index_document(connection, 'car', target.id, car_document(target))
+
+@event.listens_for(CarOwner, 'after_insert')
+@event.listens_for(CarOwner, 'after_update')
+def _owner_saved(mapper, connection, target):
+    _index_document(connection, 'owner', target.id, owner_document(target))
+
+@event.listens_for(Car, 'after_delete')
+def _car_deleted(mapper, connection, target):
+    _delete_document(connection, 'car', target.id)
+
+@event.listens_for(CarOwner, 'after_delete')
+def _owner_deleted(mapper, connection, target):
+    _delete_document(connection, 'owner', target.id)
+
+def ensure_search_index():
+    """Create the search index for the current engine, filling it if it is new"""
+    engine = db.engine
+    created = False
+    
+    if engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            exists = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'search_fts'")).first()
+            if not exists:
+                try:
+                    connection.execute(text(
+                        'CREATE VIRTUAL TABLE search_fts USING fts5('
+                        'entity_type UNINDEXED, entity_id UNINDEXED, plate, make_model, name, phone, '
+                        "tokenize = 'trigram')"
+                    ))
+                    created = True
+                    exists = True
+                except OperationalError:
+                    # SQLite older than 3.34 has no trigram tokenizer
+                    pass
+        if exists:
+            _fts5_engines.add(str(engine.url))
+    
+    if not _uses_fts5(engine):
+        missing = [table for table in trigram_metadata.sorted_tables
+                   if not db.inspect(engine).has_table(table.name)]
+        trigram_metadata.create_all(engine)
+        created = bool(missing)
+    
+    if created:
+        rebuild_search_index()
+
+def rebuild_search_index():
+    """Re-index every car and owner, returns the number of documents written"""
+    connection = db.session.connection()
+    if _uses_fts5(connection):
+        connection.execute(text('DELETE FROM search_fts'))
+    else:
+        connection.execute(search_trigram.delete())
+        connection.execute(search_document.delete())
+    
+    count = 0
+    for car in Car.query.yield_per(500):
+        _index_document(connection, 'car', car.id, car_document(car))
+        count += 1
+    for owner in CarOwner.query.yield_per(500):
+        _index_document(connection, 'owner', owner.id, owner_document(owner))
+        count += 1
+    
+    db.session.commit()
+    return count
+
+# ========== QUERIES ==========
+def _fts5_search(query, fields, limit):
+    terms = []
+    short = []
+    params = {'limit': limit}
+    for field in fields:
+        needle = _query_for_field(field, query)
+        if len(needle) >= 3:
+            terms.append('{%s} : "%s"' % (field, needle.replace('"', '""')))
+        elif needle:
+            params[field] = f'%{needle}%'
+            short.append(f'{field} LIKE :{field}')
+    
+    if terms:
+        # Plates and names outrank make/model hits in bm25
+        params['match'] = ' OR '.join(terms)
+        rows = db.session.execute(text(
+            'SELECT entity_type, entity_id FROM search_fts WHERE search_fts MATCH :match '
+            'ORDER BY bm25(search_fts, 0, 0, 10.0, 2.0, 8.0, 5.0) LIMIT :limit'
+        ), params)
+    elif short:
+        # Too short for trigrams, scan the (small) index table instead
+        rows = db.session.execute(text(
+            f'SELECT entity_type, entity_id FROM search_fts WHERE {" OR ".join(short)} LIMIT :limit'
+        ), params)
+    else:
+        return []
+    return [(row.entity_type, int(row.entity_id)) for row in rows]
+
+def _trigram_search(query, fields, limit):
+    matches = []
+    exact = []
+    prefix = []
+    for field in fields:
+        needle = _query_for_field(field, query).lower()
+        if not needle:
+            continue
+        column = func.lower(search_document.c[field])
+        condition = column.like(f'%{needle}%')
+        
+        grams = trigrams(needle)
+        if grams:
+            # Only documents holding every trigram of the needle reach the LIKE check.
+            # Each field belongs to one entity type, so entity_id alone is unambiguous here.
+            candidates = select(search_trigram.c.entity_id).where(
+                search_trigram.c.field == field, search_trigram.c.trigram.in_(grams)
+            ).group_by(search_trigram.c.entity_id).having(
+                func.count(search_trigram.c.trigram.distinct()) == len(grams)
+            )
+            condition = and_(search_document.c.entity_id.in_(candidates), condition)
+        
+        matches.append(condition)
+        exact.append(column == needle)
+        prefix.append(column.like(f'{needle}%'))
+    
+    if not matches:
+        return []
+    
+    # Whole-field hits first, then prefix hits, then anything containing the query
+    rank = case((or_(*exact), 0), (or_(*prefix), 1), else_=2)
+    rows = db.session.execute(
+        select(search_document.c.entity_type, search_document.c.entity_id)
+        .where(or_(*matches)).order_by(rank, search_document.c.entity_id).limit(limit)
+    )
+    return [(row.entity_type, row.entity_id) for row in rows]
+
+def search_entities(query, search_type='all', limit=50):
+    """Ranked (entity_type, entity_id) pairs matching `query` for a search type"""
+    query = (query or '').strip()
+    if not query:
+        return []
+    fields = SEARCH_FIELDS.get(search_type, ALL_FIELDS)
+    if _uses_fts5(db.engine):
+        return _fts5_search(query, fields, limit)
+    return _trigram_search(query, fields, limit)
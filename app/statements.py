@@ -0,0 +1,78 @@
+import hashlib
+from sqlalchemy import func, case, select, and_, true, false
+from app import db
+from app.models import Transaction
+from app.query_plans import hot_query
+
+# Statement rows are read in batches of this size, so a long account never sits in memory
+STATEMENT_BATCH_SIZE = 500
+
+def signed_amount():
+    """What a transaction does to the balance: invoices add, payments subtract"""
+    return case((Transaction.transaction_type == 'invoice', Transaction.amount), else_=-Transaction.amount)
+
+def _period(owner_id, start=None, end=None):
+    criteria = [Transaction.owner_id == owner_id]
+    if start:
+        criteria.append(Transaction.date >= start)
+    if end:
+        criteria.append(Transaction.date <= end)
+    return criteria
+
+def statement_summary(owner_id, start=None, end=None):
+    """Opening balance, period totals and closing balance in one query"""
+    in_period = Transaction.date >= start if start else true()
+    before = Transaction.date < start if start else false()
+    opening, invoiced, paid = hot_query(db.session.query(
+        func.coalesce(func.sum(case((before, signed_amount()), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((and_(in_period, Transaction.transaction_type == 'invoice'), Transaction.amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((and_(in_period, Transaction.transaction_type == 'payment'), Transaction.amount), else_=0.0)), 0.0),
+    ).filter(*_period(owner_id, end=end)), 'owner statement').one()
+    return {
+        'opening': opening,
+        'invoiced': invoiced,
+        'paid': paid,
+        'closing': opening + invoiced - paid,
+    }
+
+def statement_lines(owner_id, start=None, end=None, opening=0.0):
+    """Query over the period's transactions, each with its running balance.
+    
+    The balance is SUM() OVER (ORDER BY date, id) in the database, offset by
+    the opening balance, so any page of the statement (see statement_order)
+    carries the right balance without reading the rows before it.
+    """
+    signed = signed_amount()
+    lines = select(
+        Transaction.id,
+        Transaction.date,
+        Transaction.transaction_type,
+        Transaction.description,
+        Transaction.amount,
+        Transaction.service_job_id,
+        (opening + func.sum(signed).over(order_by=(Transaction.date, Transaction.id))).label('balance'),
+    ).where(*_period(owner_id, start, end)).subquery('statement_line')
+    return hot_query(db.session.query(lines), 'owner statement'), lines
+
+def statement_order(lines):
+    return [(lines.c.date, False), (lines.c.id, False)]
+
+def iter_statement_lines(owner_id, start=None, end=None, opening=0.0):
+    query, lines = statement_lines(owner_id, start, end, opening)
+    return query.order_by(lines.c.date, lines.c.id).yield_per(STATEMENT_BATCH_SIZE)
+
+def recent_statement_lines(owner_id, limit=10):
+    """Latest transactions, newest first, with their all-time running balance"""
+    query, lines = statement_lines(owner_id)
+    return query.order_by(lines.c.date.desc(), lines.c.id.desc()).limit(limit).all()
+
+def statement_fingerprint(owner_id, start=None, end=None):
+    """Digest of every transaction on a statement, computed a batch at a time"""
+    digest = hashlib.sha256()
+    rows = db.session.query(Transaction.id, Transaction.date, Transaction.transaction_type,
+                            Transaction.description, Transaction.amount).filter(
+        *_period(owner_id, start, end)
+    ).order_by(Transaction.date, Transaction.id).yield_per(STATEMENT_BATCH_SIZE)
+    for row in rows:
+        digest.update(repr(tuple(row)).encode('utf-8'))
+    return digest.hexdigest()
@@ -11,6 +11,7 @@ function initApp() {
     initQuickActions();
     initSearch();
     initForms();
+    initLookupPickers();
     initPrintButtons();
     initAutoRefresh();
     
@@ -23,7 +24,7 @@ function initApp() {
 // Service Worker Registration
 async function registerServiceWorker() {
     try {
-        const registration = await navigator.serviceWorker.register('/static/sw.js');
+        const registration = await navigator.serviceWorker.register('/sw.js');
         console.log('ServiceWorker registered successfully');
     } catch (error) {
         console.log('ServiceWorker registration failed:', error);
@@ -60,7 +61,10 @@ async function toggleServiceStatus(serviceId, isFixed) {
         
         const result = await response.json();
         
-        if (result.success) {
+        if (result.queued) {
+            showAlert('Offline: the change will be sent when the connection returns', 'warning');
+            updateServiceUI(serviceId, isFixed);
+        } else if (result.success) {
             showAlert('Service status updated successfully!', 'success');
             // Update the UI accordingly
             updateServiceUI(serviceId, isFixed);
@@ -308,6 +312,66 @@ function enhanceSelectWithSearch(select) {
     });
 }
 
+// Async owner/car pickers: <select data-lookup="owner|car"> starts with only the
+// selected option and is filled from /api/lookup as the user types
+function initLookupPickers() {
+    document.querySelectorAll('select[data-lookup]').forEach(initLookupPicker);
+}
+
+function initLookupPicker(select) {
+    const searchInput = document.createElement('input');
+    searchInput.type = 'text';
+    searchInput.className = 'form-control';
+    searchInput.style.marginBottom = '0.5rem';
+    searchInput.placeholder = select.dataset.lookup === 'car'
+        ? 'Type a license plate...'
+        : 'Type a name or phone number...';
+    searchInput.autocomplete = 'off';
+    select.parentNode.insertBefore(searchInput, select);
+    
+    if (select.options.length === 0) {
+        select.add(new Option('— Start typing to find a match —', ''));
+    }
+    
+    let lookupTimeout;
+    searchInput.addEventListener('input', function() {
+        clearTimeout(lookupTimeout);
+        lookupTimeout = setTimeout(() => fillLookupPicker(select, this.value.trim()), 150);
+    });
+}
+
+function fillLookupPicker(select, query) {
+    if (!query) return;
+    
+    const params = new URLSearchParams({q: query, type: select.dataset.lookup});
+    if (select.dataset.lookupBalance) {
+        params.set('balance', '1');
+    }
+    
+    fetch(`/api/lookup?${params}`)
+        .then(response => response.json())
+        .then(results => {
+            select.innerHTML = '';
+            if (results.length === 0) {
+                select.add(new Option('No matches', ''));
+                return;
+            }
+            results.forEach(result => {
+                const text = result.detail ? `${result.label} (${result.detail})` : result.label;
+                const option = new Option(text, result.id);
+                if (result.balance !== undefined) {
+                    option.dataset.balance = result.balance;
+                }
+                select.add(option);
+            });
+            select.selectedIndex = 0;
+            select.dispatchEvent(new Event('change'));
+        })
+        .catch(error => {
+            console.error('Lookup error:', error);
+        });
+}
+
 // Print Functionality
 function initPrintButtons() {
     const printButtons = document.querySelectorAll('[data-print]');
@@ -355,13 +419,52 @@ function printElement(elementSelector) {
     }, 500);
 }
 
-// Auto-refresh dashboard data
+// Live dashboard: changes pushed over /api/dashboard_stream, with polling of
+// /api/dashboard_stats while the stream is down
+const CURRENCY_STATS = ['total_revenue', 'total_outstanding', 'monthly_revenue'];
+const RECENT_ITEMS_SHOWN = 5;
+let dashboardPoll = null;
+
 function initAutoRefresh() {
     const dashboardElements = document.querySelectorAll('[data-auto-refresh]');
     
     if (dashboardElements.length > 0) {
-        // Refresh every 30 seconds
-        setInterval(refreshDashboardData, 30000);
+        if (window.EventSource) {
+            openDashboardStream();
+        } else {
+            startDashboardPolling();
+        }
+    }
+}
+
+function openDashboardStream() {
+    const stream = new EventSource('/api/dashboard_stream');
+    
+    stream.addEventListener('snapshot', event => {
+        stopDashboardPolling();
+        updateDashboardStats(JSON.parse(event.data));
+    });
+    stream.addEventListener('delta', event => updateDashboardStats(JSON.parse(event.data)));
+    stream.addEventListener('error', () => {
+        // The browser reconnects by itself; poll until a new snapshot arrives
+        startDashboardPolling();
+        if (stream.readyState === EventSource.CLOSED) {
+            // It gave up (signed out, every stream slot taken, or not a stream): try again later
+            setTimeout(openDashboardStream, 60000);
+        }
+    });
+}
+
+function startDashboardPolling() {
+    if (!dashboardPoll) {
+        dashboardPoll = setInterval(refreshDashboardData, 30000);
+    }
+}
+
+function stopDashboardPolling() {
+    if (dashboardPoll) {
+        clearInterval(dashboardPoll);
+        dashboardPoll = null;
     }
 }
 
@@ -377,21 +480,81 @@ async function refreshDashboardData() {
     }
 }
 
+// Takes a full snapshot or a delta: only the fields present are updated
 function updateDashboardStats(data) {
-    // Update various stat elements on the page
-    const statElements = {
-        'total-cars': data.total_cars,
-        'active-jobs': data.active_jobs,
-        'total-revenue': 'R ' + data.total_revenue.toLocaleString('en-ZA'),
-        'total-outstanding': 'R ' + data.total_outstanding.toLocaleString('en-ZA')
-    };
-    
-    Object.keys(statElements).forEach(key => {
-        const element = document.getElementById(key);
-        if (element) {
-            element.textContent = statElements[key];
-        }
+    Object.keys(data).forEach(name => {
+        document.querySelectorAll(`[data-stat="${name}"]`).forEach(element => {
+            element.textContent = CURRENCY_STATS.includes(name) ? formatCurrency(data[name]) : data[name];
+        });
     });
+    
+    if (data.recent_jobs) {
+        updateRecentItems('recent-jobs', 'jobId', data.recent_jobs, renderRecentJob);
+    }
+    if (data.recent_transactions) {
+        updateRecentItems('recent-transactions', 'transactionId', data.recent_transactions, renderRecentTransaction);
+    }
+}
+
+// Shows exactly `items`, newest first: snapshots, deltas and polls all carry the full list
+function updateRecentItems(containerId, datasetKey, items, render) {
+    const container = document.getElementById(containerId);
+    if (!container) {
+        return;
+    }
+    const empty = container.querySelector('[data-empty]');
+    if (empty) {
+        empty.hidden = items.length > 0;
+    }
+    
+    Array.from(container.children)
+        .filter(child => child.dataset[datasetKey])
+        .forEach(child => child.remove());
+    items.slice(0, RECENT_ITEMS_SHOWN).forEach(item => {
+        const template = document.createElement('template');
+        template.innerHTML = render(item).trim();
+        const element = template.content.firstElementChild;
+        element.dataset[datasetKey] = item.id;
+        container.insertBefore(element, empty);
+    });
+}
+
+function renderRecentJob(job) {
+    const statusClass = job.status === 'completed' ? 'text-success' : 'text-warning';
+    const status = job.status.replace('_', ' ').replace(/\b\w/g, letter => letter.toUpperCase());
+    return `
+        <div class="timeline-item">
+            <div class="timeline-icon">🔧</div>
+            <div class="timeline-content">
+                <div class="timeline-title">${escapeHtml(job.license_plate)} - ${escapeHtml(job.make)} ${escapeHtml(job.model)}</div>
+                <div class="timeline-description">
+                    ${job.item_count} services • <span class="${statusClass}">${status}</span>
+                </div>
+                <div class="timeline-time">Checked in: ${formatDate(job.date_in)}</div>
+            </div>
+        </div>
+    `;
+}
+
+function renderRecentTransaction(transaction) {
+    return `
+        <div style="padding: 1rem; border-bottom: 1px solid rgba(255,255,255,0.1);">
+            <div style="display: flex; justify-content: between; align-items: center;">
+                <div>
+                    <strong>${escapeHtml(transaction.owner_name)}</strong>
+                    <div style="font-size: 0.8rem; color: var(--gray);">${escapeHtml(transaction.description || '')}</div>
+                </div>
+                <div class="text-success" style="font-weight: bold;">${formatCurrency(transaction.amount)}</div>
+            </div>
+            <div style="font-size: 0.8rem; color: var(--gray); margin-top: 0.25rem;">${formatDate(transaction.date)}</div>
+        </div>
+    `;
+}
+
+function escapeHtml(text) {
+    const element = document.createElement('div');
+    element.textContent = text;
+    return element.innerHTML;
 }
 
 // Alert System
@@ -1,7 +1,15 @@
 // PWA Service Worker Registration
 if ('serviceWorker' in navigator) {
     window.addEventListener('load', function() {
-        navigator.serviceWorker.register('/static/sw.js')
+        // Earlier versions registered /static/sw.js, which only controlled /static/
+        navigator.serviceWorker.getRegistrations().then(function(registrations) {
+            registrations.forEach(function(registration) {
+                if (registration.scope.endsWith('/static/')) {
+                    registration.unregister();
+                }
+            });
+        });
+        navigator.serviceWorker.register('/sw.js')
             .then(function(registration) {
                 console.log('ServiceWorker registration successful with scope: ', registration.scope);
             })
@@ -55,7 +63,31 @@ window.addEventListener('offline', function() {
 });
 
 function syncPendingOperations() {
-    // Sync any data that was saved while offline
-    // This would depend on your specific offline storage implementation
-    console.log('Syncing pending operations...');
+    // Ask the service worker to send the writes it queued while offline
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.ready.then(function(registration) {
+            registration.active.postMessage({ type: 'replay' });
+        });
+    }
+}
+
+// Queue reports from the service worker (sw.js notifyQueue)
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.addEventListener('message', function(event) {
+        const queue = event.data;
+        if (!queue || queue.type !== 'queue') {
+            return;
+        }
+        if (queue.failed > 0) {
+            showAlert(`${queue.failed} change(s) saved offline were rejected by the server and not saved` +
+                (queue.sent ? `, ${queue.sent} sent` : '') + (queue.pending ? `, ${queue.pending} still waiting` : ''), 'error', 0);
+        } else if (queue.loginRequired) {
+            showAlert(`Log in again to send ${queue.pending} change(s) saved offline`, 'warning', 0);
+        } else if (queue.sent > 0) {
+            showAlert(`Sent ${queue.sent} change(s) saved offline`, 'success');
+        } else if (queue.pending > 0) {
+            showAlert(`${queue.pending} change(s) saved offline, they will be sent when the connection returns`, 'warning');
+        }
+    });
+    window.addEventListener('load', syncPendingOperations);
 }
\ No newline at end of file
@@ -1,5 +1,6 @@
 // Service Worker for Car Buddies GaragePro
-const CACHE_NAME = 'car-buddies-garagepro-v1.0.0';
+// ASSETS: rewritten by `flask build-assets` from the asset manifest; served from /sw.js
+const CACHE_NAME = 'car-buddies-garagepro-dev';
 const urlsToCache = [
     '/',
     '/static/css/styles.css',
@@ -11,30 +12,43 @@ const urlsToCache = [
     '/static/images/icon-192.png',
     '/static/images/icon-512.png'
 ];
+// END ASSETS
+
+// Pages and API reads: answered from here at once, refreshed from the network behind
+const RUNTIME_CACHE = 'car-buddies-garagepro-runtime';
+
+// Writes that are queued while offline and replayed later, each with an Idempotency-Key
+// so the server applies it once however often it arrives
+const QUEUEABLE_POSTS = [
+    /^\/jobs\/service\/\d+\/(toggle|delete)$/,
+    /^\/jobs\/\d+\/(add_service|add_quick_service|complete)$/,
+    /^\/payments\/add$/
+];
+
+// Always straight to the network: signing in and out, progress polls
+const NETWORK_ONLY = [
+    /^\/login/,
+    /^\/logout/,
+    /\/progress\//,
+    /^\/api\/csrf_token$/
+];
+
+const QUEUE_DB = 'garagepro-offline';
+const QUEUE_STORE = 'requests';
+const SYNC_TAG = 'replay-queue';
+// A queued write the server keeps failing (5xx) is dropped, and reported as failed, after this many tries
+const MAX_ATTEMPTS = 5;
 
 // Install event
 self.addEventListener('install', function(event) {
     event.waitUntil(
         caches.open(CACHE_NAME)
             .then(function(cache) {
-                console.log('Opened cache');
                 return cache.addAll(urlsToCache);
             })
-    );
-});
-
-// Fetch event
-self.addEventListener('fetch', function(event) {
-    event.respondWith(
-        caches.match(event.request)
-            .then(function(response) {
-                // Return cached version or fetch from network
-                if (response) {
-                    return response;
-                }
-                return fetch(event.request);
-            }
-        )
+            .then(function() {
+                return self.skipWaiting();
+            })
     );
 });
 
@@ -44,12 +58,301 @@ self.addEventListener('activate', function(event) {
         caches.keys().then(function(cacheNames) {
             return Promise.all(
                 cacheNames.map(function(cacheName) {
-                    if (cacheName !== CACHE_NAME) {
+                    if (cacheName !== CACHE_NAME && cacheName !== RUNTIME_CACHE) {
                         console.log('Deleting old cache:', cacheName);
                         return caches.delete(cacheName);
                     }
                 })
             );
-        })
+        }).then(function() {
+            return self.clients.claim();
+        }).then(replayQueue)
     );
-});
\ No newline at end of file
+});
+
+// Fetch event
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin || request.headers.get('Accept') === 'text/event-stream') {
+        return;
+    }
+    if (url.pathname === '/logout') {
+        // The next person on a shared tablet must not see this user's pages
+        event.waitUntil(clearRuntimeCache());
+    }
+    if (matchesAny(NETWORK_ONLY, url.pathname)) {
+        return;
+    }
+
+    if (request.method === 'POST' && matchesAny(QUEUEABLE_POSTS, url.pathname)) {
+        event.respondWith(sendOrQueue(request));
+    } else if (request.method !== 'GET') {
+        // Any other write may change what the cached pages show
+        event.waitUntil(clearRuntimeCache());
+    } else if (url.pathname.startsWith('/static/dist/')) {
+        event.respondWith(cacheFirst(request));
+    } else if (request.mode === 'navigate' || url.pathname.startsWith('/api/')) {
+        event.respondWith(staleWhileRevalidate(event));
+    } else {
+        event.respondWith(fetch(request).catch(function() {
+            return caches.match(request);
+        }));
+    }
+});
+
+// Background Sync, where the browser has it; pwa.js also asks when the page comes online
+self.addEventListener('sync', function(event) {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(replayQueue());
+    }
+});
+
+self.addEventListener('message', function(event) {
+    if (event.data && event.data.type === 'replay') {
+        event.waitUntil(replayQueue());
+    }
+});
+
+function matchesAny(patterns, path) {
+    return patterns.some(function(pattern) {
+        return pattern.test(path);
+    });
+}
+
+// ========== READS ==========
+// Fingerprinted assets never change under the same name
+async function cacheFirst(request) {
+    const cached = await caches.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(CACHE_NAME);
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function staleWhileRevalidate(event) {
+    const request = event.request;
+    const network = fetch(request).then(async function(response) {
+        if (isCacheable(response)) {
+            const cache = await caches.open(RUNTIME_CACHE);
+            await cache.put(request, response.clone());
+        }
+        return response;
+    });
+
+    const cached = await caches.match(request, {cacheName: RUNTIME_CACHE});
+    if (cached) {
+        event.waitUntil(network.catch(function() {}));
+        return cached;
+    }
+    try {
+        return await network;
+    } catch (error) {
+        return offlineResponse(request);
+    }
+}
+
+// Only pages and JSON, and never what a redirect led to: the login page, or a
+// page showing the flash message of the write before it
+function isCacheable(response) {
+    const type = response.headers.get('Content-Type') || '';
+    return response.ok && !response.redirected && response.type === 'basic' &&
+        (type.startsWith('text/html') || type.startsWith('application/json'));
+}
+
+async function offlineResponse(request) {
+    if (request.mode === 'navigate') {
+        const home = await caches.match('/');
+        if (home) {
+            return home;
+        }
+        return new Response('<h1>You are offline</h1><p>This page has not been opened on this device yet.</p>',
+            {status: 503, headers: {'Content-Type': 'text/html; charset=utf-8'}});
+    }
+    return new Response(JSON.stringify({success: false, offline: true}),
+        {status: 503, headers: {'Content-Type': 'application/json'}});
+}
+
+function clearRuntimeCache() {
+    return caches.delete(RUNTIME_CACHE);
+}
+
+// ========== OFFLINE WRITE QUEUE ==========
+async function sendOrQueue(request) {
+    const body = await request.clone().text();
+    const entry = {
+        url: request.url,
+        method: request.method,
+        contentType: request.headers.get('Content-Type') || '',
+        body: body,
+        key: request.headers.get('Idempotency-Key') || self.crypto.randomUUID(),
+        navigate: request.mode === 'navigate',
+        attempts: 0,
+        queuedAt: Date.now()
+    };
+
+    try {
+        const response = await fetch(entry.url, {
+            method: entry.method,
+            body: body,
+            headers: {'Content-Type': entry.contentType, 'Idempotency-Key': entry.key},
+            credentials: 'same-origin',
+            redirect: entry.navigate ? 'manual' : 'follow'
+        });
+        await clearRuntimeCache();
+        return response;
+    } catch (error) {
+        await queueRequest('readwrite', function(store) {
+            return store.add(entry);
+        });
+        if (self.registration.sync) {
+            await self.registration.sync.register(SYNC_TAG).catch(function() {});
+        }
+        await notifyQueue(0, false);
+        if (entry.navigate) {
+            // Back to the form's page (from the cache); pwa.js shows what is waiting
+            return Response.redirect(request.referrer || '/', 303);
+        }
+        return new Response(JSON.stringify({success: true, queued: true}),
+            {status: 202, headers: {'Content-Type': 'application/json'}});
+    }
+}
+
+let replaying = null;
+
+function replayQueue() {
+    if (!replaying) {
+        replaying = sendQueued().finally(function() {
+            replaying = null;
+        });
+    }
+    return replaying;
+}
+
+async function sendQueued() {
+    const entries = await queueRequest('readonly', function(store) {
+        return store.getAll();
+    });
+    let csrfToken = null;
+    let sent = 0;
+    let failed = 0;
+    let loginRequired = false;
+
+    for (const entry of entries) {
+        let body = entry.body;
+        if (entry.contentType.startsWith('application/x-www-form-urlencoded')) {
+            // The form's own token may have expired while it waited
+            const form = new URLSearchParams(body);
+            if (form.has('csrf_token')) {
+                csrfToken = csrfToken || await freshCsrfToken();
+                if (csrfToken === undefined) {
+                    break;
+                }
+                if (csrfToken === null) {
+                    loginRequired = true;
+                    break;
+                }
+                form.set('csrf_token', csrfToken);
+                body = form.toString();
+            }
+        }
+
+        let response;
+        try {
+            response = await fetch(entry.url, {
+                method: entry.method,
+                body: body,
+                headers: {'Content-Type': entry.contentType, 'Idempotency-Key': entry.key},
+                credentials: 'same-origin'
+            });
+        } catch (error) {
+            break;  // still offline
+        }
+        if (response.redirected && new URL(response.url).pathname === '/login') {
+            loginRequired = true;
+            break;
+        }
+        if (!response.redirected && response.status >= 500 && entry.attempts + 1 < MAX_ATTEMPTS) {
+            entry.attempts += 1;
+            await queueRequest('readwrite', function(store) {
+                return store.put(entry);
+            });
+            break;  // later writes may build on this one, so they wait to keep their order
+        }
+        await queueRequest('readwrite', function(store) {
+            return store.delete(entry.id);
+        });
+        if (isAccepted(entry, response)) {
+            sent += 1;
+        } else {
+            failed += 1;
+        }
+    }
+
+    if (sent) {
+        await clearRuntimeCache();
+    }
+    await notifyQueue(sent, loginRequired, failed);
+}
+
+// A form post succeeds with a redirect (a 200 is the form shown again with its
+// errors); other writes with a 2xx. A redirect past a write is never undone.
+function isAccepted(entry, response) {
+    if (entry.navigate) {
+        return response.redirected;
+    }
+    return response.redirected || response.ok;
+}
+
+// A token for the signed-in session; null when signed out, undefined when offline
+async function freshCsrfToken() {
+    try {
+        const response = await fetch('/api/csrf_token', {credentials: 'same-origin'});
+        if (response.redirected || !response.ok) {
+            return null;
+        }
+        return (await response.json()).csrf_token;
+    } catch (error) {
+        return undefined;
+    }
+}
+
+async function notifyQueue(sent, loginRequired, failed = 0) {
+    const pending = await queueRequest('readonly', function(store) {
+        return store.count();
+    });
+    const windows = await self.clients.matchAll({type: 'window', includeUncontrolled: true});
+    windows.forEach(function(client) {
+        client.postMessage({type: 'queue', pending: pending, sent: sent, failed: failed, loginRequired: loginRequired});
+    });
+}
+
+function queueRequest(mode, work) {
+    return new Promise(function(resolve, reject) {
+        const open = indexedDB.open(QUEUE_DB, 1);
+        open.onupgradeneeded = function() {
+            open.result.createObjectStore(QUEUE_STORE, {keyPath: 'id', autoIncrement: true});
+        };
+        open.onerror = function() {
+            reject(open.error);
+        };
+        open.onsuccess = function() {
+            const db = open.result;
+            const transaction = db.transaction(QUEUE_STORE, mode);
+            const request = work(transaction.objectStore(QUEUE_STORE));
+            transaction.oncomplete = function() {
+                db.close();
+                resolve(request.result);
+            };
+            transaction.onerror = function() {
+                db.close();
+                reject(transaction.error);
+            };
+        };
+    });
+}
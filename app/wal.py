@@ -0,0 +1,404 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import request
+from sqlalchemy import event
+from app import db
+from app.backups import backup_directory, database_path, integrity_check
+from app.db_profiles import journal_mode
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run a single worker
+    fcntl = None
+
+# SQLite WAL file layout (https://www.sqlite.org/fileformat.html#the_write_ahead_log)
+WAL_HEADER_BYTES = 32
+FRAME_HEADER_BYTES = 24
+# Pages copied per backup step when taking a base
+BASE_STEP_PAGES = 1024
+
+# ========== CONNECTION SETUP ==========
+def init_wal(app):
+    """With WAL_ARCHIVE on, leave checkpoints to the archiver and start it on the first request"""
+    if not app.config['WAL_ARCHIVE']:
+        return
+    with app.app_context():
+        if db.engine.url.get_backend_name() != 'sqlite' or db.engine.url.database in (None, '', ':memory:'):
+            return
+        if (journal_mode(app.config) or '').upper() != 'WAL':
+            app.logger.warning('WAL_ARCHIVE needs a WAL DB_PROFILE, not %r; archiving is off', app.config['DB_PROFILE'])
+            return
+        
+        @event.listens_for(db.engine, 'connect')
+        def _leave_checkpoints_to_archiver(dbapi_connection, connection_record):
+            # A checkpoint from any other connection could let SQLite reuse
+            # WAL frames before the archiver has shipped them
+            dbapi_connection.execute('PRAGMA wal_autocheckpoint=0')
+    
+    archiver = WalArchiver(app)
+    app.extensions['wal_archiver'] = archiver
+    
+    @app.before_request
+    def _start_wal_archiver():
+        if archiver.thread is None and request.endpoint != 'static':
+            archiver.start()
+
+# ========== WAL FILES ==========
+def read_wal_header(path):
+    """{'sequence', 'salts', 'page_size'} of a WAL file, or None when there is no WAL"""
+    try:
+        with open(path, 'rb') as handle:
+            header = handle.read(WAL_HEADER_BYTES)
+    except FileNotFoundError:
+        return None
+    if len(header) < WAL_HEADER_BYTES:
+        return None
+    _, _, page_size, sequence, salt1, salt2, _, _ = struct.unpack('>8I', header)
+    return {'sequence': sequence, 'salts': [salt1, salt2], 'page_size': page_size}
+
+def generation_id(header):
+    return '{:08x}{:08x}{:08x}'.format(header['sequence'], *header['salts'])
+
+def committed_frame_count(path, start_frame):
+    """Frames in the current WAL up to its last commit frame, scanning from `start_frame`.
+    
+    Frames are only trusted while their salts match the header: anything after
+    that is left over from an earlier generation. Frames past the last commit
+    belong to a rolled-back transaction and do not count. Only frame headers
+    are read, so this is cheap enough to run while holding the write lock.
+    """
+    with open(path, 'rb') as handle:
+        header = handle.read(WAL_HEADER_BYTES)
+        _, _, page_size, _, salt1, salt2, _, _ = struct.unpack('>8I', header)
+        frame_bytes = FRAME_HEADER_BYTES + page_size
+        frame = committed = start_frame
+        while True:
+            handle.seek(WAL_HEADER_BYTES + frame * frame_bytes)
+            frame_header = handle.read(FRAME_HEADER_BYTES)
+            if len(frame_header) < FRAME_HEADER_BYTES or len(handle.read(page_size)) < page_size:
+                break
+            _, commit_size, frame_salt1, frame_salt2 = struct.unpack('>4I', frame_header[:16])
+            if (frame_salt1, frame_salt2) != (salt1, salt2):
+                break
+            frame += 1
+            if commit_size:
+                committed = frame
+    return committed
+
+def read_frames(path, start_frame, end_frame):
+    """Raw frames `start_frame` up to (not including) `end_frame` of the current WAL"""
+    with open(path, 'rb') as handle:
+        header = handle.read(WAL_HEADER_BYTES)
+        page_size = struct.unpack('>8I', header)[2]
+        frame_bytes = FRAME_HEADER_BYTES + page_size
+        handle.seek(WAL_HEADER_BYTES + start_frame * frame_bytes)
+        raw = handle.read((end_frame - start_frame) * frame_bytes)
+    return [raw[i:i + frame_bytes] for i in range(0, len(raw), frame_bytes)]
+
+def apply_frames(handle, frames, page_size):
+    """Write WAL frames' page images into an open database file, then trim it to
+    the size recorded by the last commit"""
+    size = None
+    for frame in frames:
+        page_number, commit_size = struct.unpack('>2I', frame[:8])
+        handle.seek((page_number - 1) * page_size)
+        handle.write(frame[FRAME_HEADER_BYTES:])
+        if commit_size:
+            size = commit_size
+    if size is not None:
+        handle.truncate(size * page_size)
+
+# ========== ARCHIVE ==========
+# instance/backups/wal/ holds base snapshots (bases/), compressed WAL segments
+# (segments/<generation>/) and index.jsonl, one line per base or segment in the
+# order they were taken, which is all a restore needs to replay them.
+def archive_directory():
+    directory = os.path.join(backup_directory(), 'wal')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def read_index():
+    path = os.path.join(archive_directory(), 'index.jsonl')
+    if not os.path.exists(path):
+        return []
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+def _append_index(entry):
+    with open(os.path.join(archive_directory(), 'index.jsonl'), 'a') as handle:
+        handle.write(json.dumps(entry) + '\n')
+        handle.flush()
+        os.fsync(handle.fileno())
+
+def _now():
+    return datetime.utcnow().isoformat(timespec='microseconds') + 'Z'
+
+def load_state():
+    path = os.path.join(archive_directory(), 'state.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+def _save_state(state):
+    path = os.path.join(archive_directory(), 'state.json')
+    with open(f'{path}.tmp', 'w') as handle:
+        json.dump(state, handle)
+    os.replace(f'{path}.tmp', path)
+
+def continues_chain(state, header):
+    """Whether the WAL on disk carries on from where the archive stopped.
+    
+    Same salts: the same WAL, more frames appended. The next checkpoint
+    sequence with salt-1 one higher: SQLite restarted the WAL after our own
+    complete checkpoint. Anything else (no WAL, a WAL recreated after the
+    last connection closed and checkpointed on its way out, a skipped
+    generation) may hide frames the archive never saw.
+    """
+    if state is None or header is None:
+        return False
+    if header['sequence'] == state['sequence'] and header['salts'] == state['salts']:
+        return True
+    return (state['checkpointed'] and header['sequence'] == state['sequence'] + 1
+            and header['salts'][0] == (state['salts'][0] + 1) & 0xFFFFFFFF)
+
+@contextmanager
+def _write_locked(connection):
+    """Hold the database write lock for the block; other writers wait (busy timeout)"""
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    finally:
+        connection.execute('ROLLBACK')
+
+class WalArchiver:
+    """Ships committed WAL frames to the archive and checkpoints behind them.
+    
+    Each pass holds the database write lock just long enough to note how
+    far the committed frames go, then copies the frames committed since the
+    last pass into a segment with writers free to carry on: committed
+    frames never change until a checkpoint, and app connections never
+    checkpoint (wal_autocheckpoint=0). The pass then takes the lock again
+    for a PASSIVE checkpoint, skipped if anything was committed meanwhile,
+    so SQLite only recycles the WAL once the archive has every frame in it.
+    
+    When the chain cannot be continued (first run, or the WAL was replaced
+    while nobody was archiving) the pass takes a new base snapshot instead.
+    Only one process archives at a time; a lock file decides which.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.thread = None
+        self._lock_file = None
+        self._start_lock = threading.Lock()
+    
+    def _acquire_process_lock(self, directory):
+        handle = open(os.path.join(directory, 'archiver.lock'), 'w')
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+        self._lock_file = handle
+        return True
+    
+    def archive_once(self, force_base=False):
+        """One archiving pass; returns (frames shipped, whether a base was taken)"""
+        source = database_path()
+        wal_path = f'{source}-wal'
+        directory = archive_directory()
+        state = load_state()
+        
+        writer = sqlite3.connect(source, isolation_level=None, timeout=30)
+        reader = sqlite3.connect(source, isolation_level=None, timeout=30)
+        try:
+            writer.execute('PRAGMA wal_autocheckpoint=0')
+            reader.execute('PRAGMA wal_autocheckpoint=0')
+            with _write_locked(writer):
+                header = read_wal_header(wal_path)
+                chained = continues_chain(state, header)
+                start = state['frame'] if chained and header['salts'] == state['salts'] else 0
+                if header is not None:
+                    new_state = dict(header, frame=committed_frame_count(wal_path, start))
+                else:
+                    new_state = {'sequence': 0, 'salts': [0, 0], 'page_size': 0, 'frame': 0}
+                
+                base_at = state and state.get('base_at')
+                base_due = base_at is None or datetime.utcnow() - _parse_time(base_at) > \
+                    timedelta(hours=self.app.config['WAL_BASE_HOURS'])
+                took_base = force_base or base_due or not chained
+                if took_base:
+                    # A read transaction begun with writers locked out sees exactly up to
+                    # `frame`, and keeps seeing that while the base is copied from it
+                    reader.execute('BEGIN')
+                    reader.execute('SELECT count(*) FROM sqlite_master').fetchone()
+            
+            shipped = 0
+            if chained and new_state['frame'] > start:
+                self._write_segment(directory, header, start, read_frames(wal_path, start, new_state['frame']))
+                shipped = new_state['frame'] - start
+            if took_base:
+                try:
+                    base_at = self._write_base(directory, reader, new_state)
+                finally:
+                    reader.execute('ROLLBACK')
+            
+            checkpointed = False
+            with _write_locked(writer):
+                # Checkpoint only what the archive has: a commit since the first lock means
+                # frames not shipped yet, so the checkpoint waits for the next pass
+                if header is not None and read_wal_header(wal_path) == header and \
+                        committed_frame_count(wal_path, new_state['frame']) == new_state['frame']:
+                    busy, logged, copied = reader.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+                    checkpointed = busy == 0 and logged == copied
+            new_state.update(base_at=base_at, checkpointed=checkpointed)
+            _save_state(new_state)
+        finally:
+            reader.close()
+            writer.close()
+        
+        if took_base:
+            prune_archive(self.app.config['WAL_KEEP_BASES'])
+        return shipped, took_base
+    
+    def _write_segment(self, directory, header, start, frames):
+        raw = b''.join(frames)
+        generation = generation_id(header)
+        path = os.path.join(directory, 'segments', generation, f'{start:010d}-{start + len(frames):010d}.wal.z')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'wb') as handle:
+            handle.write(zlib.compress(raw, 6))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(f'{path}.tmp', path)
+        _append_index({
+            'kind': 'segment',
+            'at': _now(),
+            'generation': generation,
+            'frames': [start, start + len(frames)],
+            'page_size': header['page_size'],
+            'file': os.path.relpath(path, directory),
+            'sha256': hashlib.sha256(raw).hexdigest(),
+        })
+    
+    def _write_base(self, directory, connection, state):
+        name = f'base_{datetime.now():%Y%m%d_%H%M%S}_{os.urandom(2).hex()}.db'
+        path = os.path.join(directory, 'bases', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        target = sqlite3.connect(f'{path}.tmp')
+        try:
+            connection.backup(target, pages=BASE_STEP_PAGES)
+        finally:
+            target.close()
+        os.replace(f'{path}.tmp', path)
+        at = _now()
+        _append_index({
+            'kind': 'base',
+            'at': at,
+            'generation': generation_id(state),
+            'frames': [state['frame'], state['frame']],
+            'file': os.path.relpath(path, directory),
+        })
+        return at
+    
+    def run_forever(self):
+        config = self.app.config
+        with self.app.app_context():
+            directory = archive_directory()
+            # Another worker process may be the archiver; take over if it goes away
+            while not self._acquire_process_lock(directory):
+                time.sleep(config['WAL_ARCHIVE_SECONDS'])
+            while True:
+                try:
+                    self.archive_once()
+                except Exception:
+                    self.app.logger.exception('WAL archiving pass failed')
+                time.sleep(config['WAL_ARCHIVE_SECONDS'])
+    
+    def start(self):
+        with self._start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run_forever, name='wal-archiver', daemon=True)
+                self.thread.start()
+
+def prune_archive(keep_bases):
+    """Drop bases beyond the newest `keep_bases` and the segments only they needed"""
+    entries = read_index()
+    bases = [i for i, entry in enumerate(entries) if entry['kind'] == 'base']
+    if len(bases) <= keep_bases:
+        return 0
+    first_kept = bases[-keep_bases]
+    directory = archive_directory()
+    for entry in entries[:first_kept]:
+        path = os.path.join(directory, entry['file'])
+        if os.path.exists(path):
+            os.remove(path)
+    kept = entries[first_kept:]
+    path = os.path.join(directory, 'index.jsonl')
+    with open(f'{path}.tmp', 'w') as handle:
+        handle.writelines(json.dumps(entry) + '\n' for entry in kept)
+    os.replace(f'{path}.tmp', path)
+    segments = os.path.join(directory, 'segments')
+    for generation in os.listdir(segments) if os.path.isdir(segments) else ():
+        if not os.listdir(os.path.join(segments, generation)):
+            os.rmdir(os.path.join(segments, generation))
+    return first_kept
+
+# ========== RESTORE ==========
+def _parse_time(value):
+    return datetime.fromisoformat(value.rstrip('Z'))
+
+def recovery_window():
+    """(earliest, latest) times a restore can reach, or None without a base"""
+    entries = read_index()
+    bases = [entry for entry in entries if entry['kind'] == 'base']
+    if not bases:
+        return None
+    return _parse_time(bases[0]['at']), _parse_time(entries[-1]['at'])
+
+def restore_to(target, output):
+    """Rebuild the database as of `target` (UTC) into `output`.
+    
+    Starts from the newest base taken at or before `target` and replays the
+    segments archived after it, up to the last one archived at or before
+    `target`. Returns (base entry, segments applied, time reached, integrity).
+    """
+    entries = read_index()
+    directory = archive_directory()
+    start = max((i for i, entry in enumerate(entries)
+                 if entry['kind'] == 'base' and _parse_time(entry['at']) <= target), default=None)
+    if start is None:
+        raise ValueError('No base snapshot at or before that time')
+    base = entries[start]
+    
+    shutil.copyfile(os.path.join(directory, base['file']), output)
+    reached = _parse_time(base['at'])
+    applied = 0
+    with open(output, 'r+b') as handle:
+        for entry in entries[start + 1:]:
+            if _parse_time(entry['at']) > target:
+                break
+            if entry['kind'] != 'segment':
+                continue
+            with open(os.path.join(directory, entry['file']), 'rb') as segment:
+                raw = zlib.decompress(segment.read())
+            if hashlib.sha256(raw).hexdigest() != entry['sha256']:
+                raise ValueError(f"Segment {entry['file']} is corrupt")
+            frame_bytes = FRAME_HEADER_BYTES + entry['page_size']
+            frames = [raw[i:i + frame_bytes] for i in range(0, len(raw), frame_bytes)]
+            apply_frames(handle, frames, entry['page_size'])
+            reached = _parse_time(entry['at'])
+            applied += 1
+    
+    return base, applied, reached, integrity_check(output)
@@ -9,13 +9,49 @@ class Config:
     # Railway provides PORT environment variable
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///garage.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Run `flask migrate` once per deploy instead. Only for single-process setups
+    # (`python run.py`) that should build a fresh database on their own.
+    CREATE_SCHEMA_AT_BOOT = os.environ.get('CREATE_SCHEMA_AT_BOOT', '').lower() in ('1', 'true', 'yes')
+    
+    # Engine profile from app/db_profiles.py: SQLite PRAGMAs (journal mode, synchronous,
+    # busy timeout, cache) or pool sizing for server databases. `stock`, `durable`, `balanced`.
+    DB_PROFILE = os.environ.get('DB_PROFILE', 'balanced')
+    # Server databases only: override the profile's pool, and cap statement run time
+    DB_POOL_SIZE = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+    DB_MAX_OVERFLOW = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 30000))
+    
+    # Read replica for the views marked @read_replica (reports, exports, API reads).
+    # A replica server URL, or a second SQLite file the app copies the primary onto
+    # every REPLICA_SYNC_SECONDS (0: only `flask sync-replica`, e.g. from cron).
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    SQLALCHEMY_BINDS = {'replica': REPLICA_DATABASE_URL} if REPLICA_DATABASE_URL else {}
+    REPLICA_SYNC_SECONDS = float(os.environ.get('REPLICA_SYNC_SECONDS', 10))
+    # Without local syncing: how far the replica may trail. A user's own writes newer
+    # than this keep their reads on the primary.
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
     
     # Email configuration
     EMAIL_SERVER = os.environ.get('EMAIL_SERVER', 'smtp.gmail.com')
     EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
     EMAIL_USERNAME = os.environ.get('EMAIL_USERNAME')
     EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD')
-    EMAIL_USE_TLS = True
+    EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Background sender for the email_outbox table. Set EMAIL_WORKER=0 on all but one
+    # process (or run `flask send-outbox --loop` on its own) to keep one SMTP session.
+    # For a local SMTP stand-in: EMAIL_SERVER=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=0
+    EMAIL_WORKER = os.environ.get('EMAIL_WORKER', 'true').lower() in ('1', 'true', 'yes')
+    EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', 5))
+    EMAIL_RETRY_SECONDS = int(os.environ.get('EMAIL_RETRY_SECONDS', 30))
+    EMAIL_POLL_SECONDS = int(os.environ.get('EMAIL_POLL_SECONDS', 15))
+    EMAIL_IDLE_SECONDS = int(os.environ.get('EMAIL_IDLE_SECONDS', 60))
+    # Provider limits: messages per minute (0 = no limit) and per SMTP connection
+    EMAIL_RATE_PER_MINUTE = int(os.environ.get('EMAIL_RATE_PER_MINUTE', 60))
+    EMAIL_MESSAGES_PER_SESSION = int(os.environ.get('EMAIL_MESSAGES_PER_SESSION', 100))
+    
+    # Payment reminder campaigns render and queue this many statements per commit
+    CAMPAIGN_BATCH_SIZE = int(os.environ.get('CAMPAIGN_BATCH_SIZE', 25))
     
     # Garage details
     GARAGE_NAME = os.environ.get('GARAGE_NAME', 'THE CAR BUDDIES')
@@ -23,6 +59,72 @@ class Config:
     GARAGE_PHONE = os.environ.get('GARAGE_PHONE', '0789292789 / 0772576803')
     GARAGE_EMAIL = os.environ.get('GARAGE_EMAIL', 'happytayengwa702@gmail.com')
     
+    # Dashboard counters are cached per worker; commits in this worker clear them early
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 60))
+    
+    # /api/dashboard_stream: commits in this worker are pushed at once, those of other
+    # workers within DASHBOARD_STREAM_POLL_SECONDS. Streams end after MAX_SECONDS and
+    # the browser reconnects; BACKLOG deltas queue up for a slow client before it is dropped.
+    DASHBOARD_STREAM_POLL_SECONDS = float(os.environ.get('DASHBOARD_STREAM_POLL_SECONDS', 5))
+    DASHBOARD_STREAM_KEEPALIVE_SECONDS = float(os.environ.get('DASHBOARD_STREAM_KEEPALIVE_SECONDS', 15))
+    DASHBOARD_STREAM_MAX_SECONDS = float(os.environ.get('DASHBOARD_STREAM_MAX_SECONDS', 300))
+    DASHBOARD_STREAM_RETRY_SECONDS = float(os.environ.get('DASHBOARD_STREAM_RETRY_SECONDS', 5))
+    DASHBOARD_STREAM_BACKLOG = int(os.environ.get('DASHBOARD_STREAM_BACKLOG', 50))
+    # Each open stream holds a worker thread: past this many per worker the stream is
+    # refused (503) and the browser polls instead. Keep it well below GUNICORN_THREADS.
+    DASHBOARD_STREAM_MAX_CLIENTS = int(os.environ.get('DASHBOARD_STREAM_MAX_CLIENTS', 8))
+    
+    # List pages and their JSON counterparts (?per_page= is clamped to the max)
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+    PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', 200))
+    
+    # Typeahead index (/api/lookup) is per worker; reload it after this many seconds
+    # so cars and owners added through other workers appear
+    LOOKUP_INDEX_MAX_AGE = int(os.environ.get('LOOKUP_INDEX_MAX_AGE', 300))
+    
+    # Rendered quotations, invoices and receipts: an in-memory LRU per worker plus a
+    # shared directory (default instance/pdf_cache) trimmed oldest-first past its size
+    PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR')
+    PDF_CACHE_MEMORY_ITEMS = int(os.environ.get('PDF_CACHE_MEMORY_ITEMS', 32))
+    PDF_CACHE_DISK_MB = int(os.environ.get('PDF_CACHE_DISK_MB', 100))
+    
+    # Worker processes for month-end bulk PDF runs (default: one per CPU)
+    BULK_PDF_WORKERS = int(os.environ['BULK_PDF_WORKERS']) if os.environ.get('BULK_PDF_WORKERS') else None
+    
+    # Online SQLite backups (default instance/backups): pages copied per step of the
+    # sqlite3 backup API, and the pause between steps that lets writers in.
+    BACKUP_DIR = os.environ.get('BACKUP_DIR')
+    BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+    BACKUP_STEP_SLEEP = float(os.environ.get('BACKUP_STEP_SLEEP', 0.005))
+    # Writes restart a stepped copy; past this many restarts the rest is copied in one go
+    BACKUP_MAX_RESTARTS = int(os.environ.get('BACKUP_MAX_RESTARTS', 3))
+    
+    # Full backups go to a deduplicated store: files are cut into chunks (keep this a
+    # multiple of the SQLite page size) and compressed on a thread pool
+    BACKUP_CHUNK_KB = int(os.environ.get('BACKUP_CHUNK_KB', 256))
+    BACKUP_COMPRESS_WORKERS = int(os.environ.get('BACKUP_COMPRESS_WORKERS', 4))
+    
+    # Grandfather-father-son retention: newest backup per day, ISO week and month
+    BACKUP_KEEP_DAILY = int(os.environ.get('BACKUP_KEEP_DAILY', 7))
+    BACKUP_KEEP_WEEKLY = int(os.environ.get('BACKUP_KEEP_WEEKLY', 4))
+    BACKUP_KEEP_MONTHLY = int(os.environ.get('BACKUP_KEEP_MONTHLY', 12))
+    
+    # With WAL_ARCHIVE on (needs a WAL profile, see DB_PROFILE), committed WAL frames are
+    # shipped to instance/backups/wal every WAL_ARCHIVE_SECONDS for point-in-time restores
+    # (`flask restore-wal`), on top of a base snapshot every WAL_BASE_HOURS.
+    WAL_ARCHIVE = os.environ.get('WAL_ARCHIVE', '').lower() in ('1', 'true', 'yes')
+    WAL_ARCHIVE_SECONDS = float(os.environ.get('WAL_ARCHIVE_SECONDS', 30))
+    WAL_BASE_HOURS = float(os.environ.get('WAL_BASE_HOURS', 24))
+    # Bases kept, with the segments that replay on top of them
+    WAL_KEEP_BASES = int(os.environ.get('WAL_KEEP_BASES', 7))
+    
+    # Writes replayed by the service worker's offline queue carry an Idempotency-Key;
+    # the first response is kept this long and returned again for repeats
+    IDEMPOTENCY_KEY_HOURS = float(os.environ.get('IDEMPOTENCY_KEY_HOURS', 72))
+    
+    # Warn when a list page issues more SQL statements than its budget in routes.py
+    ENFORCE_STATEMENT_BUDGETS = os.environ.get('ENFORCE_STATEMENT_BUDGETS', '').lower() in ('1', 'true', 'yes')
+    
     # Currency
     CURRENCY = 'ZAR'
     CURRENCY_SYMBOL = 'R'
\ No newline at end of file
@@ -0,0 +1,29 @@
+import gc
+import os
+
+# Picked up by `gunicorn wsgi:application` from the project directory.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+# Threads, so an open dashboard stream (/api/dashboard_stream, up to
+# DASHBOARD_STREAM_MAX_SECONDS each) only ties up one thread, not a worker.
+# At most DASHBOARD_STREAM_MAX_CLIENTS threads per worker go to streams.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+# Build the app once in the master and fork the workers from it, so they share
+# its imported modules copy-on-write instead of each importing them again.
+# Run `flask migrate` before starting: workers no longer create the schema.
+# Run `flask build-assets` too, or static files go out unminified under plain names.
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+def on_starting(server):
+    if preload_app:
+        # Rendering modules load lazily everywhere else; preloaded here they are paid
+        # for once instead of on every worker's first PDF
+        import app.pdfs  # noqa: F401
+
+def pre_fork(server, worker):
+    # Keep the garbage collector from touching (and so copying) the shared objects
+    gc.freeze()
@@ -0,0 +1,81 @@
+-- Schema as built by the baseline models (before the owner_balance ledger,
+-- stored job totals and updated_at), for the upgrade test in test_migrations.py
+CREATE TABLE user (
+    id INTEGER NOT NULL,
+    username VARCHAR(64) NOT NULL,
+    email VARCHAR(120) NOT NULL,
+    password_hash VARCHAR(256),
+    created_at DATETIME,
+    is_active BOOLEAN,
+    PRIMARY KEY (id),
+    UNIQUE (username),
+    UNIQUE (email)
+);
+CREATE TABLE car_owner (
+    id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    phone VARCHAR(20) NOT NULL,
+    email VARCHAR(120),
+    address TEXT,
+    created_at DATETIME,
+    PRIMARY KEY (id)
+);
+CREATE TABLE service_category (
+    id INTEGER NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    description TEXT,
+    base_price FLOAT,
+    is_active BOOLEAN,
+    created_at DATETIME,
+    PRIMARY KEY (id)
+);
+CREATE TABLE car (
+    id INTEGER NOT NULL,
+    license_plate VARCHAR(20) NOT NULL,
+    make VARCHAR(50) NOT NULL,
+    model VARCHAR(50) NOT NULL,
+    year INTEGER,
+    color VARCHAR(30),
+    vin VARCHAR(50),
+    created_at DATETIME,
+    owner_id INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (license_plate),
+    FOREIGN KEY(owner_id) REFERENCES car_owner (id)
+);
+CREATE TABLE service_job (
+    id INTEGER NOT NULL,
+    date_in DATE NOT NULL,
+    date_out DATE,
+    mileage_in INTEGER NOT NULL,
+    mileage_out INTEGER,
+    status VARCHAR(20),
+    notes TEXT,
+    created_at DATETIME,
+    car_id INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(car_id) REFERENCES car (id)
+);
+CREATE TABLE service_item (
+    id INTEGER NOT NULL,
+    description VARCHAR(200) NOT NULL,
+    cost FLOAT NOT NULL,
+    is_fixed BOOLEAN,
+    created_at DATETIME,
+    service_job_id INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(service_job_id) REFERENCES service_job (id)
+);
+CREATE TABLE "transaction" (
+    id INTEGER NOT NULL,
+    amount FLOAT NOT NULL,
+    transaction_type VARCHAR(20) NOT NULL,
+    description VARCHAR(200),
+    date DATE NOT NULL,
+    created_at DATETIME,
+    owner_id INTEGER NOT NULL,
+    service_job_id INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(owner_id) REFERENCES car_owner (id),
+    FOREIGN KEY(service_job_id) REFERENCES service_job (id)
+);
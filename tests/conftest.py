@@ -0,0 +1,92 @@
+import os
+from datetime import date
+import pytest
+
+# Read when config.py is imported: no background email sender or read replica in tests
+os.environ['EMAIL_WORKER'] = '0'
+os.environ['REPLICA_DATABASE_URL'] = ''
+from app import create_app, db
+from app.cache import stats_cache
+from app.lookup import lookup_index
+from app.migrations import prepare_schema
+from app.models import User, CarOwner, Car, ServiceJob, ServiceItem, Transaction
+from config import Config
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """Build an app on a fresh SQLite file under tmp_path; config overrides as keywords"""
+    apps = []
+    
+    def make(database=None, migrate=True, **config):
+        database = database or tmp_path / 'garage.db'
+        monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{database}')
+        monkeypatch.setattr(Config, 'PDF_CACHE_DIR', str(tmp_path / 'pdf_cache'))
+        for name, value in config.items():
+            monkeypatch.setattr(Config, name, value, raising=False)
+        
+        # Process-wide state from an earlier test's database
+        lookup_index.loaded_at = None
+        stats_cache.invalidate()
+        
+        app = create_app()
+        app.config['TESTING'] = True
+        if migrate:
+            with app.app_context():
+                prepare_schema()
+        apps.append(app)
+        return app
+    
+    yield make
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+@pytest.fixture
+def user(app):
+    with app.app_context():
+        user = User(username='tester', email='tester@example.com')
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+@pytest.fixture
+def client(app, user):
+    """A test client signed in as `user`"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user)
+        session['_fresh'] = True
+    return client
+
+@pytest.fixture
+def seed(app):
+    """seed(count): `count` more owners, each with a car, a job with two items, an invoice and a payment"""
+    def seed_rows(count):
+        with app.app_context():
+            _seed(count)
+    return seed_rows
+
+def _seed(count):
+    start = CarOwner.query.count()
+    for n in range(start, start + count):
+        owner = CarOwner(name=f'Owner {n}', phone=f'0770{n:06d}', email=f'owner{n}@example.com')
+        car = Car(license_plate=f'TST{n:04d}', make='Toyota', model='Corolla', year=2015, owner=owner)
+        job = ServiceJob(car=car, date_in=date(2024, 1, 1), date_out=date(2024, 1, 2), mileage_in=1000,
+                         mileage_out=1010, status='in_progress' if n % 2 else 'completed')
+        db.session.add_all([owner, car, job])
+        db.session.flush()
+        db.session.add_all([
+            ServiceItem(service_job=job, description='Oil change', cost=300.0, is_fixed=True),
+            ServiceItem(service_job=job, description='Brake pads', cost=800.0, is_fixed=False),
+            Transaction(owner=owner, service_job_id=job.id, amount=1100.0, transaction_type='invoice',
+                        description='Invoice', date=date.today()),
+            Transaction(owner=owner, amount=500.0, transaction_type='payment',
+                        description='Payment', date=date.today()),
+        ])
+    db.session.commit()
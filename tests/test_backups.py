@@ -0,0 +1,29 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from app.backups import BackupStore
+
+def age(store, digests, seconds):
+    for digest in digests:
+        path = store.object_path(digest)
+        os.utime(path, (os.path.getmtime(path) - seconds,) * 2)
+
+def test_chunks_reused_by_a_backup_in_progress_survive_garbage_collection(tmp_path):
+    store = BackupStore(str(tmp_path / 'store'), chunk_bytes=4)
+    data = tmp_path / 'garage.db'
+    data.write_bytes(b'pagepagepage')
+    with ThreadPoolExecutor(2) as executor:
+        old = store.add_file(str(data), 'garage.db', executor)
+        age(store, old['chunks'], 7200)
+        
+        # A new snapshot dedups into the old chunks, both by content and via the previous manifest,
+        # while the old snapshot's manifest is pruned before the new one is written
+        fresh = store.add_file(str(data), 'copy.db', executor)
+        age(store, old['chunks'], 7200)
+        reused = store.add_file(str(data), 'garage.db', executor, previous={'files': [old]})
+    assert fresh['chunks'] == old['chunks'] and reused is old
+    
+    assert store.collect_garbage([]) == 0
+    assert b''.join(store.read_chunks(old)) == b'pagepagepage'
+    
+    age(store, old['chunks'], 7200)
+    assert store.collect_garbage([]) > 0
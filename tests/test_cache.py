@@ -0,0 +1,28 @@
+from app import db
+from app.cache import SnapshotCache
+from app.models import ServiceItem
+from app.utils import dashboard_snapshot
+
+def recent_item_count(job_id):
+    return next(job['item_count'] for job in dashboard_snapshot()['recent_jobs'] if job['id'] == job_id)
+
+def test_service_item_commit_refreshes_recent_jobs(app, seed):
+    seed(1)
+    with app.app_context():
+        assert recent_item_count(1) == 2
+        db.session.add(ServiceItem(service_job_id=1, description='Wiper blades', cost=120.0))
+        db.session.commit()
+        assert recent_item_count(1) == 3
+
+def test_value_computed_across_an_invalidation_is_not_stored():
+    cache = SnapshotCache()
+    
+    def compute():
+        # A commit lands while the old value is being computed
+        cache.invalidate('totals')
+        return 'stale'
+    
+    assert cache.get_or_compute('totals', compute, ttl=60) == 'stale'
+    assert cache.get('totals') is None
+    assert cache.get_or_compute('totals', lambda: 'fresh', ttl=60) == 'fresh'
+    assert cache.get('totals') == 'fresh'
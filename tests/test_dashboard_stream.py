@@ -0,0 +1,40 @@
+from app import db
+from app.dashboard_stream import snapshot_delta
+from app.models import ServiceJob
+from app.utils import dashboard_snapshot
+
+def test_delta_sends_whole_recent_lists(app, seed):
+    seed(3)
+    with app.app_context():
+        before = dashboard_snapshot(fresh=True)
+        job = db.session.get(ServiceJob, 3)
+        db.session.delete(job)
+        db.session.commit()
+        after = dashboard_snapshot(fresh=True)
+    
+    delta = snapshot_delta(before, after)
+    
+    assert [job['id'] for job in delta['recent_jobs']] == [2, 1]
+    assert delta['completed_jobs'] == before['completed_jobs'] - 1
+    assert 'total_cars' not in delta
+    assert 'recent_transactions' not in delta
+
+def test_streams_beyond_the_limit_are_refused(make_app, user):
+    app = make_app(DASHBOARD_STREAM_MAX_CLIENTS=1)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user)
+    
+    first = client.get('/api/dashboard_stream', buffered=False)
+    assert first.status_code == 200
+    assert next(first.response).startswith(b'retry:')
+    
+    refused = client.get('/api/dashboard_stream')
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == '60'
+    
+    # Closing the first stream frees its slot
+    first.close()
+    second = client.get('/api/dashboard_stream', buffered=False)
+    assert second.status_code == 200
+    second.close()
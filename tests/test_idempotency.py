@@ -0,0 +1,39 @@
+from app import db
+from app.models import IdempotencyKey, ServiceItem
+
+def add_item(client, csrf_token, key='offline-write-1'):
+    return client.post('/jobs/1/add_service', headers={'Idempotency-Key': key}, data={
+        'csrf_token': csrf_token, 'description': 'Wheel alignment', 'cost': '450.00'})
+
+def csrf_token(client):
+    return client.get('/api/csrf_token').get_json()['csrf_token']
+
+def item_count(app):
+    with app.app_context():
+        return ServiceItem.query.filter_by(description='Wheel alignment').count()
+
+def test_repeated_key_writes_once(app, client, seed):
+    seed(1)
+    token = csrf_token(client)
+    
+    first = add_item(client, token)
+    repeat = add_item(client, token)
+    
+    assert first.status_code == repeat.status_code == 302
+    assert 'Idempotent-Replayed' not in first.headers
+    assert repeat.headers['Idempotent-Replayed'] == 'true'
+    assert item_count(app) == 1
+
+def test_failed_attempt_does_not_keep_the_key(app, client, seed):
+    """A write that never committed (here, a stale CSRF token) must run again on retry"""
+    seed(1)
+    
+    rejected = add_item(client, 'expired-token')
+    assert rejected.status_code == 302
+    assert item_count(app) == 0
+    with app.app_context():
+        assert db.session.get(IdempotencyKey, ('offline-write-1', 1)) is None
+    
+    retried = add_item(client, csrf_token(client))
+    assert 'Idempotent-Replayed' not in retried.headers
+    assert item_count(app) == 1
@@ -0,0 +1,35 @@
+import sqlite3
+from app.lookup import lookup_index
+from app.models import Car
+
+def test_picker_accepts_an_owner_the_index_has_not_seen(app, client, seed):
+    seed(1)
+    client.get('/api/lookup?q=owner')
+    assert lookup_index.loaded_at is not None
+    
+    # Added through another worker process: this one's index does not know it
+    connection = sqlite3.connect(app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):])
+    owner_id = connection.execute(
+        "INSERT INTO car_owner (name, phone, created_at) VALUES ('Sipho Dube', '0712223333', '2024-05-01 08:00:00')"
+    ).lastrowid
+    connection.commit()
+    connection.close()
+    assert lookup_index.get('owner', owner_id) is None
+    
+    app.config['WTF_CSRF_ENABLED'] = False
+    response = client.post('/cars/add', data={
+        'license_plate': 'new123', 'make': 'Mazda', 'model': 'BT-50', 'owner_id': owner_id})
+    
+    assert response.status_code == 302
+    with app.app_context():
+        assert Car.query.filter_by(license_plate='NEW123').one().owner_id == owner_id
+    assert lookup_index.get('owner', owner_id) == ('Sipho Dube', '0712223333')
+
+def test_picker_rejects_an_owner_that_does_not_exist(app, client, seed):
+    seed(1)
+    app.config['WTF_CSRF_ENABLED'] = False
+    response = client.post('/cars/add', data={
+        'license_plate': 'new123', 'make': 'Mazda', 'model': 'BT-50', 'owner_id': 999})
+    
+    assert response.status_code == 200
+    assert b'Not a valid choice' in response.data
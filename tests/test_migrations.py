@@ -0,0 +1,54 @@
+import os
+import sqlite3
+from sqlalchemy import inspect
+from app import db
+from app.migrations import REVISIONS, prepare_schema, unapplied_revisions
+from app.models import OwnerBalance, ServiceJob, Transaction
+
+BASELINE_SCHEMA = os.path.join(os.path.dirname(__file__), 'baseline_schema.sql')
+
+def build_baseline_database(path):
+    """A database as the baseline code left it, with one owner, car, job, item and invoice"""
+    connection = sqlite3.connect(path)
+    with open(BASELINE_SCHEMA) as handle:
+        connection.executescript(handle.read())
+    connection.executescript('''
+        INSERT INTO car_owner (id, name, phone, created_at) VALUES (1, 'Thandi', '0771234567', '2024-01-01 08:00:00');
+        INSERT INTO car (id, license_plate, make, model, owner_id, created_at) VALUES (1, 'ABC123', 'Toyota', 'Hilux', 1, '2024-01-01 08:00:00');
+        INSERT INTO service_job (id, date_in, mileage_in, status, car_id, created_at) VALUES (1, '2024-01-02', 1000, 'in_progress', 1, '2024-01-02 08:00:00');
+        INSERT INTO service_item (id, description, cost, is_fixed, service_job_id, created_at) VALUES (1, 'Oil change', 300, 1, 1, '2024-01-02 09:00:00');
+        INSERT INTO service_item (id, description, cost, is_fixed, service_job_id, created_at) VALUES (2, 'Brake pads', 800, 0, 1, '2024-01-02 09:00:00');
+        INSERT INTO "transaction" (id, amount, transaction_type, date, owner_id, created_at) VALUES (1, 1100, 'invoice', '2024-01-02', 1, '2024-01-02 10:00:00');
+        INSERT INTO "transaction" (id, amount, transaction_type, date, owner_id, created_at) VALUES (2, 400, 'payment', '2024-01-03', 1, '2024-01-03 10:00:00');
+    ''')
+    connection.commit()
+    connection.close()
+
+def test_migrate_upgrades_a_baseline_database(make_app, tmp_path):
+    database = tmp_path / 'baseline.db'
+    build_baseline_database(database)
+    
+    app = make_app(database)
+    
+    with app.app_context():
+        assert unapplied_revisions() == []
+        columns = {column['name'] for column in inspect(db.engine).get_columns('transaction')}
+        assert 'updated_at' in columns
+        
+        ledger = db.session.get(OwnerBalance, 1)
+        assert (ledger.total_invoiced, ledger.total_paid, ledger.balance) == (1100.0, 400.0, 700.0)
+        
+        job = db.session.get(ServiceJob, 1)
+        assert (job.total_cost, job.quoted_cost, job.item_count) == (300.0, 1100.0, 2)
+        assert all(transaction.updated_at for transaction in Transaction.query)
+
+def test_migrate_is_idempotent(make_app, tmp_path):
+    database = tmp_path / 'baseline.db'
+    build_baseline_database(database)
+    make_app(database)
+    
+    # Running it again (the next deploy) applies nothing
+    app = make_app(database)
+    with app.app_context():
+        assert prepare_schema() == []
+        assert len(REVISIONS) == db.session.execute(db.text('SELECT count(*) FROM schema_migration')).scalar()
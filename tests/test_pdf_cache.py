@@ -0,0 +1,21 @@
+import os
+from app.pdf_cache import pdf_cache, send_pdf
+
+DOCUMENT = b'%PDF-1.4 test document'
+
+def test_pdf_removed_before_it_is_opened_is_still_served(app, monkeypatch):
+    ensure = pdf_cache.ensure
+    
+    def ensure_then_evict(key, render, tags=()):
+        # Another worker trims the cache between ensure() and send_file()
+        path = ensure(key, render, tags)
+        os.remove(path)
+        return path
+    
+    monkeypatch.setattr(pdf_cache, 'ensure', ensure_then_evict)
+    with app.test_request_context():
+        response = send_pdf(('evicted', lambda: DOCUMENT, ()), 'quotation.pdf')
+        response.direct_passthrough = False
+        assert response.status_code == 200
+        assert response.get_data() == DOCUMENT
+        assert response.headers['ETag'] == '"evicted"'
@@ -0,0 +1,48 @@
+from datetime import date, datetime
+from app import db
+from app.campaigns import create_campaign, prepare_campaign
+from app.mailer import due_emails
+from app.query_plans import recording_hot_queries, table_scans
+
+# Pages (and a write) that run every query tagged with hot_query(); second
+# pages come from ?per_page=2 and the cursor of the first
+REQUESTS = [
+    ('GET', '/payments', None),
+    ('GET', '/api/payments?per_page=2', None),
+    ('GET', '/jobs?status=in_progress', None),
+    ('GET', '/api/jobs?status=in_progress&per_page=2', None),
+    ('GET', '/reports/recent_payments', None),
+    ('GET', '/reports/active_jobs', None),
+    ('GET', '/cars/2', None),
+    ('GET', '/car_owners/2/statement?start=2000-01-01', None),
+    ('GET', '/reminders/1?per_page=2', None),
+    ('POST', '/jobs/2/add_service', {'description': 'Wheel alignment', 'cost': '450.00'}),
+]
+
+HOT_QUERIES = {'payments list', 'jobs by status', 'recent payments report', 'car service history',
+               'owner statement', 'campaign recipients', 'job totals', 'due emails'}
+
+def test_hot_queries_use_indexes(app, client, seed):
+    seed(6)
+    with app.app_context():
+        campaign = create_campaign(0, date(2000, 1, 1), date.today())
+        prepare_campaign(campaign.id)
+        engine = db.engine
+    csrf_token = client.get('/api/csrf_token').get_json()['csrf_token']
+    
+    with recording_hot_queries(engine) as recorded:
+        for method, url, data in REQUESTS:
+            response = client.open(url, method=method, data=data and dict(data, csrf_token=csrf_token))
+            assert response.status_code in (200, 302), url
+            cursor = response.is_json and response.get_json().get('next_cursor')
+            if cursor:
+                assert client.get(f'{url}&cursor={cursor}').status_code == 200
+        with app.app_context():
+            due_emails(datetime.utcnow()).limit(20).all()
+    
+    assert {name for name, _, _ in recorded} == HOT_QUERIES
+    tables = set(db.metadata.tables)
+    with engine.connect() as connection:
+        regressions = [(name, scan) for name, statement, parameters in recorded
+                       for scan in table_scans(connection, statement, parameters, tables)]
+    assert regressions == []
@@ -0,0 +1,104 @@
+from contextlib import contextmanager
+from datetime import date
+import pytest
+from sqlalchemy import event
+from app import db
+from app.cache import stats_cache
+from app.campaigns import create_campaign, prepare_campaign
+from app.lookup import warm_lookup_index
+from app.models import CampaignRecipient
+from app.routes import STATEMENT_BUDGETS
+
+# One request per budgeted endpoint: (method, url, form data); {campaign_id} is
+# the campaign seeded for the pass
+PAGES = {
+    'main.dashboard': ('GET', '/dashboard', None),
+    'main.car_owners': ('GET', '/car_owners', None),
+    'main.cars': ('GET', '/cars', None),
+    'main.jobs': ('GET', '/jobs', None),
+    'main.payments': ('GET', '/payments', None),
+    'main.search': ('POST', '/search', {'search_query': 'owner', 'search_type': 'owner_name'}),
+    'main.api_search': ('GET', '/api/search?q=owner', None),
+    'main.report_outstanding_balances': ('GET', '/reports/outstanding_balances', None),
+    'main.report_recent_payments': ('GET', '/reports/recent_payments', None),
+    'main.report_active_jobs': ('GET', '/reports/active_jobs', None),
+    'main.report_service_history': ('GET', '/reports/service_history', None),
+    'main.generate_report': ('GET', '/reports/unknown', None),
+    'main.api_jobs': ('GET', '/api/jobs', None),
+    'main.api_cars': ('GET', '/api/cars', None),
+    'main.api_car_owners': ('GET', '/api/car_owners', None),
+    'main.api_payments': ('GET', '/api/payments', None),
+    'main.api_lookup': ('GET', '/api/lookup?q=owner&balance=1', None),
+    'main.owner_statement': ('GET', '/car_owners/1/statement?start=2000-01-01', None),
+    'main.email_outbox': ('GET', '/email/outbox', None),
+    'main.reminder_campaigns': ('GET', '/reminders', None),
+    'main.reminder_campaign': ('GET', '/reminders/{campaign_id}', None),
+}
+
+# Pages that answer with a redirect
+REDIRECTS = {'main.generate_report'}
+
+# Rows per list page: both below PAGE_SIZE, so every seeded row is rendered
+FEW, MANY = 3, 30
+
+@contextmanager
+def counting_statements(app):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+    
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+def statement_counts(app, client, campaign_id):
+    """SQL statements issued by each page, with the dashboard cache cold and the lookup index warm"""
+    csrf_token = client.get('/api/csrf_token').get_json()['csrf_token']
+    counts = {}
+    for endpoint, (method, url, data) in PAGES.items():
+        if data is not None:
+            data = dict(data, csrf_token=csrf_token)
+        stats_cache.invalidate()
+        with app.app_context():
+            warm_lookup_index()
+        with counting_statements(app) as statements:
+            response = client.open(url.format(campaign_id=campaign_id), method=method, data=data)
+        assert response.status_code == (302 if endpoint in REDIRECTS else 200), endpoint
+        counts[endpoint] = len(statements)
+    return counts
+
+def seed_campaign(app):
+    with app.app_context():
+        campaign = create_campaign(0, date(2000, 1, 1), date.today())
+        prepare_campaign(campaign.id)
+        return campaign.id
+
+@pytest.fixture
+def budget_app(make_app):
+    return make_app(ENFORCE_STATEMENT_BUDGETS=True)
+
+def test_every_budget_has_a_page():
+    assert set(PAGES) == set(STATEMENT_BUDGETS)
+
+def test_statement_counts_do_not_grow_with_rows(budget_app, user, seed):
+    client = budget_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user)
+    
+    seed(FEW)
+    few = statement_counts(budget_app, client, seed_campaign(budget_app))
+    
+    seed(MANY - FEW)
+    campaign_id = seed_campaign(budget_app)
+    with budget_app.app_context():
+        assert CampaignRecipient.query.filter_by(campaign_id=campaign_id).count() == MANY
+    many = statement_counts(budget_app, client, campaign_id)
+    
+    for endpoint, budget in STATEMENT_BUDGETS.items():
+        assert few[endpoint] <= budget, f'{endpoint}: {few[endpoint]} statements, budget is {budget}'
+        assert many[endpoint] == few[endpoint], f'{endpoint}: {few[endpoint]} statements for {FEW} rows, {many[endpoint]} for {MANY}'
@@ -0,0 +1,46 @@
+import sqlite3
+from datetime import datetime, timedelta
+from app import db
+from app.backups import database_path
+from app.models import CarOwner
+from app.wal import WalArchiver, restore_to
+
+def test_writers_are_not_held_up_by_an_archiving_pass(make_app, seed, tmp_path, monkeypatch):
+    app = make_app(DB_PROFILE='balanced', WAL_ARCHIVE=True, BACKUP_DIR=str(tmp_path / 'backups'))
+    seed(3)
+    archiver = WalArchiver(app)
+    written = []
+    
+    def write_meanwhile(original):
+        def wrapped(self, directory, *args):
+            if original.__name__ in written:
+                return original(self, directory, *args)
+            # Fails with "database is locked" if the pass still holds the write lock
+            connection = sqlite3.connect(database_path(), isolation_level=None, timeout=0)
+            try:
+                connection.execute("INSERT INTO car_owner (name, phone, email) VALUES (?, '0770999999', 'late@example.com')",
+                                   (f'Late {len(written)}',))
+                written.append(original.__name__)
+            finally:
+                connection.close()
+            return original(self, directory, *args)
+        return wrapped
+    
+    monkeypatch.setattr(WalArchiver, '_write_base', write_meanwhile(WalArchiver._write_base))
+    monkeypatch.setattr(WalArchiver, '_write_segment', write_meanwhile(WalArchiver._write_segment))
+    with app.app_context():
+        assert archiver.archive_once() == (0, True)
+        # The owner written during the base is not in it: the next pass ships it
+        shipped, took_base = archiver.archive_once()
+        assert shipped and not took_base
+        assert written == ['_write_base', '_write_segment']
+        assert archiver.archive_once() == (1, False)
+        
+        output = tmp_path / 'restored.db'
+        restore_to(datetime.utcnow() + timedelta(minutes=1), str(output))
+        expected = sorted(owner.name for owner in CarOwner.query)
+        db.session.remove()
+    restored = sqlite3.connect(output)
+    assert sorted(name for name, in restored.execute('SELECT name FROM car_owner')) == expected
+    assert len(expected) == 5
+    restored.close()